@@ -0,0 +1,88 @@
+"""
+Measure how many messages per second a Thoonk listener can handle.
+
+Three numbers are reported:
+
+    parse -- Messages fed straight to the listener's message handler,
+             measuring only the cost of parsing and emitting events.
+    frame -- The same, with binary framed messages carrying items of
+             SIZE bytes.
+    redis -- Items published through Redis and received by a listening
+             Thoonk instance.
+
+Usage: python examples/bench_listener.py [-n MESSAGES] [-f FEEDS] [-s SIZE]
+"""
+
+import optparse
+import threading
+import time
+
+import thoonk
+from thoonk.notify import frame
+
+
+def bench_parse(ps, feeds, count):
+    channels = ['feed.publish:bench%s' % i for i in range(feeds)]
+    handle = ps.listener._handle_message
+    start = time.time()
+    for i in xrange(count):
+        handle(channels[i % feeds], '%s\x00item' % i)
+    return count / (time.time() - start)
+
+
+def bench_frame(ps, feeds, count, size):
+    channels = ['feed.publish:bench%s' % i for i in range(feeds)]
+    messages = [frame((i, 'x' * size)) for i in range(feeds)]
+    for i in range(feeds):
+        ps.listener._formats['bench%s' % i] = ('', 'binary')
+    handle = ps.listener._handle_message
+    start = time.time()
+    for i in xrange(count):
+        handle(channels[i % feeds], messages[i % feeds])
+    return count / (time.time() - start)
+
+
+def bench_redis(ps, feeds, count):
+    received = [0]
+    done = threading.Event()
+
+    def handler(feed, item, id):
+        received[0] += 1
+        if received[0] == count:
+            done.set()
+
+    ps.register_handler('publish', handler)
+    names = ['bench%s' % i for i in range(feeds)]
+    pipe = ps.redis.pipeline(transaction=False)
+    start = time.time()
+    for i in xrange(count):
+        pipe.publish('feed.publish:' + names[i % feeds], '%s\x00item' % i)
+        if i % 1000 == 999:
+            pipe.execute()
+    pipe.execute()
+    done.wait(60)
+    elapsed = time.time() - start
+    ps.remove_handler('publish', handler)
+    return received[0] / elapsed
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('-n', dest='count', type='int', default=100000,
+                      help='number of messages to send')
+    parser.add_option('-f', dest='feeds', type='int', default=100,
+                      help='number of feeds to spread messages over')
+    parser.add_option('-s', dest='size', type='int', default=1024,
+                      help='size of framed items in bytes')
+    opts, args = parser.parse_args()
+
+    ps = thoonk.Thoonk(listen=True, listen_patterns=True)
+    try:
+        ps.register_handler('publish', lambda feed, item, id: None)
+        print 'parse: %d msgs/sec' % bench_parse(ps, opts.feeds, opts.count)
+        print 'frame: %d msgs/sec' % bench_frame(ps, opts.feeds, opts.count,
+                                                 opts.size)
+        ps.listener._formats.clear()
+        print 'redis: %d msgs/sec' % bench_redis(ps, opts.feeds, opts.count)
+    finally:
+        ps.close()
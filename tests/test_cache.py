@@ -0,0 +1,73 @@
+import thoonk
+from thoonk.exceptions import FeedDoesNotExist
+import unittest
+import threading
+import time
+from ConfigParser import ConfigParser
+
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        conf = ConfigParser()
+        conf.read('test.cfg')
+        if conf.sections() == ['Test']:
+            self.ps = thoonk.Thoonk(host=conf.get('Test', 'host'),
+                                    port=conf.getint('Test', 'port'),
+                                    db=conf.getint('Test', 'db'),
+                                    feed_cache_size=3)
+            self.ps.redis.flushdb()
+        else:
+            print 'No test configuration found in test.cfg'
+            exit()
+
+    def tearDown(self):
+        self.ps.close()
+
+    def test_01_missing_feeds(self):
+        """Test missing feeds are remembered until created"""
+        for i in range(2):
+            self.assertRaises(FeedDoesNotExist,
+                              lambda: self.ps._feeds['missing'])
+        stats = self.ps.cache_stats()
+        self.assertEqual((stats['misses'], stats['negative_hits']), (1, 1))
+        self.ps.feed('missing')
+        self.assertEqual(self.ps._feeds['missing'].feed, 'missing')
+
+    def test_02_eviction(self):
+        """Test the cache is bounded and keeps feeds in use"""
+        self.ps.feed('busy')
+        for i in range(6):
+            self.ps.feed('feed%s' % i)
+            self.ps.feed('busy')
+        stats = self.ps.cache_stats()
+        self.assertEqual(stats['cached'], 3)
+        self.assertEqual(stats['evictions'], 4)
+        self.assertTrue('busy' in self.ps._feeds._feeds)
+
+    def test_03_coalescing(self):
+        """Test concurrent misses for a feed share one lookup"""
+        self.ps.feed('shared')
+        self.ps._feeds.invalidate('shared')
+        redis_for = self.ps.redis_for
+        def slow_redis_for(feed):
+            time.sleep(0.1)
+            return redis_for(feed)
+        self.ps.redis_for = slow_redis_for
+        before = self.ps.cache_stats()
+        results = []
+        threads = [threading.Thread(
+                       target=lambda: results.append(self.ps._feeds['shared']))
+                   for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(results)), 1)
+        stats = self.ps.cache_stats()
+        self.assertEqual(stats['misses'] - before['misses'], 1)
+        self.assertEqual(stats['coalesced'] + stats['hits'] -
+                         before['coalesced'] - before['hits'], 4)
+
+
+suite = unittest.TestLoader().loadTestsFromTestCase(TestCache)
@@ -109,5 +109,90 @@ class TestLeaf(unittest.TestCase):
         self.assertEqual(expected, items,
                 "Maxed items don't match: %s" % items)
 
+    def test_60_get_since(self):
+        """Test reading the items published since a given time"""
+        feed = self.ps.feed('testfeed3')
+        feed.redis.zadd(feed.feed_ids, **{'1': 100, '2': 200, '3': 300})
+        feed.redis.hmset(feed.feed_items, {'1': 'a', '2': 'b', '3': 'c'})
+        self.assertEqual(feed.get_since(200), [('2', 'b', 200.0),
+                                               ('3', 'c', 300.0)])
+        self.assertEqual(feed.get_since(301), [])
+
+        feed.publish('b2', id='2')
+        self.assertEqual([id for id, _, _ in feed.get_since(1000)], ['2'])
+
+    def test_70_replica_reads(self):
+        """Test reads go to replicas unless consistency is required"""
+        conn = self.ps.redis.connection_pool.connection_kwargs
+        replica = 'redis://%s:%s/%s' % (conn['host'], conn['port'],
+                                        conn['db'] + 1)
+        ps = thoonk.Thoonk(conn['host'], conn['port'], conn['db'],
+                           replicas=[replica])
+        try:
+            ps.replicas[0].flushdb()
+            feed = ps.feed("testfeed")
+            feed.publish('a', id='1')
+            sorted_feed = ps.sorted_feed("testsorted")
+            sorted_feed.append('b')
+            # the stand-in replica never receives the writes
+            self.assertEqual(feed.get_ids(), [])
+            self.assertEqual(feed.get_item('1'), None)
+            self.assertEqual(sorted_feed.get_range(), [])
+            self.assertEqual(ps.get_feed_names(), set())
+            self.assertEqual(feed.get_ids(consistent=True), ['1'])
+            self.assertEqual(feed.get_all(consistent=True), {'1': 'a'})
+            self.assertEqual(sorted_feed.get_range(consistent=True),
+                             [('1', 'b')])
+            self.assertEqual(ps.get_feed_names(consistent=True),
+                             set(['testfeed', 'testsorted']))
+            self.assertEqual(len(ps.pool_stats()['replicas']), 1)
+        finally:
+            ps.close()
+
+    def test_80_batch_create_delete(self):
+        """Test creating and deleting many feeds at once"""
+        events = []
+        done = threading.Event()
+        def create_handler(name):
+            events.append(('create', name))
+        def delete_handler(name):
+            events.append(('delete', name))
+            if len(events) == 8:
+                done.set()
+        self.ps.register_handler('create', create_handler)
+        self.ps.register_handler('delete', delete_handler)
+
+        self.ps.feed('batch0')
+        names = ['batch%s' % i for i in range(5)]
+        existing = self.ps.create_feeds(
+            dict((name, {'type': 'queue'} if name == 'batch4' else {})
+                 for name in names), batch_size=2)
+        self.assertEqual(existing, set(['batch0']))
+        self.assertEqual(self.ps.get_feed_names(), set(names))
+        self.assertEqual(type(self.ps.feed('batch1')), Feed)
+        self.assertEqual(type(self.ps.feed('batch4')), thoonk.feeds.Queue)
+
+        received = []
+        publish = threading.Event()
+        def publish_handler(feed, item, id):
+            received.append((feed, item))
+            publish.set()
+        self.ps.register_handler('publish', publish_handler)
+        self.ps.feed('batch2').publish('hi')
+        publish.wait(2)
+        self.assertEqual(received, [('batch2', 'hi')])
+
+        missing = self.ps.delete_feeds(['batch1', 'batch2', 'batch4',
+                                        'nofeed'], batch_size=3)
+        self.assertEqual(missing, set(['nofeed']))
+        self.assertEqual(self.ps.get_feed_names(), set(['batch0', 'batch3']))
+        self.assertEqual(self.ps.redis.keys('feed.*:batch2'), [])
+        self.assertFalse(self.ps.feed_exists('batch4'))
+        done.wait(2)
+        self.assertEqual(sorted(events),
+                         [('create', name) for name in names] +
+                         [('delete', name)
+                          for name in ('batch1', 'batch2', 'batch4')])
+
 
 suite = unittest.TestLoader().loadTestsFromTestCase(TestLeaf)
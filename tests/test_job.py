@@ -2,6 +2,7 @@ import thoonk
 import unittest
 from ConfigParser import ConfigParser
 import threading
+import time
 
 
 class TestJob(unittest.TestCase):
@@ -70,6 +71,204 @@ class TestJob(unittest.TestCase):
         self.assertEqual(j.get_ids(), [])
         self.assertRaises(thoonk.exceptions.Empty, j.get, timeout=1)
 
+    def test_40_rate_limit(self):
+        """Test job dispatch is limited by the configured rate"""
+        j = self.ps.job("testjob", {'rate_limit': 10, 'rate_burst': 1})
+        for x in range(4):
+            j.put(str(x))
+        start = time.time()
+        for x in range(4):
+            id, job_content, cancelled = j.get(timeout=3)
+            j.finish(id)
+        elapsed = time.time() - start
+        self.assertTrue(elapsed >= 0.25,
+                "Jobs were dispatched too quickly: %s" % elapsed)
+
+    def test_41_rate_limit_timeout(self):
+        """Test rate limited job.get times out while waiting for a token"""
+        j = self.ps.job("testjob", {'rate_limit': 0.2, 'rate_burst': 1})
+        j.put('9.0')
+        j.put('9.1')
+        id, job_content, cancelled = j.get(timeout=1)
+        j.finish(id)
+        self.assertRaises(thoonk.exceptions.Empty, j.get, timeout=1)
+
+    def test_42_rate_limit_keeps_timeout(self):
+        """Test waiting for a token does not extend the get timeout"""
+        j = self.ps.job("testjob", {'rate_limit': 1.5, 'rate_burst': 1})
+        j.put('9.0')
+        id, job_content, cancelled = j.get(timeout=1)
+        j.finish(id)
+        start = time.time()
+        self.assertRaises(thoonk.exceptions.Empty, j.get, timeout=1)
+        self.assertTrue(time.time() - start < 1.0)
+        self.ps.set_config("testjob", {'rate_limit': 0})
+        self.assertEqual(j._get_rate_limit(), (0, 0))
+
+    def test_43_rate_limit_blocked_workers(self):
+        """Test blocked workers do not hold or lose rate limit tokens"""
+        j = self.ps.job("testjob", {'rate_limit': 4, 'rate_burst': 2})
+        claimed = []
+        def worker(timeout):
+            try:
+                while True:
+                    id, job_content, cancelled = j.get(timeout=timeout)
+                    claimed.append(job_content)
+                    j.finish(id)
+                    if not timeout:
+                        break
+            except thoonk.exceptions.Empty:
+                pass
+        # workers blocked on an empty feed, one of them without a timeout
+        forever = threading.Thread(target=worker, args=(0,))
+        forever.start()
+        threads = [threading.Thread(target=worker, args=(1,))
+                   for i in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(claimed, [])
+        tokens = self.ps.redis.hget(j.feed_ratelimit, 'tokens')
+        self.assertTrue(tokens is None or float(tokens) >= 0)
+
+        threads = [threading.Thread(target=worker, args=(3,))
+                   for i in range(3)]
+        for thread in threads:
+            thread.start()
+        start = time.time()
+        for x in range(6):
+            j.put(str(x))
+        for thread in threads + [forever]:
+            thread.join()
+        elapsed = time.time() - start
+        self.assertEqual(sorted(claimed), [str(x) for x in range(6)])
+        self.assertTrue(elapsed >= 0.9,
+                "Jobs were dispatched too quickly: %s" % elapsed)
+        self.assertEqual(j.get_ids(), [])
+
+    def test_50_dedupe_key(self):
+        """Test duplicate jobs are collapsed until finished"""
+        j = self.ps.job("testjob")
+        id = j.put('9.0', dedupe_key='a')
+        self.assertEqual(j.put('9.1', dedupe_key='a'), id)
+        self.assertEqual(j.get_ids(), [id])
+        id_worker, job_content, cancelled = j.get(timeout=1)
+        self.assertEqual(j.put('9.2', dedupe_key='a'), id)
+        j.finish(id_worker)
+        id2 = j.put('9.3', dedupe_key='a')
+        self.assertNotEqual(id2, id)
+        j.retract(id2)
+        self.assertNotEqual(j.put('9.4', dedupe_key='a'), id2)
+
+    def test_51_dedupe_content(self):
+        """Test duplicate jobs are detected by content hash"""
+        j = self.ps.job("testjob")
+        id = j.put('9.0', dedupe_key=j.CONTENT_HASH)
+        self.assertEqual(j.put('9.0', dedupe_key=j.CONTENT_HASH), id)
+        self.assertNotEqual(j.put('9.1', dedupe_key=j.CONTENT_HASH), id)
+        self.assertEqual(len(j.get_ids()), 2)
+
+    def test_60_latency_stats(self):
+        """Test job wait and service times are recorded"""
+        j = self.ps.job("testjob")
+        j.put('9.0')
+        j.put('9.1')
+        time.sleep(0.1)
+        for x in range(2):
+            id, job_content, cancelled = j.get(timeout=1)
+            j.finish(id)
+        stats = j.get_latency_stats()
+        self.assertEqual(stats['wait']['count'], 2)
+        self.assertEqual(stats['service']['count'], 2)
+        self.assertTrue(stats['wait']['p50'] >= 90,
+                "Wait time too short: %s" % stats['wait'])
+        self.assertTrue(stats['wait']['p99'] >= stats['wait']['p50'])
+        j.reset_latency_stats()
+        self.assertEqual(j.get_latency_stats()['wait']['count'], 0)
+
+    def test_70_reap_worker(self):
+        """Test jobs of a worker with an expired heartbeat are requeued"""
+        j = self.ps.job("testjob")
+        alive = j.register_worker(ttl=10)
+        dead = j.register_worker(ttl=1)
+        id1 = j.put('9.0')
+        id2 = j.put('9.1')
+        j.get(timeout=1, worker=alive)
+        j.get(timeout=1, worker=dead)
+        self.assertEqual(j.get_worker_claims(dead), [id2])
+        self.assertEqual(j.reap_workers(), 0)
+        time.sleep(1.5)
+        self.assertEqual(j.reap_workers(), 1)
+        self.assertEqual(j.get_workers(), set([alive]))
+        self.assertEqual(j.get_worker_claims(dead), [])
+        id, job_content, cancelled = j.get(timeout=1, worker=alive)
+        self.assertEqual((id, cancelled), (id2, 1))
+        j.finish(id1)
+        j.finish(id2)
+        self.assertEqual(j.get_worker_claims(alive), [])
+
+    def test_71_unregister_worker(self):
+        """Test unregistering a worker requeues its jobs"""
+        j = self.ps.job("testjob")
+        worker = j.register_worker()
+        id = j.put('9.0')
+        j.get(timeout=1, worker=worker)
+        j.unregister_worker(worker)
+        self.assertEqual(j.get_workers(), set())
+        self.assertEqual(j.get(timeout=1)[0], id)
+
+    def test_72_maintenance_reaps_past_stale_claims(self):
+        """Test maintenance keeps reaping past batches of stale claims"""
+        j = self.ps.job("testjob")
+        dead = j.register_worker(ttl=1)
+        id = j.put('9.0')
+        j.get(timeout=1, worker=dead)
+        # claims left behind by jobs that are long gone
+        self.ps.redis.zadd(j._worker_claims_key(dead),
+                           **dict(('gone%s' % i, 0) for i in range(150)))
+        time.sleep(1.5)
+        j.maintenance()
+        self.assertEqual(j.get_workers(), set())
+        self.assertEqual(j.get_ids(), [id])
+        self.assertEqual(j.get(timeout=1)[0], id)
+
+    def test_73_percent_feed_name(self):
+        """Test workers and claims of a feed named with a '%'"""
+        j = self.ps.job("50%off")
+        dead = j.register_worker(ttl=1)
+        id = j.put('9.0')
+        self.assertEqual(j.get(timeout=1, worker=dead)[0], id)
+        self.assertEqual(j.get_worker_claims(dead), [id])
+        self.assertTrue(j._worker_key(dead) in j.get_schemas())
+        self.assertTrue(j.get_dispatch_rate() >= 0)
+        time.sleep(1.5)
+        self.assertEqual(j.reap_workers(), 1)
+        self.assertEqual(j.get(timeout=1)[0], id)
+
+    def test_74_delete_feeds(self):
+        """Test deleting job feeds removes their worker keys in batches"""
+        names = ['job%s' % x for x in range(3)]
+        for name in names:
+            j = self.ps.job(name)
+            worker = j.register_worker()
+            j.put('9.0')
+            j.get(timeout=1, worker=worker)
+        get_workers = thoonk.feeds.Job.get_workers
+        def no_reads(job):
+            raise AssertionError('Worker set read for %s' % job.feed)
+        thoonk.feeds.Job.get_workers = no_reads
+        try:
+            self.assertEqual(self.ps.delete_feeds(names, batch_size=2),
+                             set())
+        finally:
+            thoonk.feeds.Job.get_workers = get_workers
+        for name in names:
+            self.assertEqual(self.ps.redis.keys('feed.worker*:%s*' % name),
+                             [])
+            self.assertEqual(self.ps.redis.keys('feed.claim*:%s' % name), [])
+
+
 class TestJobResult(unittest.TestCase):
 
     def setUp(self, *args, **kwargs):
@@ -1,5 +1,7 @@
 import thoonk
 from thoonk.feeds import Feed, Job
+from thoonk.notify import frame, parse_frame
+from thoonk.dispatch import EventBuffer
 import unittest
 import time
 import redis
@@ -224,4 +226,721 @@ class TestNotice(unittest.TestCase):
         self.ps.remove_handler('retried_notice', retried_handler)
         self.ps.remove_handler('finished_notice', finished_handler)
         
-suite = unittest.TestLoader().loadTestsFromTestCase(TestNotice)
+class TestPatternNotice(unittest.TestCase):
+
+    def setUp(self):
+        conf = ConfigParser()
+        conf.read('test.cfg')
+        if conf.sections() == ['Test']:
+            self.ps = thoonk.Thoonk(host=conf.get('Test', 'host'),
+                                    port=conf.getint('Test', 'port'),
+                                    db=conf.getint('Test', 'db'))
+            self.ps.redis.flushdb()
+            self.ps.feed("existing")
+            self.lps = thoonk.Thoonk(host=conf.get('Test', 'host'),
+                                     port=conf.getint('Test', 'port'),
+                                     db=conf.getint('Test', 'db'),
+                                     listen=True,
+                                     listen_patterns=True)
+        else:
+            print 'No test configuration found in test.cfg'
+            exit()
+
+    def tearDown(self):
+        self.lps.close()
+        self.ps.close()
+
+    def test_01_pattern_notices(self):
+        """Test notices are received through pattern subscriptions"""
+        received = []
+        event = threading.Event()
+        def publish_handler(feed, item, id):
+            received.append((feed, item))
+            if len(received) == 2:
+                event.set()
+
+        self.lps.register_handler('publish', publish_handler)
+        self.ps.feed("existing").publish('a')
+        self.ps.feed("new").publish('b')
+        event.wait(1)
+        self.assertEqual(sorted(received), [('existing', 'a'), ('new', 'b')])
+
+
+class TestSelectiveNotice(unittest.TestCase):
+
+    def setUp(self):
+        conf = ConfigParser()
+        conf.read('test.cfg')
+        if conf.sections() == ['Test']:
+            self.ps = thoonk.Thoonk(host=conf.get('Test', 'host'),
+                                    port=conf.getint('Test', 'port'),
+                                    db=conf.getint('Test', 'db'))
+            self.ps.redis.flushdb()
+            self.ps.feed("news.a")
+            self.ps.feed("news.b")
+            self.ps.feed("other")
+            self.ps.job("jobs")
+            self.kwargs = dict(host=conf.get('Test', 'host'),
+                               port=conf.getint('Test', 'port'),
+                               db=conf.getint('Test', 'db'),
+                               listen=True)
+        else:
+            print 'No test configuration found in test.cfg'
+            exit()
+
+    def tearDown(self):
+        self.ps.close()
+
+    def _publish_all(self, lps, expected):
+        received = []
+        event = threading.Event()
+        def publish_handler(feed, item, id):
+            received.append(feed)
+            if len(received) == expected:
+                event.set()
+
+        lps.register_handler('publish', publish_handler)
+        self.ps.feed("news.a").publish('a')
+        self.ps.feed("news.b").publish('b')
+        self.ps.feed("other").publish('c')
+        self.ps.job("jobs").put('d')
+        event.wait(1)
+        # Give unexpected notices a chance to arrive.
+        time.sleep(0.1)
+        lps.remove_handler('publish', publish_handler)
+        return sorted(received)
+
+    def _check(self, **kwargs):
+        kwargs.update(self.kwargs)
+        lps = thoonk.Thoonk(**kwargs)
+        try:
+            self.assertEqual(self._publish_all(lps, 2),
+                             ['news.a', 'news.b'])
+            lps.subscribe_feed('other')
+            lps.unsubscribe_feed('news.a')
+            self.assertEqual(self._publish_all(lps, 2),
+                             ['news.b', 'other'])
+        finally:
+            lps.close()
+
+    def test_01_feed_filter(self):
+        """Test only notices for matching feeds are received"""
+        self._check(listen_feeds=['news.*'])
+
+    def test_02_pattern_feed_filter(self):
+        """Test feed filters with pattern subscriptions"""
+        self._check(listen_feeds=['news.*'], listen_patterns=True)
+
+    def test_03_type_filter(self):
+        """Test only notices for feeds of matching types are received"""
+        lps = thoonk.Thoonk(listen_types=['job'], **self.kwargs)
+        try:
+            self.assertEqual(self._publish_all(lps, 1), ['jobs'])
+        finally:
+            lps.close()
+
+    def test_04_not_listening(self):
+        """Test subscribing requires a listening instance"""
+        self.assertRaises(thoonk.exceptions.NotListening,
+                          self.ps.subscribe_feed, 'other')
+
+
+class TestBatchNotice(unittest.TestCase):
+
+    def setUp(self):
+        conf = ConfigParser()
+        conf.read('test.cfg')
+        if conf.sections() == ['Test']:
+            redis.Redis(host=conf.get('Test', 'host'),
+                        port=conf.getint('Test', 'port'),
+                        db=conf.getint('Test', 'db')).flushdb()
+            self.ps = thoonk.Thoonk(host=conf.get('Test', 'host'),
+                                    port=conf.getint('Test', 'port'),
+                                    db=conf.getint('Test', 'db'),
+                                    listen=True)
+        else:
+            print 'No test configuration found in test.cfg'
+            exit()
+
+    def tearDown(self):
+        self.ps.close()
+
+    def test_01_batches(self):
+        """Test events are delivered in batches per feed"""
+        batches = []
+        event = threading.Event()
+        def batch_handler(feed, events):
+            batches.append((feed, [item for item, id in events]))
+            if sum(len(b[1]) for b in batches) == 6:
+                event.set()
+
+        self.ps.register_batch_handler('publish', batch_handler,
+                                       max_size=3, max_wait=0.2)
+        a = self.ps.feed("a")
+        b = self.ps.feed("b")
+        for item in '12345':
+            a.publish(item)
+        b.publish('6')
+        event.wait(2)
+        self.assertEqual(sorted(batches), [('a', ['1', '2', '3']),
+                                           ('a', ['4', '5']),
+                                           ('b', ['6'])])
+
+    def test_02_coalesce(self):
+        """Test repeated events for an item are coalesced"""
+        batches = []
+        event = threading.Event()
+        def batch_handler(feed, events):
+            batches.append(events)
+            event.set()
+
+        f = self.ps.feed("a")
+        id = f.publish('1')
+        other = f.publish('x')
+        self.ps.register_batch_handler('edit', batch_handler,
+                                       max_wait=0.2, coalesce=True)
+        f.publish('2', id=id)
+        f.publish('y', id=other)
+        f.publish('3', id=id)
+        event.wait(2)
+        self.assertEqual(batches, [[('3', id), ('y', other)]])
+
+    def test_03_coalesce_unsupported(self):
+        """Test coalescing requires events with item IDs"""
+        self.assertRaises(ValueError, self.ps.register_batch_handler,
+                          'create', lambda feed, events: None,
+                          coalesce=True)
+
+
+class TestReconnectNotice(unittest.TestCase):
+
+    def setUp(self):
+        conf = ConfigParser()
+        conf.read('test.cfg')
+        if conf.sections() == ['Test']:
+            redis.Redis(host=conf.get('Test', 'host'),
+                        port=conf.getint('Test', 'port'),
+                        db=conf.getint('Test', 'db')).flushdb()
+            self.kwargs = dict(host=conf.get('Test', 'host'),
+                               port=conf.getint('Test', 'port'),
+                               db=conf.getint('Test', 'db'),
+                               listen=True)
+            self.ps = thoonk.Thoonk(host=conf.get('Test', 'host'),
+                                    port=conf.getint('Test', 'port'),
+                                    db=conf.getint('Test', 'db'))
+        else:
+            print 'No test configuration found in test.cfg'
+            exit()
+
+    def tearDown(self):
+        self.ps.close()
+
+    def _missed_publishes(self, ps, feeds):
+        """
+        Drop the listener connection, publish to the feeds while it is
+        down, and return the set of publish events received after it is
+        back. Items published around the reconnect may be replayed as
+        well as received live.
+        """
+        received = []
+        event = threading.Event()
+        def publish_handler(feed, item, id):
+            received.append((feed, item, id))
+            if item == 'after':
+                event.set()
+
+        ps.register_handler('publish', publish_handler)
+        # Add items without their publish notices, as if the notices had
+        # been sent while the listener was disconnected.
+        for feed in feeds:
+            ps.redis.zadd(feed.feed_ids, missed=time.time())
+            ps.redis.hset(feed.feed_items, 'missed', 'during')
+
+        for client in ps.redis.client_list():
+            if client['cmd'] in ('subscribe', 'psubscribe'):
+                ps.redis.client_kill(client['addr'])
+
+        # Wait for the listener to resubscribe before publishing.
+        for x in range(50):
+            if ps.redis.execute_command('PUBSUB', 'NUMSUB',
+                                        feeds[0].feed_publish)[1]:
+                break
+            time.sleep(0.02)
+        feeds[0].publish('after', id='after')
+        event.wait(2)
+        return set(received)
+
+    def test_01_catch_up(self):
+        """Test publishes missed while disconnected are replayed"""
+        ps = thoonk.Thoonk(catch_up=True, **self.kwargs)
+        try:
+            feed = ps.feed("catchup")
+            self.assertEqual(self._missed_publishes(ps, [feed]),
+                             set([('catchup', 'during', 'missed'),
+                                  ('catchup', 'after', 'after')]))
+        finally:
+            ps.close()
+
+    def test_02_catch_up_selected(self):
+        """Test only the chosen feeds are replayed"""
+        ps = thoonk.Thoonk(catch_up=['chosen', 'picked*'], **self.kwargs)
+        try:
+            feeds = [ps.feed(name) for name in ('chosen', 'other', 'picked1')]
+            self.assertEqual(self._missed_publishes(ps, feeds),
+                             set([('chosen', 'after', 'after'),
+                                  ('chosen', 'during', 'missed'),
+                                  ('picked1', 'during', 'missed')]))
+        finally:
+            ps.close()
+
+    def test_03_no_catch_up(self):
+        """Test nothing is replayed by default"""
+        ps = thoonk.Thoonk(**self.kwargs)
+        try:
+            feed = ps.feed("catchup")
+            self.assertEqual(self._missed_publishes(ps, [feed]),
+                             set([('catchup', 'after', 'after')]))
+        finally:
+            ps.close()
+
+
+class TestLazyNotice(unittest.TestCase):
+
+    def setUp(self):
+        conf = ConfigParser()
+        conf.read('test.cfg')
+        if conf.sections() == ['Test']:
+            redis.Redis(host=conf.get('Test', 'host'),
+                        port=conf.getint('Test', 'port'),
+                        db=conf.getint('Test', 'db')).flushdb()
+            self.ps = thoonk.Thoonk(host=conf.get('Test', 'host'),
+                                    port=conf.getint('Test', 'port'),
+                                    db=conf.getint('Test', 'db'),
+                                    listen=True)
+        else:
+            print 'No test configuration found in test.cfg'
+            exit()
+
+    def tearDown(self):
+        self.ps.close()
+
+    def _receive(self, publish, count):
+        received = []
+        event = threading.Event()
+        def publish_handler(feed, item, id):
+            received.append((item, id))
+            if len(received) == count:
+                event.set()
+
+        self.ps.register_handler('publish', publish_handler)
+        publish()
+        event.wait(1)
+        self.ps.remove_handler('publish', publish_handler)
+        return received
+
+    def test_01_id_only_feed(self):
+        """Test ID only notices give lazily fetched items"""
+        feed = self.ps.feed("lazy", {'notify': 'id'})
+        received = self._receive(lambda: [feed.publish(item, id=item)
+                                          for item in ('a', 'bb', 'ccc')], 3)
+        self.assertEqual([id for item, id in received], ['a', 'bb', 'ccc'])
+        items = [item for item, id in received]
+        self.assertEqual([len(item) for item in items], [1, 2, 3])
+        self.assertEqual([item.version for item in items], [1, 2, 3])
+        self.assertEqual(items[0].batch.values, None)
+        self.assertEqual(items[0], 'a')
+        self.assertEqual(items[0].batch.values,
+                         {'a': 'a', 'bb': 'bb', 'ccc': 'ccc'})
+        self.assertEqual([str(item) for item in items], ['a', 'bb', 'ccc'])
+        self.assertEqual(items[2].upper(), 'CCC')
+
+    def test_02_id_only_job_and_sorted_feed(self):
+        """Test ID only notices from jobs and sorted feeds"""
+        job = self.ps.job("lazyjob", {'notify': 'id'})
+        received = self._receive(lambda: (job.put('x'),
+                                          job.put_many(['y', 'z'])), 3)
+        self.assertEqual(sorted(str(item) for item, id in received),
+                         ['x', 'y', 'z'])
+
+        sorted_feed = self.ps.sorted_feed("lazysorted", {'notify': 'id'})
+        received = self._receive(lambda: (sorted_feed.append('x'),
+                                          sorted_feed.append_many(['y'])), 2)
+        self.assertEqual([str(item) for item, id in received], ['x', 'y'])
+
+    def test_03_full_notices(self):
+        """Test feeds send whole items by default"""
+        feed = self.ps.feed("full")
+        received = self._receive(lambda: feed.publish('a', id='1'), 1)
+        self.assertEqual(received, [('a', '1')])
+        self.assertEqual(type(received[0][0]), str)
+
+    def test_04_binary_frames(self):
+        """Test binary framed notices carry items containing NUL bytes"""
+        fields = parse_frame(frame(['a\x00b', '', 3]))
+        self.assertEqual(map(type, fields), [buffer] * 3)
+        self.assertEqual(map(str, fields), ['a\x00b', '', '3'])
+        self.assertEqual(parse_frame(frame(['abc'])[:-1]), None)
+        self.assertEqual(parse_frame('a\x00b'), None)
+
+        feed = self.ps.feed("framed", {'framing': 'binary'})
+        sorted_feed = self.ps.sorted_feed("framedsorted",
+                                          {'framing': 'binary'})
+        received = self._receive(lambda: (feed.publish('\x00\xff', id='1'),
+                                          sorted_feed.append('x\x00y')), 2)
+        self.assertEqual(received[0], ('\x00\xff', '1'))
+        self.assertEqual(received[1][0], 'x\x00y')
+
+        job = self.ps.job("framedjob", {'framing': 'binary'})
+        results = []
+        event = threading.Event()
+        def finish_handler(feed, id, result):
+            results.append((id, result))
+            event.set()
+        self.ps.register_handler('finish', finish_handler)
+        id = job.put('work')
+        job.get(timeout=1)
+        job.finish(id, 'done\x00ok')
+        event.wait(1)
+        self.assertEqual(results, [(id, 'done\x00ok')])
+
+    def test_05_binary_id_only_frames(self):
+        """Test binary framed ID only notices"""
+        feed = self.ps.feed("framedlazy", {'framing': 'binary',
+                                           'notify': 'id'})
+        received = self._receive(lambda: feed.publish('a\x00b', id='x'), 1)
+        item, id = received[0]
+        self.assertEqual(id, 'x')
+        self.assertEqual((item.version, len(item)), (1, 3))
+        self.assertEqual(item, 'a\x00b')
+
+    def test_06_frame_like_plain_notices(self):
+        """Test plain notices that look like frames are not parsed as such"""
+        feed = self.ps.feed("plain")
+        # the notice '\xff\x01' '\x00' item is a well formed frame
+        item = '\x00\x00\x01a\x00\x00\x00\x01b'
+        received = self._receive(lambda: feed.publish(item, id='\xff\x01'),
+                                 1)
+        self.assertEqual(received, [(item, '\xff\x01')])
+
+    def test_07_id_only_unicode_sizes(self):
+        """Test ID only notices give item sizes in bytes"""
+        feed = self.ps.feed("lazyunicode", {'notify': 'id'})
+        job = self.ps.job("lazyunicodejob", {'notify': 'id'})
+        received = self._receive(lambda: (feed.publish(u'\xe9t\xe9', id='u'),
+                                          job.put_many([u'\xe9'])), 2)
+        self.assertEqual(sorted(len(item) for item, id in received), [2, 5])
+
+
+class TestBufferNotice(unittest.TestCase):
+
+    def setUp(self):
+        conf = ConfigParser()
+        conf.read('test.cfg')
+        if conf.sections() == ['Test']:
+            redis.Redis(host=conf.get('Test', 'host'),
+                        port=conf.getint('Test', 'port'),
+                        db=conf.getint('Test', 'db')).flushdb()
+            self.ps = thoonk.Thoonk(host=conf.get('Test', 'host'),
+                                    port=conf.getint('Test', 'port'),
+                                    db=conf.getint('Test', 'db'))
+            self.kwargs = dict(host=conf.get('Test', 'host'),
+                               port=conf.getint('Test', 'port'),
+                               db=conf.getint('Test', 'db'),
+                               listen=True)
+        else:
+            print 'No test configuration found in test.cfg'
+            exit()
+
+    def tearDown(self):
+        self.ps.close()
+
+    def _slow_consumer(self, lps, name, expected):
+        received = []
+        release = threading.Event()
+        done = threading.Event()
+        def handler(feed, item, id):
+            release.wait(2)
+            received.append(item)
+            if len(received) == expected:
+                done.set()
+
+        lps.register_handler(name, handler)
+        return received, release, done
+
+    def _wait_for(self, lps, stat, value):
+        for x in range(100):
+            if lps.get_buffer_stats()[stat] == value:
+                break
+            time.sleep(0.01)
+
+    def test_01_drop_oldest(self):
+        """Test the oldest buffered messages are dropped when full"""
+        feed = self.ps.feed("buffered")
+        lps = thoonk.Thoonk(buffer_size=2, buffer_policy='drop_oldest',
+                            **self.kwargs)
+        try:
+            received, release, done = self._slow_consumer(lps, 'publish', 3)
+            for item in '12345':
+                feed.publish(item)
+            self._wait_for(lps, 'dropped', 2)
+            stats = lps.get_buffer_stats()
+            self.assertEqual(stats['buffered'], 2)
+            self.assertEqual(stats['dropped'], 2)
+            self.assertTrue(stats['lag'] > 0)
+            release.set()
+            done.wait(2)
+            self.assertEqual(received, ['1', '4', '5'])
+        finally:
+            lps.close()
+
+    def test_02_coalesce(self):
+        """Test buffered messages for the same item are coalesced"""
+        feed = self.ps.feed("buffered")
+        lps = thoonk.Thoonk(buffer_size=10, buffer_policy='coalesce',
+                            **self.kwargs)
+        try:
+            feed.publish('a', id='a')
+            feed.publish('b', id='b')
+            received, release, done = self._slow_consumer(lps, 'edit', 2)
+            feed.publish('a1', id='a')
+            for item in ('b1', 'b2', 'b3'):
+                feed.publish(item, id='b')
+            self._wait_for(lps, 'coalesced', 2)
+            self.assertEqual(lps.get_buffer_stats()['buffered'], 1)
+            release.set()
+            done.wait(2)
+            self.assertEqual(received, ['a1', 'b3'])
+        finally:
+            lps.close()
+
+    def test_03_control_not_dropped(self):
+        """Test feed notices bypass a full drop_oldest buffer"""
+        feed = self.ps.feed("buffered")
+        lps = thoonk.Thoonk(buffer_size=2, buffer_policy='drop_oldest',
+                            **self.kwargs)
+        try:
+            received, release, done = self._slow_consumer(lps, 'publish', 3)
+            created = threading.Event()
+            lps.register_handler('create', lambda name: created.set())
+            for item in '12345':
+                feed.publish(item)
+            self._wait_for(lps, 'dropped', 2)
+            latecomer = self.ps.feed("latecomer")
+            self.assertTrue(created.wait(2))
+            self.assertEqual(lps.get_buffer_stats()['dropped'], 2)
+            release.set()
+            done.wait(2)
+            del received[:]
+            done.clear()
+            for item in 'xyz':
+                latecomer.publish(item)
+            done.wait(2)
+            self.assertEqual(received, ['x', 'y', 'z'])
+        finally:
+            lps.close()
+
+    def test_04_coalesce_with_room(self):
+        """Test waiting entries are coalesced even when the buffer has room"""
+        buf = EventBuffer(size=100, policy=EventBuffer.COALESCE)
+        received = []
+        release = threading.Event()
+        def handler(item):
+            release.wait(2)
+            received.append(item)
+        try:
+            # the delivery thread holds the first entry until released
+            buf.put(handler, ('first',))
+            for x in range(100):
+                if buf.stats()['buffered'] == 0:
+                    break
+                time.sleep(0.01)
+            for x in range(50):
+                buf.put(handler, ('a%s' % x,), key='a')
+                buf.put(handler, ('b%s' % x,), key='b')
+            stats = buf.stats()
+            self.assertEqual(stats['buffered'], 2)
+            self.assertEqual(stats['coalesced'], 98)
+            release.set()
+        finally:
+            buf.stop()
+        self.assertEqual(received, ['first', 'a49', 'b49'])
+
+
+class TestSharedNotice(unittest.TestCase):
+
+    def setUp(self):
+        conf = ConfigParser()
+        conf.read('test.cfg')
+        if conf.sections() == ['Test']:
+            self.ps = thoonk.Thoonk(host=conf.get('Test', 'host'),
+                                    port=conf.getint('Test', 'port'),
+                                    db=conf.getint('Test', 'db'))
+            self.ps.redis.flushdb()
+            self.ps.feed("shared")
+            self.kwargs = dict(host=conf.get('Test', 'host'),
+                               port=conf.getint('Test', 'port'),
+                               db=conf.getint('Test', 'db'),
+                               listen=True,
+                               shared_listener=True)
+        else:
+            print 'No test configuration found in test.cfg'
+            exit()
+
+    def tearDown(self):
+        self.ps.close()
+
+    def _subscribers(self):
+        return len([client for client in self.ps.redis.client_list()
+                    if client['cmd'] in ('subscribe', 'psubscribe')])
+
+    def _received(self, lps):
+        received = []
+        event = threading.Event()
+        def publish_handler(feed, item, id):
+            received.append(item)
+            event.set()
+        lps.register_handler('publish', publish_handler)
+        return received, event
+
+    def test_01_shared_connection(self):
+        """Test listeners share one connection and all get notices"""
+        a = thoonk.Thoonk(**self.kwargs)
+        b = thoonk.Thoonk(listen_patterns=True, **self.kwargs)
+        try:
+            self.assertTrue(a.listener.hub is b.listener.hub)
+            self.assertEqual(self._subscribers(), 1)
+            received_a, event_a = self._received(a)
+            received_b, event_b = self._received(b)
+            self.ps.feed("shared").publish('x')
+            event_a.wait(1)
+            event_b.wait(1)
+            self.assertEqual(received_a, ['x'])
+            self.assertEqual(received_b, ['x'])
+
+            a.close()
+            event_b.clear()
+            self.ps.feed("shared").publish('y')
+            event_b.wait(1)
+            self.assertEqual(received_a, ['x'])
+            self.assertEqual(received_b, ['x', 'y'])
+        finally:
+            a.close()
+            b.close()
+        self.assertEqual(thoonk.pubsub.ListenerHub._hubs, {})
+
+    def test_03_close_hub(self):
+        """Test the last shared listener closes the hub's connection"""
+        def pubsub_clients():
+            return len([client for client in self.ps.redis.client_list()
+                        if 'subscribe' in client['cmd']])
+        before = pubsub_clients()
+        a = thoonk.Thoonk(**self.kwargs)
+        b = thoonk.Thoonk(**self.kwargs)
+        hub = a.listener.hub
+        self.assertEqual(pubsub_clients(), before + 1)
+        a.close()
+        self.assertTrue(hub.isAlive())
+        b.close()
+        hub.join(1)
+        self.assertFalse(hub.isAlive())
+        for x in range(100):
+            if pubsub_clients() == before:
+                break
+            time.sleep(0.01)
+        self.assertEqual(pubsub_clients(), before)
+
+    def test_04_close_listener(self):
+        """Test closing a listener disconnects all of its connections"""
+        clients = len(self.ps.redis.client_list())
+        for shared in (False, True):
+            self.kwargs['shared_listener'] = shared
+            thoonk.Thoonk(**self.kwargs).close()
+            for x in range(100):
+                if len(self.ps.redis.client_list()) == clients:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(len(self.ps.redis.client_list()), clients)
+
+    def test_02_reconnect(self):
+        """Test every shared listener catches up after a reconnect"""
+        a = thoonk.Thoonk(catch_up=True, **self.kwargs)
+        b = thoonk.Thoonk(catch_up=True, **self.kwargs)
+        try:
+            received_a, event_a = self._received(a)
+            received_b, event_b = self._received(b)
+            feed = self.ps.feed("shared")
+            self.ps.redis.zadd(feed.feed_ids, missed=time.time())
+            self.ps.redis.hset(feed.feed_items, 'missed', 'during')
+            for client in self.ps.redis.client_list():
+                if client['cmd'] in ('subscribe', 'psubscribe'):
+                    self.ps.redis.client_kill(client['addr'])
+            event_a.wait(1)
+            event_b.wait(1)
+            self.assertEqual(received_a, ['during'])
+            self.assertEqual(received_b, ['during'])
+        finally:
+            a.close()
+            b.close()
+
+
+class TestDispatchNotice(unittest.TestCase):
+
+    def setUp(self):
+        conf = ConfigParser()
+        conf.read('test.cfg')
+        if conf.sections() == ['Test']:
+            redis.Redis(host=conf.get('Test', 'host'),
+                        port=conf.getint('Test', 'port'),
+                        db=conf.getint('Test', 'db')).flushdb()
+            self.ps = thoonk.Thoonk(host=conf.get('Test', 'host'),
+                                    port=conf.getint('Test', 'port'),
+                                    db=conf.getint('Test', 'db'),
+                                    listen=True,
+                                    dispatch_workers=4)
+        else:
+            print 'No test configuration found in test.cfg'
+            exit()
+
+    def tearDown(self):
+        self.ps.close()
+
+    def test_01_ordered_dispatch(self):
+        """Test handlers for different feeds run in parallel, in order per feed"""
+        slow = self.ps.feed("slow")
+        fast = self.ps.feed("fast")
+        blocked = threading.Event()
+        fast_event = threading.Event()
+        received = []
+
+        def publish_handler(feed, item, id):
+            if feed == "slow":
+                blocked.wait(2)
+                received.append(item)
+            else:
+                fast_event.set()
+
+        self.ps.register_handler('publish', publish_handler)
+        for x in range(3):
+            slow.publish(str(x))
+        fast.publish('a')
+        fast_event.wait(1)
+        self.assertTrue(fast_event.isSet(), "Fast feed blocked by slow feed")
+        self.assertEqual(received, [])
+        blocked.set()
+        for x in range(10):
+            if len(received) == 3:
+                break
+            time.sleep(0.1)
+        self.assertEqual(received, ['0', '1', '2'])
+
+
+suite = unittest.TestSuite((
+    unittest.TestLoader().loadTestsFromTestCase(TestNotice),
+    unittest.TestLoader().loadTestsFromTestCase(TestPatternNotice),
+    unittest.TestLoader().loadTestsFromTestCase(TestSelectiveNotice),
+    unittest.TestLoader().loadTestsFromTestCase(TestBatchNotice),
+    unittest.TestLoader().loadTestsFromTestCase(TestReconnectNotice),
+    unittest.TestLoader().loadTestsFromTestCase(TestLazyNotice),
+    unittest.TestLoader().loadTestsFromTestCase(TestBufferNotice),
+    unittest.TestLoader().loadTestsFromTestCase(TestSharedNotice),
+    unittest.TestLoader().loadTestsFromTestCase(TestDispatchNotice)))
@@ -1,6 +1,8 @@
 import thoonk
 from thoonk.feeds import Queue
 import unittest
+import redis
+import threading
 from ConfigParser import ConfigParser
 
 
@@ -31,5 +33,45 @@ class TestQueue(unittest.TestCase):
             r.append(q.get(timeout=2))
         self.assertEqual(r, ["10", "20", "30", "40"], "Queue results did not match publish.")
 
+    def test_blocking_pool(self):
+        """Test blocking pops use their own connection pool."""
+        q = self.ps.queue("testqueue")
+        results = []
+        thread = threading.Thread(target=lambda: results.append(q.get(2)))
+        thread.start()
+        while self.ps.pool_stats()['blocking']['in_use'] == 0:
+            thread.join(0.01)
+        stats = self.ps.pool_stats()
+        self.assertEqual(stats['blocking']['in_use'], 1)
+        self.assertEqual(stats['commands']['in_use'], 0)
+        q.put("10")
+        thread.join()
+        self.assertEqual(results, ["10"])
+        self.assertEqual(self.ps.pool_stats()['blocking'],
+                         {'max': 50, 'created': 1, 'in_use': 0, 'idle': 1})
+
+    def test_connection_options(self):
+        """Test connecting with a URL or an existing pool."""
+        conn = self.ps.redis.connection_pool.connection_kwargs
+        url = 'redis://%s:%s/%s' % (conn['host'], conn['port'], conn['db'])
+        by_url = thoonk.Thoonk(url=url, max_connections=2)
+        by_url.queue("testqueue").put("10")
+        self.assertEqual(by_url.db, conn['db'])
+        self.assertEqual(by_url.pool_stats()['commands']['max'], 2)
+
+        pool = redis.ConnectionPool(**conn)
+        by_pool = thoonk.Thoonk(connection_pool=pool)
+        self.assertTrue(by_pool.redis.connection_pool is pool)
+        self.assertEqual(by_pool.queue("testqueue").get(timeout=1), "10")
+        self.assertEqual(by_pool.pool_stats()['commands']['in_use'], 0)
+
+        # close leaves the pool it was given connected
+        by_pool.close()
+        self.assertTrue(pool._available_connections[0]._sock is not None)
+        pool.disconnect()
+        by_url.close()
+        connections = by_url.redis.connection_pool._connections
+        self.assertTrue(all(c._sock is None for c in connections))
+
 suite = unittest.TestLoader().loadTestsFromTestCase(TestQueue)
 
@@ -0,0 +1,79 @@
+import thoonk
+from thoonk.scheduler import Scheduler
+import unittest
+import time
+from ConfigParser import ConfigParser
+
+
+class TestScheduler(unittest.TestCase):
+
+    def setUp(self):
+        conf = ConfigParser()
+        conf.read('test.cfg')
+        if conf.sections() == ['Test']:
+            self.ps = thoonk.Thoonk(host=conf.get('Test', 'host'),
+                                    port=conf.getint('Test', 'port'),
+                                    db=conf.getint('Test', 'db'))
+            self.ps.redis.flushdb()
+        else:
+            print 'No test configuration found in test.cfg'
+            exit()
+
+    def tearDown(self):
+        self.ps.close()
+
+    def test_10_tick(self):
+        """Test due schedules are added to their job feed once"""
+        s = Scheduler(self.ps, 'test')
+        id = s.add('testjob', 'tick', 60, start=time.time() - 1)
+        self.assertTrue(s.is_leader())
+        self.assertEqual(s.tick(), 1)
+        self.assertEqual(s.tick(), 0)
+        j = self.ps.job('testjob')
+        self.assertEqual(j.get(timeout=1)[1], 'tick')
+        next = s.get_schedules()[id]['next']
+        self.assertTrue(time.time() < next <= time.time() + 60,
+                "Schedule not advanced: %s" % next)
+
+    def test_20_leader(self):
+        """Test only the leader fires schedules"""
+        s1 = Scheduler(self.ps, 'test')
+        s2 = Scheduler(self.ps, 'test')
+        s1.add('testjob', 'tick', 60, start=time.time() - 1)
+        self.assertTrue(s1.is_leader())
+        self.assertFalse(s2.is_leader())
+        self.assertEqual(s2.tick(), 0)
+        s1.resign()
+        self.assertTrue(s2.is_leader())
+        self.assertEqual(s2.tick(), 1)
+
+    def test_30_run(self):
+        """Test the scheduler thread fires schedules as they are due"""
+        s = Scheduler(self.ps, 'test')
+        s.add('testjob', 'tick', 0.2)
+        s.start()
+        time.sleep(0.7)
+        s.finish()
+        s.join()
+        count = len(self.ps.job('testjob').get_ids())
+        self.assertTrue(2 <= count <= 4, "Unexpected job count: %s" % count)
+
+    def test_40_remove(self):
+        """Test removing a schedule"""
+        s = Scheduler(self.ps, 'test')
+        id = s.add('testjob', 'tick', 60)
+        self.assertEqual(s.get_schedules().keys(), [id])
+        s.remove(id)
+        self.assertEqual(s.get_schedules(), {})
+
+    def test_50_keyword_id(self):
+        """Test schedules whose ID is a zadd keyword argument"""
+        s = Scheduler(self.ps, 'test')
+        self.assertEqual(s.add('testjob', 'tick', 60, id='name',
+                               start=time.time() - 1), 'name')
+        self.assertTrue(s.is_leader())
+        self.assertEqual(s.tick(), 1)
+        self.assertTrue('name' in s.get_schedules())
+
+
+suite = unittest.TestLoader().loadTestsFromTestCase(TestScheduler)
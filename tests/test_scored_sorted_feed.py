@@ -0,0 +1,115 @@
+import thoonk
+from thoonk.feeds import ScoredSortedFeed
+import unittest
+from ConfigParser import ConfigParser
+
+
+class TestScoredSortedFeed(unittest.TestCase):
+
+    def setUp(self):
+        conf = ConfigParser()
+        conf.read('test.cfg')
+        if conf.sections() == ['Test']:
+            self.ps = thoonk.Thoonk(host=conf.get('Test', 'host'),
+                                    port=conf.getint('Test', 'port'),
+                                    db=conf.getint('Test', 'db'))
+            self.ps.redis.flushdb()
+        else:
+            print 'No test configuration found in test.cfg'
+            exit()
+
+    def tearDown(self):
+        self.ps.close()
+
+    def test_10_publish(self):
+        """Test basic scored sorted feed publish and retrieve."""
+        l = self.ps.scored_sorted_feed("sortedfeed")
+        self.assertEqual(l.__class__, ScoredSortedFeed)
+        l.publish("hi")
+        l.publish("bye")
+        l.prepend("first")
+        r = l.get_ids()
+        self.assertEqual(r, ['3', '1', '2'],
+                "Sorted feed results did not match publish: %s." % r)
+        self.assertEqual(l.get_items(), {'1': 'hi', '2': 'bye', '3': 'first'})
+
+    def test_20_insert(self):
+        """Test adding items before and after other items"""
+        l = self.ps.scored_sorted_feed("sortedfeed")
+        l.publish("hi")
+        l.publish("bye")
+        l.publish_before('2', 'foo')
+        l.publish_after('2', 'bar')
+        self.assertEqual(l.publish_after('42', 'missing'), None)
+        r = l.get_ids()
+        self.assertEqual(r, ['1', '3', '2', '4'],
+                "Sorted feed results did not match: %s." % r)
+
+    def test_30_move(self):
+        """Test moving items around in the feed."""
+        l = self.ps.scored_sorted_feed("sortedfeed")
+        for item in ("hi", "bye", "thanks", "you're welcome"):
+            l.publish(item)
+        l.move_first('4')
+        self.assertEqual(l.get_ids(), ['4', '1', '2', '3'])
+        l.move_last('1')
+        self.assertEqual(l.get_ids(), ['4', '2', '3', '1'])
+        l.move_before('4', '3')
+        self.assertEqual(l.get_ids(), ['3', '4', '2', '1'])
+        l.move_after('4', '1')
+        self.assertEqual(l.get_ids(), ['3', '4', '1', '2'])
+
+    def test_40_retract(self):
+        """Test retracting an item from a scored sorted feed"""
+        l = self.ps.scored_sorted_feed("sortedfeed")
+        l.publish("hi")
+        l.publish("bye")
+        l.publish("thanks")
+        l.retract('2')
+        self.assertEqual(l.get_ids(), ['1', '3'])
+        self.assertEqual(l.get_item('2'), None)
+
+    def test_50_rebalance(self):
+        """Test inserting many items into the same gap"""
+        l = self.ps.scored_sorted_feed("sortedfeed")
+        l.publish("a")
+        l.publish("b")
+        expected = ['1']
+        for x in range(60):
+            expected.insert(1, str(l.publish_after('1', str(x))))
+        expected.append('2')
+        self.assertEqual(l.get_ids(), expected)
+        for x in range(60):
+            l.move_before('2', '1')
+            l.move_first('1')
+        self.assertEqual(l.get_ids(), expected)
+
+    def test_60_range(self):
+        """Test reading a slice of the feed in order"""
+        l = self.ps.scored_sorted_feed("sortedfeed")
+        for x in range(5):
+            l.publish(str(x))
+        l.move_first('5')
+        self.assertEqual(l.get_range(0, 2), [('5', '4'), ('1', '0')])
+        self.assertEqual(len(list(l.iter_items(batch_size=2))), 5)
+
+    def test_70_many(self):
+        """Test adding batches of items to either end of the feed"""
+        l = self.ps.scored_sorted_feed("sortedfeed")
+        l.publish("hi")
+        self.assertEqual(l.append_many(['a', 'b']), [2, 3])
+        self.assertEqual(l.prepend_many(['c', 'd']), [4, 5])
+        self.assertEqual(l.get_ids(), ['4', '5', '1', '2', '3'])
+
+    def test_80_reorder(self):
+        """Test moving several items at once and replacing the order"""
+        l = self.ps.scored_sorted_feed("sortedfeed")
+        l.append_many(['a', 'b', 'c', 'd'])
+        self.assertEqual(l.move_many([('begin:', '4'), ('1:', '3')]), 2)
+        self.assertEqual(l.get_ids(), ['4', '1', '3', '2'])
+        l.reorder(['2', '3', '1', '4'])
+        self.assertEqual(l.get_ids(), ['2', '3', '1', '4'])
+        self.assertRaises(ValueError, l.reorder, ['1'])
+
+
+suite = unittest.TestLoader().loadTestsFromTestCase(TestScoredSortedFeed)
@@ -0,0 +1,123 @@
+import thoonk
+from thoonk.sharding import HashRing
+import unittest
+import threading
+import redis
+from ConfigParser import ConfigParser
+
+
+class TestSharding(unittest.TestCase):
+
+    def setUp(self):
+        conf = ConfigParser()
+        conf.read('test.cfg')
+        if conf.sections() == ['Test']:
+            self.host = conf.get('Test', 'host')
+            self.port = conf.getint('Test', 'port')
+            self.db = conf.getint('Test', 'db')
+            self.shards = ['redis://%s:%s/%s' % (self.host, self.port,
+                                                 self.db + i)
+                           for i in (1, 2)]
+            for db in (self.db, self.db + 1, self.db + 2):
+                redis.StrictRedis(host=self.host, port=self.port,
+                                  db=db).flushdb()
+        else:
+            print 'No test configuration found in test.cfg'
+            exit()
+
+    def _receive(self, ps, publish, count):
+        received = []
+        event = threading.Event()
+        def publish_handler(feed, item, id):
+            received.append((feed, item))
+            if len(received) == count:
+                event.set()
+
+        ps.register_handler('publish', publish_handler)
+        publish()
+        event.wait(2)
+        ps.remove_handler('publish', publish_handler)
+        return sorted(received)
+
+    def test_01_hash_ring(self):
+        """Test consistent hashing moves few feeds when a node is added"""
+        names = ['feed%s' % i for i in range(1000)]
+        before = HashRing({'a': 'a', 'b': 'b', 'c': 'c'})
+        after = HashRing({'a': 'a', 'b': 'b', 'c': 'c', 'd': 'd'})
+        placed = [before.get(name) for name in names]
+        self.assertEqual(set(placed), set(['a', 'b', 'c']))
+        self.assertTrue(min(placed.count(node) for node in 'abc') > 200)
+        moved = [name for name in names if before.get(name) != after.get(name)]
+        self.assertTrue(all(after.get(name) == 'd' for name in moved))
+        self.assertTrue(len(moved) < 400)
+
+    def test_02_hash_tags(self):
+        """Test hash tagged keys and notices"""
+        ps = thoonk.Thoonk(self.host, self.port, self.db, listen=True,
+                           hash_tags=True)
+        try:
+            feed = ps.feed('tagged')
+            sorted_feed = ps.sorted_feed('taggedsorted')
+            job = ps.job('taggedjob')
+            received = self._receive(ps, lambda: (feed.publish('a'),
+                                                  sorted_feed.append('b'),
+                                                  job.put('c')), 3)
+            self.assertEqual(received, [('tagged', 'a'),
+                                        ('taggedjob', 'c'),
+                                        ('taggedsorted', 'b')])
+            self.assertTrue(ps.redis.exists('feed.ids:{tagged}'))
+            self.assertFalse(ps.redis.exists('feed.ids:tagged'))
+            id = job.get(timeout=1)[0]
+            job.finish(id)
+            ps.delete_feed('tagged')
+            self.assertFalse(ps.redis.exists('feed.ids:{tagged}'))
+            self.assertFalse(ps.feed_exists('tagged'))
+        finally:
+            ps.close()
+
+    def test_03_shards(self):
+        """Test feeds spread over shards"""
+        ps = thoonk.Thoonk(self.host, self.port, self.db, listen=True,
+                           shards=self.shards)
+        try:
+            names = ['shard%s' % i for i in range(10)]
+            feeds = [ps.feed(name) for name in names]
+            received = self._receive(
+                ps, lambda: [feed.publish(feed.feed) for feed in feeds], 10)
+            self.assertEqual(received, sorted(zip(names, names)))
+
+            dbs = [ps.redis_for(name).connection_pool.connection_kwargs['db']
+                   for name in names]
+            self.assertEqual(set(dbs), set([self.db + 1, self.db + 2]))
+            for name, db in zip(names, dbs):
+                self.assertTrue(redis.StrictRedis(
+                    host=self.host, port=self.port, db=db).exists(
+                        'feed.ids:%s' % name))
+            self.assertFalse(ps.redis.exists('feed.ids:shard0'))
+            self.assertEqual(ps.get_feed_names(), set(names))
+
+            queue = ps.queue('shardqueue')
+            queue.put('x')
+            self.assertEqual(queue.get(timeout=1), 'x')
+
+            ps.delete_feed('shard0')
+            self.assertFalse(ps.redis_for('shard0').exists('feed.ids:shard0'))
+        finally:
+            ps.close()
+
+    def test_04_shards_with_patterns(self):
+        """Test pattern listeners receive notices from every shard"""
+        ps = thoonk.Thoonk(self.host, self.port, self.db, listen=True,
+                           listen_patterns=True, hash_tags=True,
+                           shards=self.shards)
+        try:
+            names = ['pattern%s' % i for i in range(6)]
+            feeds = [ps.feed(name) for name in names]
+            received = self._receive(
+                ps, lambda: [feed.publish(feed.feed) for feed in feeds], 6)
+            self.assertEqual(received, sorted(zip(names, names)))
+        finally:
+            ps.close()
+
+
+suite = unittest.TestLoader().loadTestsFromTestCase(TestSharding)
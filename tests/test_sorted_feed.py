@@ -1,5 +1,6 @@
 import thoonk
 from thoonk.feeds import SortedFeed
+from thoonk.feeds.sorted_feed import SORTED_INSERT
 import unittest
 from ConfigParser import ConfigParser
 
@@ -140,5 +141,74 @@ class TestLeaf(unittest.TestCase):
         self.assertEqual(r, ['1', '4', '2', '3'],
                 "Sorted feed results don't match: %s" % r)
 
+    def test_80_sorted_feed_range(self):
+        """Test reading a slice of the feed in order."""
+        l = self.ps.sorted_feed('sortedfeed')
+        for x in range(10):
+            l.publish(str(x))
+        l.move_first('10')
+        r = l.get_range(0, 3)
+        self.assertEqual(r, [('10', '9'), ('1', '0'), ('2', '1')],
+                "Sorted feed range doesn't match: %s" % r)
+        self.assertEqual(l.get_range(-2), [('8', '7'), ('9', '8')])
+        self.assertEqual(l.get_range(3, 0), [])
+        self.assertEqual(l.get_range(20, 30), [])
+
+    def test_81_sorted_feed_iter(self):
+        """Test iterating over the feed in order."""
+        l = self.ps.sorted_feed('sortedfeed')
+        for x in range(10):
+            l.publish(str(x))
+        r = list(l.iter_items(batch_size=3))
+        self.assertEqual(r, [(str(x + 1), str(x)) for x in range(10)],
+                "Sorted feed iteration doesn't match: %s" % r)
+
+    def test_90_sorted_feed_many(self):
+        """Test adding batches of items to either end of the feed."""
+        l = self.ps.sorted_feed('sortedfeed')
+        l.publish("hi")
+        self.assertEqual(l.append_many(['a', 'b']), [2, 3])
+        self.assertEqual(l.prepend_many(['c', 'd']), [4, 5])
+        self.assertEqual(l.append_many([]), [])
+        r = l.get_ids()
+        self.assertEqual(r, ['4', '5', '1', '2', '3'],
+                "Sorted feed results don't match: %s" % r)
+        self.assertEqual(l.get_item('5'), 'd')
+
+    def test_91_sorted_feed_move_many(self):
+        """Test moving several items at once."""
+        l = self.ps.sorted_feed('sortedfeed')
+        l.append_many(['a', 'b', 'c', 'd'])
+        n = l.move_many([('begin:', '4'), ('1:', '3'), (':end', '42')])
+        self.assertEqual(n, 2)
+        r = l.get_ids()
+        self.assertEqual(r, ['4', '1', '3', '2'],
+                "Sorted feed results don't match: %s" % r)
+
+    def test_92_sorted_feed_reorder(self):
+        """Test replacing the order of the feed."""
+        l = self.ps.sorted_feed('sortedfeed')
+        l.append_many(['a', 'b', 'c'])
+        l.reorder(['3', '1', '2'])
+        self.assertEqual(l.get_ids(), ['3', '1', '2'])
+        self.assertRaises(ValueError, l.reorder, ['1', '2'])
+        self.assertRaises(ValueError, l.reorder, ['1', '1', '2'])
+        self.assertEqual(l.get_ids(), ['3', '1', '2'])
+
+    def test_93_sorted_feed_scripts(self):
+        """Test Lua scripts are reloaded after the script cache is flushed."""
+        l = self.ps.sorted_feed("sortedfeed")
+        SORTED_INSERT.reset()
+        l.append("a")
+        self.ps.redis.script_flush()
+        l.append("b")
+        l.append("c")
+        self.assertEqual([item for id, item in l.get_range()],
+                         ["a", "b", "c"])
+        stats = self.ps.script_stats()['sorted_insert']
+        self.assertEqual((stats['calls'], stats['errors']), (3, 0))
+        self.assertTrue(1 <= stats['reloads'] <= 2)
+        self.assertTrue(stats['max_time'] >= stats['mean_time'] > 0)
+
 
 suite = unittest.TestLoader().loadTestsFromTestCase(TestLeaf)
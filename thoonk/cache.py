@@ -3,39 +3,101 @@
     Released under the terms of the MIT License
 """
 
+import collections
 import threading
-import uuid
+import time
 from thoonk.exceptions import FeedDoesNotExist
 
+
+class _Entry(object):
+
+    """
+    A cached feed object, or a record that a feed does not exist.
+
+    Attributes:
+        feed    -- The feed object, or None for a missing feed.
+        expires -- The time a missing feed record runs out.
+        used    -- Set on every hit, and cleared when the entry is
+                   given a second chance instead of being evicted.
+    """
+
+    __slots__ = ('feed', 'expires', 'used')
+
+    def __init__(self, feed, expires=None):
+        self.feed = feed
+        self.expires = expires
+        self.used = False
+
+
+class _Fetch(object):
+
+    """
+    A lookup of a feed's type in progress, which threads missing the
+    same feed wait for instead of starting their own.
+
+    Attributes:
+        done  -- An event set when the lookup has finished.
+        feed  -- The feed object, or None if the feed does not exist.
+        error -- The exception raised by the lookup, if any.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.feed = None
+        self.error = None
+
+
 class FeedCache(object):
 
     """
     The FeedCache class stores an in-memory version of each
-    feed. As there may be multiple systems using
-    Thoonk with the same Redis server, and each with its own
-    FeedCache instance, each FeedCache has a self.instance
-    field to uniquely identify itself.
+    feed, so that the type of a feed is not looked up in Redis
+    every time the feed is used.
+
+    Hits take no lock. On a miss, only one thread looks up the feed's
+    type while other threads asking for the same feed wait for its
+    answer, and lookups of different feeds run in parallel. Feeds that
+    do not exist are remembered for negative_ttl seconds.
+
+    The cache holds at most size feeds. When it is full, the feed
+    added longest ago is evicted, unless it was used since it was last
+    considered, in which case it gets a second chance; this
+    approximates evicting the least recently used feed without
+    reordering the cache on every hit.
 
     Attributes:
-        thoonk   -- The main Thoonk object.
-        instance -- A hex string for uniquely identifying this
-                    FeedCache instance.
+        thoonk       -- The main Thoonk object.
+        size         -- The maximum number of cached feeds.
+        negative_ttl -- Seconds a missing feed is remembered.
 
     Methods:
         invalidate -- Force a feed's config to be retrieved from
                       Redis instead of in-memory.
+        stats      -- Return the cache counters.
     """
 
-    def __init__(self, thoonk):
+    def __init__(self, thoonk, size=10000, negative_ttl=1.0):
         """
         Create a new configuration cache.
 
         Arguments:
-            thoonk -- The main Thoonk object.
+            thoonk       -- The main Thoonk object.
+            size         -- The maximum number of cached feeds.
+            negative_ttl -- Seconds a missing feed is remembered.
         """
-        self._feeds = {}
+        self._feeds = collections.OrderedDict()
+        self._fetches = {}
         self.thoonk = thoonk
+        self.size = size
+        self.negative_ttl = negative_ttl
         self.lock = threading.Lock()
+        # Hits are counted without the lock, so the counters may fall
+        # slightly short under heavy concurrency.
+        self._hits = 0
+        self._negative_hits = 0
+        self._misses = 0
+        self._coalesced = 0
+        self._evictions = 0
 
     def __getitem__(self, feed):
         """
@@ -44,16 +106,110 @@ class FeedCache(object):
         Arguments:
             feed -- The name of the requested feed.
         """
-        with self.lock:
-            if feed not in self._feeds:
-                feed_type = self.thoonk.redis.hget('feed.config:%s' % feed, "type")
-                if not feed_type:
-                    raise FeedDoesNotExist
-                self._feeds[feed] = self.thoonk.feedtypes[feed_type](self.thoonk, feed)
-            return self._feeds[feed]
-    
+        entry = self._feeds.get(feed)
+        if entry is not None:
+            if entry.feed is not None:
+                entry.used = True
+                self._hits += 1
+                return entry.feed
+            if entry.expires > time.time():
+                self._negative_hits += 1
+                raise FeedDoesNotExist
+        return self._fetch(feed)
+
     def __delitem__(self, feed):
+        self.invalidate(feed)
+
+    def invalidate(self, feed):
+        """
+        Forget a feed, so that its type is looked up again on next use.
+
+        Arguments:
+            feed -- The name of the feed.
+        """
+        with self.lock:
+            self._feeds.pop(feed, None)
+            self._fetches.pop(feed, None)
+
+    def stats(self):
+        """
+        Return a dictionary with the number of feeds 'cached', and the
+        number of 'hits', 'negative_hits' on missing feeds, 'misses'
+        looked up in Redis, misses 'coalesced' into a lookup already in
+        progress, and 'evictions'.
+        """
+        with self.lock:
+            return {'cached': len(self._feeds),
+                    'hits': self._hits,
+                    'negative_hits': self._negative_hits,
+                    'misses': self._misses,
+                    'coalesced': self._coalesced,
+                    'evictions': self._evictions}
+
+    def _fetch(self, feed):
+        """
+        Look up a feed missing from the cache, or wait for the lookup
+        already in progress for it.
+
+        Arguments:
+            feed -- The name of the feed.
+        """
         with self.lock:
-            if feed in self._feeds:
-                self._feeds[feed].delete()
-                del self._feeds[feed]
+            entry = self._feeds.get(feed)
+            if entry is not None and entry.feed is not None:
+                return entry.feed
+            fetch = self._fetches.get(feed)
+            owner = fetch is None
+            if owner:
+                fetch = self._fetches[feed] = _Fetch()
+                self._misses += 1
+            else:
+                self._coalesced += 1
+
+        if not owner:
+            fetch.done.wait()
+        else:
+            try:
+                feed_type = self.thoonk.redis_for(feed).hget(
+                    'feed.config:%s' % self.thoonk.key_name(feed), "type")
+                if feed_type:
+                    fetch.feed = self.thoonk.feedtypes[feed_type](self.thoonk,
+                                                                  feed)
+            except Exception as e:
+                fetch.error = e
+            with self.lock:
+                # an invalidation during the lookup discards its result
+                if self._fetches.get(feed) is fetch:
+                    del self._fetches[feed]
+                    if fetch.error is None:
+                        self._store(feed, fetch.feed)
+            fetch.done.set()
+
+        if fetch.error is not None:
+            raise fetch.error
+        if fetch.feed is None:
+            raise FeedDoesNotExist
+        return fetch.feed
+
+    def _store(self, feed, instance):
+        """
+        Add a feed, or a record that it is missing, to the cache,
+        evicting feeds if it is full. Called with the lock held.
+
+        Arguments:
+            feed     -- The name of the feed.
+            instance -- The feed object, or None if the feed is missing.
+        """
+        if instance is None:
+            entry = _Entry(None, time.time() + self.negative_ttl)
+        else:
+            entry = _Entry(instance)
+        self._feeds.pop(feed, None)
+        self._feeds[feed] = entry
+        while len(self._feeds) > self.size:
+            name, oldest = self._feeds.popitem(last=False)
+            if oldest.used and name != feed:
+                oldest.used = False
+                self._feeds[name] = oldest
+            else:
+                self._evictions += 1
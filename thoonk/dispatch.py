@@ -0,0 +1,339 @@
+"""
+    Written by Nathan Fritz and Lance Stout. Copyright 2011 by &yet, LLC.
+    Released under the terms of the MIT License
+"""
+
+import collections
+import logging
+import threading
+import time
+import zlib
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+log = logging.getLogger(__name__)
+
+
+class OrderedDispatcher(object):
+
+    """
+    An OrderedDispatcher runs event handlers on a pool of worker
+    threads instead of the listener thread.
+
+    Every event carries a key, normally the name of the feed it is
+    about. Events with the same key are always handled by the same
+    worker, so they are handled one at a time in the order they were
+    received, while events for different keys are handled in parallel.
+
+    Each worker has a bounded queue. When a worker falls behind and
+    its queue fills up, dispatching blocks until there is room again,
+    slowing the listener down instead of buffering without limit.
+
+    Attributes:
+        workers -- The worker threads.
+
+    Methods:
+        dispatch -- Queue handlers to be called for an event.
+        stop     -- Finish handling queued events and stop the workers.
+    """
+
+    def __init__(self, workers=4, queue_size=1000):
+        """
+        Create a new dispatcher and start its worker threads.
+
+        Arguments:
+            workers    -- The number of worker threads.
+            queue_size -- The maximum number of events waiting for
+                          each worker.
+        """
+        self._queues = [queue.Queue(queue_size) for x in range(workers)]
+        self.workers = []
+        for q in self._queues:
+            worker = threading.Thread(target=self._work, args=(q,))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def dispatch(self, key, handlers, args):
+        """
+        Queue a set of handlers to be called for an event.
+
+        Arguments:
+            key      -- The ordering key for the event, such as the
+                        feed name.
+            handlers -- A sequence of functions to call.
+            args     -- The arguments to pass to each handler.
+        """
+        index = zlib.crc32(key) % len(self._queues)
+        self._queues[index].put((handlers, args))
+
+    def stop(self):
+        """Finish handling the queued events and stop the workers."""
+        for q in self._queues:
+            q.put(None)
+        for worker in self.workers:
+            worker.join()
+
+    def _work(self, q):
+        """
+        Call the handlers for queued events until stopped.
+
+        Arguments:
+            q -- The queue of events for this worker.
+        """
+        while True:
+            event = q.get()
+            if event is None:
+                return
+            handlers, args = event
+            for handler in handlers:
+                try:
+                    handler(*args)
+                except Exception:
+                    log.exception('Error in event handler %r', handler)
+
+
+class BatchHandler(object):
+
+    """
+    A BatchHandler collects the events for a feed and passes them to
+    a handler as a list, instead of calling the handler once per event.
+
+    A feed's batch is delivered once it holds max_size events, or
+    max_wait seconds after its first event arrived, whichever comes
+    first. The handler is called as handler(feed, events), where events
+    is a list of the argument tuples of each event, without the feed
+    name. Batches are delivered on the BatchHandler's own thread, one
+    at a time, in the order they were completed.
+
+    When coalescing, an event for an item ID that is already in the
+    pending batch replaces the earlier event in place, so each ID
+    appears at most once per batch with its latest arguments.
+
+    Methods:
+        stop -- Deliver the pending batches and stop the thread.
+    """
+
+    def __init__(self, handler, max_size=100, max_wait=0.05, id_index=None):
+        """
+        Create a new batch handler and start its delivery thread.
+
+        Arguments:
+            handler  -- The function to call with each batch.
+            max_size -- The maximum number of events in a batch.
+            max_wait -- The maximum number of seconds an event waits
+                        before its batch is delivered.
+            id_index -- Optional position of the item ID in the event
+                        arguments, after the feed name. When given,
+                        events for the same ID are coalesced.
+        """
+        self.handler = handler
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self.id_index = id_index
+        self._batches = {}
+        self._ready = []
+        self._stopped = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __call__(self, feed, *args):
+        """
+        Add an event to its feed's batch.
+
+        Arguments:
+            feed -- The name of the feed.
+            args -- The remaining event arguments.
+        """
+        with self._cond:
+            batch = self._batches.get(feed)
+            if batch is None:
+                batch = (time.time() + self.max_wait, [], {})
+                self._batches[feed] = batch
+                self._cond.notify()
+            _, events, positions = batch
+            if self.id_index is not None:
+                id = args[self.id_index]
+                if id in positions:
+                    events[positions[id]] = args
+                    return
+                positions[id] = len(events)
+            events.append(args)
+            if len(events) >= self.max_size:
+                del self._batches[feed]
+                self._ready.append((feed, events))
+                self._cond.notify()
+
+    def stop(self):
+        """Deliver the pending batches and stop the delivery thread."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._thread.join()
+
+    def _run(self):
+        """Deliver batches as they fill up or expire, until stopped."""
+        while True:
+            with self._cond:
+                while True:
+                    now = time.time()
+                    for feed, batch in list(self._batches.items()):
+                        if batch[0] <= now or self._stopped:
+                            del self._batches[feed]
+                            self._ready.append((feed, batch[1]))
+                    if self._ready or self._stopped:
+                        break
+                    wait = None
+                    if self._batches:
+                        wait = min(batch[0] for batch
+                                   in self._batches.values()) - now
+                    self._cond.wait(wait)
+                ready, self._ready = self._ready, []
+                stopped = self._stopped
+            for feed, events in ready:
+                try:
+                    self.handler(feed, events)
+                except Exception:
+                    log.exception('Error in batch handler %r', self.handler)
+            if stopped:
+                return
+
+
+class EventBuffer(object):
+
+    """
+    An EventBuffer holds received messages between the listener thread
+    reading them from Redis and a delivery thread handling them, so a
+    slow handler does not leave messages piling up in Redis, where the
+    connection would be dropped once its output buffer limit is hit.
+
+    The buffer holds at most size entries. New entries are handled
+    according to the policy:
+
+        block       -- Wait for room when full, leaving further
+                       messages in Redis.
+        drop_oldest -- Discard the oldest entry to make room when full.
+        coalesce    -- Replace a waiting entry with the same key, such
+                       as a notice for the same item, with the new one,
+                       whether or not the buffer is full. Entries
+                       without a waiting match wait for room when full.
+
+    Attributes:
+        size   -- The maximum number of entries.
+        policy -- The policy for new entries.
+
+    Methods:
+        put   -- Add an entry to be handled.
+        stats -- Return the buffer counters.
+        stop  -- Handle the remaining entries and stop.
+    """
+
+    BLOCK = 'block'
+    DROP_OLDEST = 'drop_oldest'
+    COALESCE = 'coalesce'
+
+    def __init__(self, size=10000, policy=BLOCK):
+        """
+        Create a new buffer and start its delivery thread.
+
+        Arguments:
+            size   -- The maximum number of entries.
+            policy -- One of 'block', 'drop_oldest' or 'coalesce'.
+        """
+        if policy not in (self.BLOCK, self.DROP_OLDEST, self.COALESCE):
+            raise ValueError('Unknown buffer policy: %s' % policy)
+        self.size = size
+        self.policy = policy
+        self._entries = collections.deque()
+        self._keys = {}
+        self._dropped = 0
+        self._coalesced = 0
+        self._stopped = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, func, args, key=None):
+        """
+        Add an entry to be handled by calling func(*args).
+
+        Arguments:
+            func -- The function to call.
+            args -- The arguments to pass to the function.
+            key  -- Optional key identifying entries that may replace
+                    each other under the coalesce policy.
+        """
+        with self._cond:
+            if self.policy == self.COALESCE and key is not None:
+                entry = self._keys.get(key)
+                if entry is not None:
+                    entry[1] = func
+                    entry[2] = args
+                    self._coalesced += 1
+                    return
+            if self.policy == self.DROP_OLDEST:
+                while len(self._entries) >= self.size:
+                    self._discard(self._entries.popleft())
+                    self._dropped += 1
+            else:
+                while len(self._entries) >= self.size and not self._stopped:
+                    self._cond.wait()
+            entry = [key, func, args, time.time()]
+            if key is not None and self.policy == self.COALESCE:
+                self._keys[key] = entry
+            self._entries.append(entry)
+            self._cond.notify_all()
+
+    def stats(self):
+        """
+        Return a dictionary with the number of entries 'buffered', the
+        total 'dropped' and 'coalesced', and the 'lag' in seconds of the
+        oldest waiting entry.
+        """
+        with self._cond:
+            lag = 0.0
+            if self._entries:
+                lag = time.time() - self._entries[0][3]
+            return {'buffered': len(self._entries),
+                    'dropped': self._dropped,
+                    'coalesced': self._coalesced,
+                    'lag': lag}
+
+    def stop(self):
+        """Handle the remaining entries and stop the delivery thread."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def _discard(self, entry):
+        """
+        Forget the key of an entry leaving the buffer.
+
+        Arguments:
+            entry -- The entry.
+        """
+        if entry[0] is not None and self._keys.get(entry[0]) is entry:
+            del self._keys[entry[0]]
+
+    def _run(self):
+        """Handle entries in order until stopped."""
+        while True:
+            with self._cond:
+                while not self._entries and not self._stopped:
+                    self._cond.wait()
+                if not self._entries:
+                    return
+                entry = self._entries.popleft()
+                self._discard(entry)
+                self._cond.notify_all()
+            try:
+                entry[1](*entry[2])
+            except Exception:
+                log.exception('Error handling event %r', entry[2])
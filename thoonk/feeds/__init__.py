@@ -8,3 +8,4 @@ from thoonk.feeds.queue import Queue
 from thoonk.feeds.pyqueue import PythonQueue
 from thoonk.feeds.job import Job
 from thoonk.feeds.sorted_feed import SortedFeed
+from thoonk.feeds.scored_sorted_feed import ScoredSortedFeed
@@ -11,6 +11,7 @@ except ImportError:
     import Queue as queue
 
 from thoonk.exceptions import *
+from thoonk.notify import item_notice
 import redis.exceptions
 
 class Feed(object):
@@ -36,6 +37,15 @@ class Feed(object):
         feed.config:[feed]    -- A JSON string of configuration data.
         feed.edit:[feed]      -- A pubsub channel for edit notices.
 
+    Setting the 'notify' config field to 'id' makes publish and edit
+    notices carry only the item ID, the value of feed.publishes and the
+    size of the item instead of the whole item. Listeners then pass a
+    LazyItem to handlers, which fetches the item when first used.
+
+    Setting the 'framing' config field to 'binary' sends publish and
+    edit notices as length prefixed binary frames instead of joining
+    their fields with NUL bytes, so items may contain NUL bytes.
+
     Thoonk.py Implementation API:
         get_channels  -- Return the standard pubsub channels for this feed.
         event_publish -- Process publication events.
@@ -47,6 +57,7 @@ class Feed(object):
         get_ids  -- Return the IDs of all items in the feed.
         get_item -- Return a single item from the feed given its ID.
         get_all  -- Return all items in the feed.
+        get_since -- Return the items published or edited after a time.
         publish  -- Publish a new item to the feed, or edit an existing item.
         retract  -- Remove an item from the feed.
     """
@@ -65,16 +76,17 @@ class Feed(object):
             config -- Optional dictionary of configuration values.
         """
         self.thoonk = thoonk
-        self.redis = thoonk.redis
+        self.redis = thoonk.redis_for(feed)
         self.feed = feed
+        name = thoonk.key_name(feed)
 
-        self.feed_ids = 'feed.ids:%s' % feed
-        self.feed_items = 'feed.items:%s' % feed
-        self.feed_publish = 'feed.publish:%s' % feed
-        self.feed_publishes = 'feed.publishes:%s' % feed
-        self.feed_retract = 'feed.retract:%s' % feed
-        self.feed_config = 'feed.config:%s' % feed
-        self.feed_edit = 'feed.edit:%s' % feed
+        self.feed_ids = 'feed.ids:%s' % name
+        self.feed_items = 'feed.items:%s' % name
+        self.feed_publish = 'feed.publish:%s' % name
+        self.feed_publishes = 'feed.publishes:%s' % name
+        self.feed_retract = 'feed.retract:%s' % name
+        self.feed_config = 'feed.config:%s' % name
+        self.feed_edit = 'feed.edit:%s' % name
 
     # Thoonk.py Implementation API
     # =================================================================
@@ -108,6 +120,17 @@ class Feed(object):
         """
         pass
 
+    def _reader(self, consistent=False):
+        """
+        Return the Redis connection for a read only call, which may be
+        a replica unless consistency is required.
+
+        Arguments:
+            consistent -- Flag indicating if the feed's own server must
+                          be read instead of a replica.
+        """
+        return self.thoonk.read_redis_for(self.feed, consistent)
+
     def delete_feed(self):
         """Delete the feed and its contents."""
         self.thoonk.delete_feed(self.feed)
@@ -121,26 +144,62 @@ class Feed(object):
     # Thoonk Standard API
     # =================================================================
 
-    def get_ids(self):
-        """Return the set of IDs used by items in the feed."""
-        return self.redis.zrange(self.feed_ids, 0, -1)
+    def get_ids(self, consistent=False):
+        """
+        Return the set of IDs used by items in the feed.
+
+        Arguments:
+            consistent -- Flag indicating if the feed's own server must
+                          be read instead of a replica.
+        """
+        return self._reader(consistent).zrange(self.feed_ids, 0, -1)
 
-    def get_item(self, id=None):
+    def get_item(self, id=None, consistent=False):
         """
         Retrieve a single item from the feed.
 
         Arguments:
-            id -- The ID of the item to retrieve.
+            id         -- The ID of the item to retrieve.
+            consistent -- Flag indicating if the feed's own server must
+                          be read instead of a replica.
         """
+        reader = self._reader(consistent)
         if id is None:
-            self.redis.hget(self.feed_items,
-                            self.redis.lindex(self.feed_ids, 0))
+            reader.hget(self.feed_items, reader.lindex(self.feed_ids, 0))
         else:
-            return self.redis.hget(self.feed_items, id)
+            return reader.hget(self.feed_items, id)
+
+    def get_all(self, consistent=False):
+        """
+        Return all items from the feed.
+
+        Arguments:
+            consistent -- Flag indicating if the feed's own server must
+                          be read instead of a replica.
+        """
+        return self._reader(consistent).hgetall(self.feed_items)
+
+    def get_since(self, since, consistent=False):
+        """
+        Return the items published or edited since a given time, oldest
+        first, as a list of (id, item, time) tuples.
 
-    def get_all(self):
-        """Return all items from the feed."""
-        return self.redis.hgetall(self.feed_items)
+        Items are found by their publication times in feed.ids, so an
+        edited item is returned with the time of its latest edit.
+
+        Arguments:
+            since      -- The Unix time to return items from, inclusive.
+            consistent -- Flag indicating if the feed's own server must
+                          be read instead of a replica.
+        """
+        reader = self._reader(consistent)
+        published = reader.zrangebyscore(self.feed_ids, since, '+inf',
+                                          withscores=True)
+        if not published:
+            return []
+        items = reader.hmget(self.feed_items, [id for id, _ in published])
+        return [(id, item, at) for (id, at), item in zip(published, items)
+                if item is not None]
 
     def publish(self, item, id=None):
         """
@@ -161,8 +220,13 @@ class Feed(object):
         if publish_id is None:
             publish_id = uuid.uuid4().hex
         
+        notify = []
+
         def _publish(pipe):
-            max = int(pipe.hget(self.feed_config, "max_length") or 0)
+            max, mode, framing = pipe.hmget(self.feed_config, "max_length",
+                                            "notify", "framing")
+            max = int(max or 0)
+            notify[:] = [mode, framing]
             if max > 0:
                 delete_ids = pipe.zrange(self.feed_ids, 0, -max)
                 pipe.multi()
@@ -178,12 +242,14 @@ class Feed(object):
             pipe.hset(self.feed_items, publish_id, item)
         
         results = self.redis.transaction(_publish, self.feed_ids)
-        
+        notice = item_notice(notify[0], publish_id, item, results[-2],
+                             notify[1])
+
         if results[-3]:
             # If zadd was successful
-            self.thoonk._publish(self.feed_publish, (publish_id, item))
+            self.redis.publish(self.feed_publish, notice)
         else:
-            self.thoonk._publish(self.feed_edit, (publish_id, item))
+            self.redis.publish(self.feed_edit, notice)
 
         return publish_id
 
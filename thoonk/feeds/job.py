@@ -3,12 +3,155 @@
     Released under the terms of the MIT License
 """
 
+import hashlib
+import math
 import time
 import uuid
 
+from thoonk import histogram, scripts
+from thoonk.notify import NOTIFY_LIB, item_notice
 from thoonk.feeds import Queue
 from thoonk.feeds.queue import Empty
 
+
+# Seconds the rate limit config of a job feed is cached for. Listening
+# Thoonk instances also forget it as soon as the config changes.
+RATE_LIMIT_CONFIG_TTL = 1.0
+
+# Take a token from a feed's dispatch token bucket for a popped job.
+#
+# KEYS: feed.ratelimit:[feed], feed.ids:[feed]
+# ARGV: rate (tokens/sec), burst, now (ms), id
+#
+# The bucket is refilled based on the time elapsed since the last call.
+# If a token is available it is taken and 0 is returned. Otherwise the
+# job is pushed back onto the end of the queue it was popped from, and
+# the number of milliseconds until the next token is due is returned.
+# No token is ever held by a worker that has not claimed a job.
+RATE_LIMIT_CLAIM = scripts.register('rate_limit_claim', """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('hmget', KEYS[1], 'tokens', 'stamp')
+local tokens = tonumber(state[1]) or burst
+local stamp = tonumber(state[2]) or now
+if now > stamp then
+    tokens = math.min(burst, tokens + (now - stamp) * rate / 1000)
+    stamp = now
+end
+if tokens >= 1 then
+    redis.call('hmset', KEYS[1], 'tokens', tokens - 1, 'stamp', stamp)
+    return 0
+end
+redis.call('hmset', KEYS[1], 'tokens', tokens, 'stamp', stamp)
+redis.call('rpush', KEYS[2], ARGV[4])
+return math.ceil((1 - tokens) * 1000 / rate)
+""")
+
+# Add a job unless a job with the same deduplication key is queued
+# or claimed.
+#
+# KEYS: feed.dedupe:[feed], feed.dedupeids:[feed], feed.ids:[feed],
+#       feed.publishes:[feed], feed.items:[feed], feed.published:[feed],
+#       feed.config:[feed]
+# ARGV: dedupe key, id, item, priority (1 or 0), now (ms)
+#
+# Returns a pair of a flag indicating if the job was added and the ID
+# of the new or existing job.
+JOB_PUT_DEDUPE = scripts.register('job_put_dedupe', NOTIFY_LIB + """
+local existing = redis.call('hget', KEYS[1], ARGV[1])
+if existing then
+    return {0, existing}
+end
+redis.call('hset', KEYS[1], ARGV[1], ARGV[2])
+redis.call('hset', KEYS[2], ARGV[2], ARGV[1])
+if ARGV[4] == '1' then
+    redis.call('rpush', KEYS[3], ARGV[2])
+else
+    redis.call('lpush', KEYS[3], ARGV[2])
+end
+local version = redis.call('incr', KEYS[4])
+redis.call('hset', KEYS[5], ARGV[2], ARGV[3])
+redis.call('zadd', KEYS[6], ARGV[5], ARGV[2])
+redis.call('publish', KEYS[4],
+           item_notice(notice_format(KEYS[7]), ARGV[2], ARGV[3], version))
+return {1, ARGV[2]}
+""")
+
+# Add a batch of jobs.
+#
+# KEYS: feed.ids:[feed], feed.publishes:[feed], feed.items:[feed],
+#       feed.published:[feed], feed.config:[feed]
+# ARGV: priority (1 or 0), now (ms), followed by pairs of ID and item
+JOB_PUT_MANY = scripts.register('job_put_many', NOTIFY_LIB + """
+local push = ARGV[1] == '1' and 'rpush' or 'lpush'
+for i = 3, #ARGV, 2 do
+    redis.call(push, KEYS[1], ARGV[i])
+    redis.call('hset', KEYS[3], ARGV[i], ARGV[i + 1])
+    redis.call('zadd', KEYS[4], ARGV[2], ARGV[i])
+end
+local n = (#ARGV - 2) / 2
+local version = redis.call('incrby', KEYS[2], n) - n
+local format = notice_format(KEYS[5])
+for i = 3, #ARGV, 2 do
+    version = version + 1
+    redis.call('publish', KEYS[2],
+               item_notice(format, ARGV[i], ARGV[i + 1], version))
+end
+""")
+
+# Requeue a batch of the jobs claimed by a worker whose heartbeat
+# has expired.
+#
+# KEYS: feed.worker:[feed]:[worker], feed.workerclaims:[feed]:[worker],
+#       feed.workers:[feed], feed.claimedby:[feed], feed.claimed:[feed],
+#       feed.cancelled:[feed], feed.ids:[feed]
+# ARGV: worker, batch size
+#
+# Nothing is done if the worker's heartbeat is still alive. The worker
+# is unregistered once all of its claims have been handled. Returns the
+# number of claims examined and the number of jobs requeued.
+JOB_REAP_WORKER = scripts.register('job_reap_worker', """
+if redis.call('exists', KEYS[1]) == 1 then
+    return {0, 0}
+end
+local ids = redis.call('zrange', KEYS[2], 0, tonumber(ARGV[2]) - 1)
+local requeued = 0
+for i, id in ipairs(ids) do
+    redis.call('zrem', KEYS[2], id)
+    if redis.call('hget', KEYS[4], id) == ARGV[1] then
+        redis.call('hdel', KEYS[4], id)
+        if redis.call('zrem', KEYS[5], id) == 1 then
+            redis.call('hincrby', KEYS[6], id, 1)
+            redis.call('lpush', KEYS[7], id)
+            requeued = requeued + 1
+        end
+    end
+end
+if redis.call('zcard', KEYS[2]) == 0 then
+    redis.call('srem', KEYS[3], ARGV[1])
+end
+return {#ids, requeued}
+""")
+
+# Read what finishing, cancelling, stalling or retracting a job needs
+# to know about it, in a single round trip.
+#
+# KEYS: feed.claimed:[feed], feed.items:[feed], feed.dedupeids:[feed],
+#       feed.claimedby:[feed], feed.config:[feed]
+# ARGV: id
+#
+# Returns the time the job was claimed, a flag indicating if the job
+# exists, its deduplication key, the worker that claimed it and the
+# framing config of the feed. Missing values are returned as nil.
+JOB_STATE = scripts.register('job_state', """
+return {redis.call('zscore', KEYS[1], ARGV[1]),
+        redis.call('hexists', KEYS[2], ARGV[1]),
+        redis.call('hget', KEYS[3], ARGV[1]),
+        redis.call('hget', KEYS[4], ARGV[1]),
+        redis.call('hget', KEYS[5], 'framing')}
+""")
+
 class Job(Queue):
 
     """
@@ -41,6 +184,36 @@ class Job(Queue):
         - The job item is completely removed from the queue and any
           other job states.
 
+    Rate Limiting:
+        Setting the 'rate_limit' configuration value to a number of
+        jobs per second caps how fast jobs are dispatched by self.get()
+        across all workers. Tokens are kept in a token bucket in Redis
+        which holds up to 'rate_burst' tokens (defaults to one second's
+        worth). A token is taken atomically when a popped job is
+        claimed; if none is left, the job is put back at the head of
+        the queue and the worker sleeps until the next token is due
+        instead of polling.
+
+    Deduplication:
+        A job may be added with a deduplication key, either given
+        explicitly or derived from a hash of the job content. While a
+        job with the same key is queued, claimed or stalled, adding
+        another returns the existing job's ID instead. The key is
+        released once the job is finished or retracted.
+
+    Worker Registry:
+        Workers may register with the feed and keep a heartbeat key
+        alive while running. Jobs claimed by a registered worker record
+        the worker as their owner. When a worker's heartbeat expires,
+        self.reap_workers() (also run by self.maintenance()) moves the
+        jobs it held back into the queue.
+
+    Latency Statistics:
+        The time each job waits in the queue before being claimed and
+        the time between being claimed and finished are recorded into
+        histograms stored in Redis, shared by every process using the
+        feed. self.get_latency_stats() summarizes them.
+
     Redis Keys Used:
         feed.published:[feed] -- A time sorted set of queued jobs.
         feed.cancelled:[feed] -- A hash table of cancelled jobs.
@@ -49,6 +222,18 @@ class Job(Queue):
         feed.running:[feed]   -- A hash table of running jobs.
         feed.publishes:[feed] -- A count of the number of jobs published
         feed.finishes:[feed]  -- A count of the number of jobs finished
+        feed.ratelimit:[feed] -- A hash holding the dispatch token bucket.
+        feed.dedupe:[feed]    -- A hash of job IDs keyed by dedupe key.
+        feed.dedupeids:[feed] -- A hash of dedupe keys keyed by job ID.
+        feed.workers:[feed]   -- A set of registered worker IDs.
+        feed.worker:[feed]:[worker] -- An expiring worker heartbeat key.
+        feed.workerclaims:[feed]:[worker] -- A time sorted set of jobs
+                                 claimed by a worker.
+        feed.claimedby:[feed] -- A hash of worker IDs keyed by job ID.
+        feed.waittime:[feed]  -- A histogram of queue wait times.
+        feed.servicetime:[feed] -- A histogram of processing times.
+        feed.dispatched:[feed]:[second] -- A short lived count of jobs
+                                 dispatched during a given second.
         job.finish:[feed]    -- A pubsub channel for job results
 
     Thoonk.py Implementation API:
@@ -60,8 +245,20 @@ class Job(Queue):
         get         -- Retrieve the next job from the queue.
         get_ids     -- Return IDs of all jobs in the queue.
         get_result  -- Retrieve the result of a job.
+        get_dispatch_rate -- Return the number of jobs dispatched during
+                             the last full second.
+        get_latency_stats -- Return wait and processing time statistics.
+        get_workers       -- Return the IDs of registered workers.
+        get_worker_claims -- Return the IDs of jobs claimed by a worker.
+        heartbeat         -- Refresh a worker's heartbeat.
+        reap_workers      -- Requeue jobs held by expired workers.
+        register_worker   -- Register a worker with the feed.
+        unregister_worker -- Remove a worker and requeue its jobs.
+        reset_latency_stats -- Clear the wait and processing time
+                               statistics.
         maintenance -- Perform periodic house cleaning.
         put         -- Add a new job to the queue.
+        put_many    -- Add several new jobs to the queue at once.
         retract     -- Completely remove a job from use.
         retry       -- Resume execution of a stalled job.
         stall       -- Pause execution of a queued job.
@@ -81,35 +278,68 @@ class Job(Queue):
             config -- Optional dictionary of configuration values.
         """
         Queue.__init__(self, thoonk, feed)
-
-        self.feed_publishes = 'feed.publishes:%s' % feed
-        self.feed_published = 'feed.published:%s' % feed
-        self.feed_cancelled = 'feed.cancelled:%s' % feed
-        self.feed_retried = 'feed.retried:%s' % feed
-        self.feed_finishes = 'feed.finishes:%s' % feed
-        self.feed_claimed = 'feed.claimed:%s' % feed
-        self.feed_stalled = 'feed.stalled:%s' % feed
-        self.feed_running = 'feed.running:%s' % feed
+        name = thoonk.key_name(feed)
+
+        self.feed_publishes = 'feed.publishes:%s' % name
+        self.feed_published = 'feed.published:%s' % name
+        self.feed_cancelled = 'feed.cancelled:%s' % name
+        self.feed_retried = 'feed.retried:%s' % name
+        self.feed_finishes = 'feed.finishes:%s' % name
+        self.feed_claimed = 'feed.claimed:%s' % name
+        self.feed_stalled = 'feed.stalled:%s' % name
+        self.feed_running = 'feed.running:%s' % name
+        self.feed_ratelimit = 'feed.ratelimit:%s' % name
+        self.feed_dedupe = 'feed.dedupe:%s' % name
+        self.feed_dedupe_ids = 'feed.dedupeids:%s' % name
+        self.feed_workers = 'feed.workers:%s' % name
+        self.feed_claimed_by = 'feed.claimedby:%s' % name
+        self.feed_wait_time = 'feed.waittime:%s' % name
+        self.feed_service_time = 'feed.servicetime:%s' % name
+        self.feed_dispatched = 'feed.dispatched:%s' % name
         
-        self.job_finish = 'job.finish:%s' % feed        
+        self.job_finish = 'job.finish:%s' % name        
 
     def get_channels(self):
         return (self.feed_publishes, self.feed_claimed, self.feed_stalled,
             self.feed_finishes, self.feed_cancelled, self.feed_retried,
             self.job_finish)
 
-    def get_schemas(self):
-        """Return the set of Redis keys used exclusively by this feed."""
+    def get_schemas(self, workers=None):
+        """
+        Return the set of Redis keys used exclusively by this feed.
+
+        Arguments:
+            workers -- Optional set of registered worker IDs, when
+                       already read; fetched from Redis otherwise.
+        """
         schema = set((self.feed_claimed,
                       self.feed_stalled,
                       self.feed_running,
                       self.feed_publishes,
-                      self.feed_cancelled))
+                      self.feed_cancelled,
+                      self.feed_ratelimit,
+                      self.feed_dedupe,
+                      self.feed_dedupe_ids,
+                      self.feed_wait_time,
+                      self.feed_service_time,
+                      self.feed_workers,
+                      self.feed_claimed_by))
+        if workers is None:
+            workers = self.get_workers()
+        for worker in workers:
+            schema.add(self._worker_key(worker))
+            schema.add(self._worker_claims_key(worker))
         return schema.union(Queue.get_schemas(self))
 
-    def get_ids(self):
-        """Return the set of IDs used by jobs in the queue."""
-        return self.redis.hkeys(self.feed_items)
+    def get_ids(self, consistent=False):
+        """
+        Return the set of IDs used by jobs in the queue.
+
+        Arguments:
+            consistent -- Flag indicating if the feed's own server must
+                          be read instead of a replica.
+        """
+        return self._reader(consistent).hkeys(self.feed_items)
 
     def retract(self, id):
         """
@@ -119,7 +349,8 @@ class Job(Queue):
             id -- The ID of the job to remove.
         """
         def _retract(pipe):
-            if pipe.hexists(self.feed_items, id):
+            _, exists, dedupe_key, worker, _ = self._job_state(pipe, id)
+            if exists:
                 pipe.multi()
                 pipe.hdel(self.feed_items, id)
                 pipe.hdel(self.feed_cancelled, id)
@@ -127,21 +358,33 @@ class Job(Queue):
                 pipe.srem(self.feed_stalled, id)
                 pipe.zrem(self.feed_claimed, id)
                 pipe.lrem(self.feed_ids, 1, id)
+                self._release_dedupe_key(pipe, id, dedupe_key)
+                self._release_claim(pipe, id, worker)
         
         self.redis.transaction(_retract, self.feed_items)
 
-    def put(self, item, priority=False):
+    CONTENT_HASH = []
+    def put(self, item, priority=False, dedupe_key=None):
         """
         Add a new job to the queue.
 
         (Same as self.publish())
 
+        If a deduplication key is given and a job with the same key
+        is already queued, claimed or stalled, no new job is added
+        and the ID of the existing job is returned instead.
+
         Arguments:
-            item     -- The content to add to the queue (string).
-            priority -- Optional priority; if equal to True then
-                        the item will be inserted at the head of the
-                        queue instead of the end.
+            item       -- The content to add to the queue (string).
+            priority   -- Optional priority; if equal to True then
+                          the item will be inserted at the head of the
+                          queue instead of the end.
+            dedupe_key -- Optional deduplication key. Passing
+                          self.CONTENT_HASH uses a hash of the item.
         """
+        if dedupe_key is not None:
+            return self._put_dedupe(item, priority, dedupe_key)
+
         id = uuid.uuid4().hex
         pipe = self.redis.pipeline()
 
@@ -152,47 +395,393 @@ class Job(Queue):
         pipe.incr(self.feed_publishes)
         pipe.hset(self.feed_items, id, item)
         pipe.zadd(self.feed_published, **{id: int(time.time()*1000)})
+        pipe.hmget(self.feed_config, 'notify', 'framing')
 
         results = pipe.execute()
+        mode, framing = results[-1]
+        notice = item_notice(mode, id, item, results[1], framing)
 
-        if results[-1]:
+        if results[-2]:
             # If zadd was successful
-            self.thoonk._publish(self.feed_publishes, (id, item))
+            self.redis.publish(self.feed_publishes, notice)
         else:
-            self.thoonk._publish(self.feed_edit, (id, item))
+            self.redis.publish(self.feed_edit, notice)
 
         return id
 
-    def get(self, timeout=0):
+    def put_many(self, items, priority=False):
+        """
+        Add several new jobs to the queue in a single round trip.
+
+        Returns the list of new job IDs, in the same order as the items.
+
+        Arguments:
+            items    -- A list of job contents (strings).
+            priority -- Optional priority; if equal to True then
+                        the items will be inserted at the head of the
+                        queue instead of the end.
+        """
+        ids = [uuid.uuid4().hex for item in items]
+        if not ids:
+            return ids
+        args = []
+        for id, item in zip(ids, items):
+            args.extend((id, item))
+        JOB_PUT_MANY.run(self.redis, 5,
+                         self.feed_ids,
+                         self.feed_publishes,
+                         self.feed_items,
+                         self.feed_published,
+                         self.feed_config,
+                         1 if priority else 0,
+                         int(time.time()*1000),
+                         *args)
+        return ids
+
+    def _put_dedupe(self, item, priority, dedupe_key):
+        """
+        Add a new job to the queue unless a job with the same
+        deduplication key already exists.
+
+        Arguments:
+            item       -- The content to add to the queue (string).
+            priority   -- If True, insert at the head of the queue.
+            dedupe_key -- The deduplication key, or self.CONTENT_HASH.
+        """
+        if dedupe_key is self.CONTENT_HASH:
+            dedupe_key = 'sha1:' + hashlib.sha1(item).hexdigest()
+
+        added, id = JOB_PUT_DEDUPE.run(self.redis, 7,
+                                       self.feed_dedupe,
+                                       self.feed_dedupe_ids,
+                                       self.feed_ids,
+                                       self.feed_publishes,
+                                       self.feed_items,
+                                       self.feed_published,
+                                       self.feed_config,
+                                       dedupe_key, uuid.uuid4().hex, item,
+                                       1 if priority else 0,
+                                       int(time.time()*1000))
+        return id
+
+    def _release_dedupe_key(self, pipe, id, dedupe_key):
+        """
+        Queue the commands for freeing a job's deduplication key.
+
+        Arguments:
+            pipe       -- A Redis pipeline in MULTI mode.
+            id         -- The ID of the job.
+            dedupe_key -- The job's deduplication key, if any.
+        """
+        if dedupe_key is not None:
+            pipe.hdel(self.feed_dedupe, dedupe_key)
+            pipe.hdel(self.feed_dedupe_ids, id)
+
+    def get(self, timeout=0, worker=None):
         """
         Retrieve the next job from the queue.
 
         Raises an Empty exception if the request times out.
 
+        If the feed has a rate limit, a popped job is only claimed
+        once the limit allows another job to be dispatched; until then
+        it is kept at the head of the queue.
+
         Arguments:
             timeout -- Optional time in seconds to wait before
                        raising an exception.
+            worker  -- Optional ID of a registered worker to record
+                       as the owner of the claimed job.
         
         Returns:
             id      -- The id of the job
             job     -- The job content
             cancelled -- The number of times the job has been cancelled
         """
-        id = self.redis.brpop(self.feed_ids, timeout)
-        if id is None:
-            raise Empty
-        id = id[1]
-
+        start = time.time()
+        rate, burst = self._get_rate_limit()
+        conn = self.thoonk.blocking_redis_for(self.feed)
+        while True:
+            if rate and timeout:
+                # never wait past the caller's timeout; BRPOP only takes
+                # whole seconds, and a timeout of 0 would wait forever
+                remaining = timeout - (time.time() - start)
+                if remaining >= 1:
+                    id = conn.brpop(self.feed_ids, int(math.floor(remaining)))
+                else:
+                    id = conn.rpop(self.feed_ids)
+                    id = None if id is None else (self.feed_ids, id)
+            else:
+                id = conn.brpop(self.feed_ids, timeout)
+            if id is None:
+                raise Empty
+            id = id[1]
+            if not rate:
+                break
+            wait = RATE_LIMIT_CLAIM.run(self.redis, 2, self.feed_ratelimit,
+                                        self.feed_ids, rate, burst,
+                                        int(time.time() * 1000), id)
+            if not wait:
+                break
+            wait = wait / 1000.0
+            if timeout and time.time() - start + wait > timeout:
+                raise Empty
+            time.sleep(wait)
+
+        now = time.time()
+        now_ms = int(now*1000)
+        dispatched = self._dispatched_key(int(now))
         pipe = self.redis.pipeline()
-        pipe.zadd(self.feed_claimed, **{id: int(time.time()*1000)})
+        pipe.zadd(self.feed_claimed, **{id: now_ms})
         pipe.hget(self.feed_items, id)
         pipe.hget(self.feed_cancelled, id)
+        pipe.incr(dispatched)
+        pipe.expire(dispatched, 5)
+        pipe.zscore(self.feed_published, id)
+        if worker is not None:
+            pipe.hset(self.feed_claimed_by, id, worker)
+            pipe.zadd(self._worker_claims_key(worker), **{id: now_ms})
         result = pipe.execute()
         
-        self.thoonk._publish(self.feed_claimed, (id,))
+        pipe = self.redis.pipeline(transaction=False)
+        if result[5] is not None:
+            histogram.record(pipe, self.feed_wait_time,
+                             max(0, now_ms - result[5]), now_ms)
+        self.thoonk._publish(self.feed_claimed, (id,), pipe)
+        pipe.execute()
 
         return id, result[1], 0 if result[2] is None else int(result[2])
 
+    def _get_rate_limit(self):
+        """
+        Return the configured dispatch rate and burst size, or
+        (0, 0) if the feed is not rate limited.
+
+        The values are cached for RATE_LIMIT_CONFIG_TTL seconds, or
+        until the config of the feed changes, so that feeds without a
+        rate limit do not read their config on every call to get.
+        """
+        cached = self.thoonk._rate_limits.get(self.feed)
+        if cached is not None and cached[0] > time.time():
+            return cached[1]
+        rate, burst = self.redis.hmget(self.feed_config,
+                                       'rate_limit', 'rate_burst')
+        rate = float(rate or 0)
+        if rate <= 0:
+            limit = (0, 0)
+        else:
+            limit = (rate, float(burst or 0) or max(1.0, rate))
+        self.thoonk._rate_limits[self.feed] = (
+            time.time() + RATE_LIMIT_CONFIG_TTL, limit)
+        return limit
+
+    def _dispatched_key(self, second):
+        """
+        Return the key counting the jobs dispatched during a second.
+
+        Arguments:
+            second -- The second, as a whole Unix timestamp.
+        """
+        return '%s:%d' % (self.feed_dispatched, second)
+
+    def get_dispatch_rate(self):
+        """
+        Return the number of jobs dispatched during the last full second.
+        """
+        return int(self.redis.get(
+            self._dispatched_key(int(time.time()) - 1)) or 0)
+
+    def _job_state(self, pipe, id):
+        """
+        Return the claim time, existence flag, deduplication key,
+        owning worker and the feed's framing config for a job, in one
+        round trip.
+
+        Arguments:
+            pipe -- A Redis pipeline watching the job's keys, before
+                    MULTI.
+            id   -- The ID of the job.
+        """
+        return JOB_STATE.run(pipe, 5,
+                             self.feed_claimed,
+                             self.feed_items,
+                             self.feed_dedupe_ids,
+                             self.feed_claimed_by,
+                             self.feed_config,
+                             id)
+
+    def _release_claim(self, pipe, id, worker):
+        """
+        Queue the commands for removing a worker's ownership of a job.
+
+        Arguments:
+            pipe   -- A Redis pipeline in MULTI mode.
+            id     -- The ID of the job.
+            worker -- The ID of the worker owning the job, if any.
+        """
+        if worker is not None:
+            pipe.hdel(self.feed_claimed_by, id)
+            pipe.zrem(self._worker_claims_key(worker), id)
+
+    def register_worker(self, worker=None, ttl=30):
+        """
+        Register a worker with the feed and start its heartbeat.
+
+        The worker must call self.heartbeat() more often than every
+        ttl seconds, or its claimed jobs will be requeued the next
+        time the feed is reaped.
+
+        Returns the worker's ID.
+
+        Arguments:
+            worker -- Optional ID for the worker. One will be
+                      generated if not given.
+            ttl    -- Seconds before the heartbeat expires.
+        """
+        if worker is None:
+            worker = uuid.uuid4().hex
+        pipe = self.redis.pipeline()
+        pipe.sadd(self.feed_workers, worker)
+        pipe.setex(self._worker_key(worker), ttl, int(time.time()*1000))
+        pipe.execute()
+        return worker
+
+    def heartbeat(self, worker, ttl=30):
+        """
+        Keep a registered worker's heartbeat alive.
+
+        Arguments:
+            worker -- The ID of the worker.
+            ttl    -- Seconds before the heartbeat expires.
+        """
+        self.redis.setex(self._worker_key(worker), ttl,
+                         int(time.time()*1000))
+
+    def unregister_worker(self, worker, batch_size=100):
+        """
+        Remove a worker from the feed, requeuing any jobs it still holds.
+
+        Arguments:
+            worker     -- The ID of the worker.
+            batch_size -- The number of jobs to requeue per call
+                          to Redis.
+        """
+        self.redis.delete(self._worker_key(worker))
+        while self._reap_worker(worker, batch_size)[0]:
+            pass
+
+    def _worker_key(self, worker):
+        """
+        Return the key holding a worker's heartbeat.
+
+        Arguments:
+            worker -- The ID of the worker.
+        """
+        return 'feed.worker:%s:%s' % (self.feed, worker)
+
+    def _worker_claims_key(self, worker):
+        """
+        Return the key holding the jobs claimed by a worker.
+
+        Arguments:
+            worker -- The ID of the worker.
+        """
+        return 'feed.workerclaims:%s:%s' % (self.feed, worker)
+
+    def get_workers(self):
+        """Return the set of IDs of registered workers."""
+        return self.redis.smembers(self.feed_workers) or set()
+
+    def get_worker_claims(self, worker):
+        """
+        Return the IDs of the jobs claimed by a worker, oldest first.
+
+        Arguments:
+            worker -- The ID of the worker.
+        """
+        return self.redis.zrange(self._worker_claims_key(worker), 0, -1)
+
+    def reap_workers(self, batch_size=100):
+        """
+        Requeue the jobs held by workers whose heartbeat has expired.
+
+        At most batch_size claims are examined per call, so that a
+        large backlog of dead workers does not block Redis. Claims of
+        jobs that were already finished or requeued are examined but
+        not requeued, so a call may requeue nothing while claims remain;
+        self.maintenance() calls this until every claim is examined.
+
+        Returns the number of jobs requeued.
+
+        Arguments:
+            batch_size -- The maximum number of claims to examine.
+        """
+        return self._reap_workers(batch_size)[1]
+
+    def _reap_workers(self, batch_size):
+        """
+        Requeue a batch of the jobs held by expired workers.
+
+        Returns the number of claims examined and the number of
+        jobs requeued.
+
+        Arguments:
+            batch_size -- The maximum number of claims to examine.
+        """
+        examined = requeued = 0
+        for worker in self.get_workers():
+            if examined >= batch_size:
+                break
+            count = self._reap_worker(worker, batch_size - examined)
+            examined += count[0]
+            requeued += count[1]
+        return examined, requeued
+
+    def _reap_worker(self, worker, batch_size):
+        """
+        Requeue a batch of the jobs held by an expired worker.
+
+        Returns the number of claims examined and the number of
+        jobs requeued.
+
+        Arguments:
+            worker     -- The ID of the worker.
+            batch_size -- The maximum number of claims to examine.
+        """
+        return JOB_REAP_WORKER.run(self.redis, 7,
+                                   self._worker_key(worker),
+                                   self._worker_claims_key(worker),
+                                   self.feed_workers,
+                                   self.feed_claimed_by,
+                                   self.feed_claimed,
+                                   self.feed_cancelled,
+                                   self.feed_ids,
+                                   worker, batch_size)
+
+    def get_latency_stats(self, percentiles=(50, 95, 99)):
+        """
+        Return statistics on how long jobs wait in the queue before
+        being claimed, and how long they take to finish once claimed.
+
+        Returns a dictionary with 'wait' and 'service' entries. Each
+        is a dictionary with the number of jobs measured, the mean and
+        requested percentiles in milliseconds (keyed as 'p50', 'p95',
+        etc), and the throughput in jobs per second.
+
+        Arguments:
+            percentiles -- Optional list of percentiles to compute.
+        """
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hgetall(self.feed_wait_time)
+        pipe.hgetall(self.feed_service_time)
+        wait, service = pipe.execute()
+        return {'wait': histogram.summarize(wait, percentiles),
+                'service': histogram.summarize(service, percentiles)}
+
+    def reset_latency_stats(self):
+        """Clear the recorded wait and processing time statistics."""
+        self.redis.delete(self.feed_wait_time, self.feed_service_time)
+
     def get_failure_count(self, id):
         return int(self.redis.hget(self.feed_cancelled, id) or 0)
     
@@ -206,16 +795,25 @@ class Job(Queue):
             result  -- The result data from the job. (should be a string!)
         """
         def _finish(pipe):
-            if pipe.zrank(self.feed_claimed, id) is None:
+            claimed, _, dedupe_key, worker, framing = \
+                self._job_state(pipe, id)
+            if claimed is None:
                 return # raise exception?
+            claimed = float(claimed)
+            now = int(time.time()*1000)
             pipe.multi()
             pipe.zrem(self.feed_claimed, id)
             pipe.hdel(self.feed_cancelled, id)
             pipe.zrem(self.feed_published, id)
             pipe.incr(self.feed_finishes)
+            histogram.record(pipe, self.feed_service_time,
+                             max(0, now - claimed), now)
             if result is not self.NO_RESULT:
-                self.thoonk._publish(self.job_finish, (id, result), pipe)
+                self.thoonk._publish(self.job_finish, (id, result), pipe,
+                                     framing)
             pipe.hdel(self.feed_items, id)
+            self._release_dedupe_key(pipe, id, dedupe_key)
+            self._release_claim(pipe, id, worker)
         
         self.redis.transaction(_finish, self.feed_claimed)
 
@@ -227,12 +825,14 @@ class Job(Queue):
             id -- The ID of the job to cancel.
         """
         def _cancel(pipe):
-            if self.redis.zrank(self.feed_claimed, id) is None:
+            claimed, _, _, worker, _ = self._job_state(pipe, id)
+            if claimed is None:
                 return # raise exception?
             pipe.multi()
             pipe.hincrby(self.feed_cancelled, id, 1)
             pipe.lpush(self.feed_ids, id)
             pipe.zrem(self.feed_claimed, id)
+            self._release_claim(pipe, id, worker)
         
         self.redis.transaction(_cancel, self.feed_claimed)
 
@@ -246,13 +846,15 @@ class Job(Queue):
             id -- The ID of the job to pause.
         """
         def _stall(pipe):
-            if pipe.zrank(self.feed_claimed, id) is None:
+            claimed, _, _, worker, _ = self._job_state(pipe, id)
+            if claimed is None:
                 return # raise exception?
             pipe.multi()
             pipe.zrem(self.feed_claimed, id)
             pipe.hdel(self.feed_cancelled, id)
             pipe.sadd(self.feed_stalled, id)
             pipe.zrem(self.feed_published, id)
+            self._release_claim(pipe, id, worker)
         
         self.redis.transaction(_stall, self.feed_claimed)
 
@@ -269,7 +871,7 @@ class Job(Queue):
             pipe.multi()
             pipe.srem(self.feed_stalled, id)
             pipe.lpush(self.feed_ids, id)
-            pipe.zadd(self.feed_published, **{id: time.time()})
+            pipe.zadd(self.feed_published, **{id: int(time.time()*1000)})
         
         results = self.redis.transaction(_retry, self.feed_stalled)
         if not results[0]:
@@ -282,9 +884,14 @@ class Job(Queue):
         Fix any inconsistencies such as jobs that are not in any state, etc,
         that can be caused by software crashes and other unexpected events.
 
+        Jobs held by workers whose heartbeat has expired are requeued.
+
         Expected use is to create a maintenance thread for periodically
         calling this method.
         """
+        while self._reap_workers(100)[0]:
+            pass
+
         pipe = self.redis.pipeline()
         pipe.hkeys(self.feed_items)
         pipe.lrange(self.feed_ids, 0, -1)
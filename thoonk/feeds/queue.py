@@ -72,7 +72,8 @@ class Queue(Feed):
             timeout -- Optional time in seconds to wait before
                        raising an exception.
         """
-        result = self.redis.brpop(self.feed_ids, timeout)
+        conn = self.thoonk.blocking_redis_for(self.feed)
+        result = conn.brpop(self.feed_ids, timeout)
         if result is None:
             raise Empty
 
@@ -84,6 +85,12 @@ class Queue(Feed):
 
         return results[0]
 
-    def get_ids(self):
-        """Return the set of IDs used by jobs in the queue."""
-        return self.redis.lrange(self.feed_ids, 0, -1)
+    def get_ids(self, consistent=False):
+        """
+        Return the set of IDs used by jobs in the queue.
+
+        Arguments:
+            consistent -- Flag indicating if the feed's own server must
+                          be read instead of a replica.
+        """
+        return self._reader(consistent).lrange(self.feed_ids, 0, -1)
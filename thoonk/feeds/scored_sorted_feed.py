@@ -0,0 +1,305 @@
+"""
+    Written by Nathan Fritz and Lance Stout. Copyright 2011 by &yet, LLC.
+    Released under the terms of the MIT License
+"""
+
+from thoonk import scripts
+from thoonk.feeds import SortedFeed
+from thoonk.notify import NOTIFY_LIB
+
+
+# Shared Lua functions for placing an item in a scored sorted feed.
+#
+# Items are ordered by integer scores in a sorted set. New items at
+# either end are placed GAP away from the current first or last item,
+# and items placed between two neighbours take the midpoint of their
+# scores. When neighbours are too close to fit another item, the
+# scores around them are spread out again: the window of items being
+# respaced grows until the surrounding scores leave at least
+# MIN_SPACING between items, so a rebalance usually touches only a
+# handful of items. Windows reaching either end of the feed can always
+# grow outward, so respacing always succeeds.
+SCORED_ORDER_LIB = """
+local GAP = 1048576
+local MIN_SPACING = 1024
+
+local function score_at(key, rank)
+    return tonumber(redis.call('zrange', key, rank, rank, 'WITHSCORES')[2])
+end
+
+local function spread(key, rank)
+    local n = redis.call('zcard', key)
+    local size = 16
+    while true do
+        local lo = math.max(0, rank - size)
+        local hi = math.min(n - 1, rank + size)
+        local count = hi - lo + 1
+        local low, high
+        if lo == 0 then
+            low = score_at(key, 0) - GAP * (count + 1)
+        else
+            low = score_at(key, lo - 1)
+        end
+        if hi == n - 1 then
+            high = score_at(key, hi) + GAP * (count + 1)
+        else
+            high = score_at(key, hi + 1)
+        end
+        local step = math.floor((high - low) / (count + 1))
+        if step >= MIN_SPACING or (lo == 0 and hi == n - 1) then
+            local ids = redis.call('zrange', key, lo, hi)
+            for i, id in ipairs(ids) do
+                redis.call('zadd', key, low + step * i, id)
+            end
+            return
+        end
+        size = size * 2
+    end
+end
+
+local function place(key, id, rel_id, dir)
+    local score
+    if rel_id == 'begin' then
+        local first = redis.call('zrange', key, 0, 0, 'WITHSCORES')
+        score = first[2] and tonumber(first[2]) - GAP or 0
+    elseif rel_id == 'end' then
+        local last = redis.call('zrange', key, -1, -1, 'WITHSCORES')
+        score = last[2] and tonumber(last[2]) + GAP or 0
+    else
+        for attempt = 1, 2 do
+            local rank = redis.call('zrank', key, rel_id)
+            local low, high
+            if dir == 'BEFORE' then
+                high = score_at(key, rank)
+                low = rank > 0 and score_at(key, rank - 1) or high - 2 * GAP
+            else
+                low = score_at(key, rank)
+                local n = redis.call('zcard', key)
+                high = rank < n - 1 and score_at(key, rank + 1) or low + 2 * GAP
+            end
+            if high - low >= 2 then
+                score = math.floor((low + high) / 2)
+                break
+            end
+            spread(key, rank)
+        end
+    end
+    redis.call('zadd', key, score, id)
+end
+"""
+
+# Add a new item to a scored sorted feed.
+#
+# KEYS: feed.idincr:[feed], feed.ids:[feed], feed.items:[feed],
+#       feed.publishes:[feed], feed.publish:[feed], feed.position:[feed],
+#       feed.config:[feed]
+# ARGV: item, relative ID ('begin', 'end' or an item ID),
+#       direction ('BEFORE' or 'AFTER'), position notice suffix
+#
+# Returns the new item's ID, or nil if the relative item is missing.
+SCORED_INSERT = scripts.register('scored_insert',
+                                 NOTIFY_LIB + SCORED_ORDER_LIB + """
+local rel_id = ARGV[2]
+if rel_id ~= 'begin' and rel_id ~= 'end' and
+   redis.call('hexists', KEYS[3], rel_id) == 0 then
+    return nil
+end
+local id = redis.call('incr', KEYS[1])
+place(KEYS[2], id, rel_id, ARGV[3])
+redis.call('hset', KEYS[3], id, ARGV[1])
+local version = redis.call('incr', KEYS[4])
+redis.call('publish', KEYS[5],
+           item_notice(notice_format(KEYS[7]), id, ARGV[1], version))
+redis.call('publish', KEYS[6], id .. '\\0' .. ARGV[4])
+return id
+""")
+
+# Add a batch of new items to either end of a scored sorted feed,
+# keeping the order of the batch.
+#
+# KEYS: feed.idincr:[feed], feed.ids:[feed], feed.items:[feed],
+#       feed.publishes:[feed], feed.publish:[feed], feed.position:[feed],
+#       feed.config:[feed]
+# ARGV: 'begin' or 'end', followed by the items
+#
+# IDs for the whole batch are reserved with a single INCRBY. Returns
+# the list of new IDs.
+SCORED_INSERT_MANY = scripts.register('scored_insert_many',
+                                      NOTIFY_LIB + SCORED_ORDER_LIB + """
+local n = #ARGV - 1
+local first = redis.call('incrby', KEYS[1], n) - n + 1
+local ids = {}
+for i = 1, n do
+    ids[i] = first + i - 1
+    redis.call('hset', KEYS[3], ids[i], ARGV[i + 1])
+end
+if ARGV[1] == 'begin' then
+    for i = n, 1, -1 do
+        place(KEYS[2], ids[i], 'begin', 'BEFORE')
+    end
+else
+    for i = 1, n do
+        place(KEYS[2], ids[i], 'end', 'AFTER')
+    end
+end
+local version = redis.call('incrby', KEYS[4], n) - n
+local format = notice_format(KEYS[7])
+for i = 1, n do
+    redis.call('publish', KEYS[5],
+               item_notice(format, ids[i], ARGV[i + 1], version + i))
+    local position = ':end'
+    if ARGV[1] == 'begin' then
+        position = i == 1 and 'begin:' or ids[i - 1] .. ':'
+    end
+    redis.call('publish', KEYS[6], ids[i] .. '\\0' .. position)
+end
+return ids
+""")
+
+# Move an existing item in a scored sorted feed.
+#
+# KEYS: feed.ids:[feed], feed.items:[feed], feed.position:[feed]
+# ARGV: ID, relative ID ('begin', 'end' or an item ID),
+#       direction ('BEFORE' or 'AFTER'), relative position
+SCORED_MOVE = scripts.register('scored_move', SCORED_ORDER_LIB + """
+local id = ARGV[1]
+local rel_id = ARGV[2]
+if redis.call('hexists', KEYS[2], id) == 0 then
+    return 0
+end
+if rel_id ~= 'begin' and rel_id ~= 'end' and
+   (rel_id == id or redis.call('hexists', KEYS[2], rel_id) == 0) then
+    return 0
+end
+redis.call('zrem', KEYS[1], id)
+place(KEYS[1], id, rel_id, ARGV[3])
+redis.call('publish', KEYS[3], id .. '\\0' .. ARGV[4])
+return 1
+""")
+
+# Move a batch of existing items in a scored sorted feed.
+#
+# KEYS: feed.ids:[feed], feed.items:[feed], feed.reorder:[feed]
+# ARGV: groups of ID, relative ID ('begin', 'end' or an item ID),
+#       direction ('BEFORE' or 'AFTER') and relative position
+SCORED_MOVE_MANY = scripts.register('scored_move_many', SCORED_ORDER_LIB + """
+local notice = {}
+for i = 1, #ARGV, 4 do
+    local id, rel_id, dir = ARGV[i], ARGV[i + 1], ARGV[i + 2]
+    if redis.call('hexists', KEYS[2], id) == 1 and
+       (rel_id == 'begin' or rel_id == 'end' or
+        (rel_id ~= id and redis.call('hexists', KEYS[2], rel_id) == 1)) then
+        redis.call('zrem', KEYS[1], id)
+        place(KEYS[1], id, rel_id, dir)
+        table.insert(notice, id)
+        table.insert(notice, ARGV[i + 3])
+    end
+end
+if #notice > 0 then
+    redis.call('publish', KEYS[3], table.concat(notice, '\\0'))
+end
+return #notice / 2
+""")
+
+# Replace the order of a scored sorted feed.
+#
+# KEYS: feed.ids:[feed], feed.items:[feed], feed.reorder:[feed]
+# ARGV: every item ID in the feed, in the new order
+SCORED_REORDER = scripts.register('scored_reorder', SCORED_ORDER_LIB + """
+if #ARGV ~= redis.call('hlen', KEYS[2]) then
+    return 0
+end
+local seen = {}
+for i, id in ipairs(ARGV) do
+    if seen[id] or redis.call('hexists', KEYS[2], id) == 0 then
+        return 0
+    end
+    seen[id] = true
+end
+redis.call('del', KEYS[1])
+local notice = {}
+for i, id in ipairs(ARGV) do
+    redis.call('zadd', KEYS[1], i * GAP, id)
+    table.insert(notice, id)
+    table.insert(notice, i == 1 and 'begin:' or ARGV[i - 1] .. ':')
+end
+if #notice > 0 then
+    redis.call('publish', KEYS[3], table.concat(notice, '\\0'))
+end
+return 1
+""")
+
+
+class ScoredSortedFeed(SortedFeed):
+
+    """
+    A scored sorted feed is a manually ordered collection of items,
+    with the same API as a sorted feed.
+
+    Instead of a list, the item order is kept in a sorted set with
+    gapped integer scores, so inserting, moving and retracting items
+    take O(log n) time instead of scanning the list. Each operation is
+    performed by a single server side script.
+
+    Redis Keys Used:
+        feed.ids:[feed] -- A sorted set of item IDs scored by position.
+
+    Thoonk Standard API:
+        get_ids -- Return the IDs of all items in the feed, in order.
+        move    -- Move an item before or after an existing item.
+        retract -- Remove an item from the feed.
+    """
+
+    _range_command = 'zrange'
+    _insert_script = SCORED_INSERT
+    _insert_many_script = SCORED_INSERT_MANY
+    _move_many_script = SCORED_MOVE_MANY
+    _reorder_script = SCORED_REORDER
+
+    def move(self, rel_position, id):
+        """
+        Move an existing item to before or after an existing item.
+
+        Specifying the new location for the item is done by:
+
+            :42    -- Move before existing item ID 42.
+            42:    -- Move after existing item ID 42.
+            begin: -- Move to beginning of the feed.
+            :end   -- Move to the end of the feed.
+
+        Arguments:
+            rel_position -- A formatted ID to move before/after.
+            id           -- The ID of the item to move.
+        """
+        dir, rel_id = self._parse_position(rel_position)
+        SCORED_MOVE.run(self.redis, 3,
+                        self.feed_ids,
+                        self.feed_items,
+                        self.feed_position,
+                        id, rel_id, dir, rel_position)
+
+    def retract(self, id):
+        """
+        Remove an item from the feed.
+
+        Arguments:
+            id -- The ID value of the item to remove.
+        """
+        def _retract(pipe):
+            if pipe.hexists(self.feed_items, id):
+                pipe.multi()
+                pipe.zrem(self.feed_ids, id)
+                pipe.hdel(self.feed_items, id)
+                pipe.publish(self.feed_retract, id)
+
+        self.redis.transaction(_retract, self.feed_items)
+
+    def get_ids(self, consistent=False):
+        """
+        Return the IDs of the items in the feed, in order.
+
+        Arguments:
+            consistent -- Flag indicating if the feed's own server must
+                          be read instead of a replica.
+        """
+        return self._reader(consistent).zrange(self.feed_ids, 0, -1)
@@ -3,7 +3,187 @@
     Released under the terms of the MIT License
 """
 
+from thoonk import scripts
 from thoonk.feeds import Feed
+from thoonk.notify import NOTIFY_LIB
+
+
+# Return a slice of a sorted feed's IDs along with their items.
+#
+# KEYS: feed.ids:[feed], feed.items:[feed]
+# ARGV: start, stop (inclusive), range command ('lrange' or 'zrange')
+#
+# Returns a flat list of ID and item pairs.
+SORTED_RANGE = scripts.register('sorted_range', """
+local ids = redis.call(ARGV[3], KEYS[1], ARGV[1], ARGV[2])
+local result = {}
+for i = 1, #ids, 1000 do
+    local chunk = {unpack(ids, i, math.min(i + 999, #ids))}
+    local items = redis.call('hmget', KEYS[2], unpack(chunk))
+    for j, id in ipairs(chunk) do
+        table.insert(result, id)
+        table.insert(result, items[j])
+    end
+end
+return result
+""")
+
+
+# Add a new item to a sorted feed.
+#
+# KEYS: feed.idincr:[feed], feed.ids:[feed], feed.items:[feed],
+#       feed.publishes:[feed], feed.publish:[feed], feed.position:[feed],
+#       feed.config:[feed]
+# ARGV: item, relative ID ('begin', 'end' or an item ID),
+#       direction ('BEFORE' or 'AFTER'), position notice suffix
+#
+# Returns the new item's ID, or nil if the relative item is missing.
+SORTED_INSERT = scripts.register('sorted_insert', NOTIFY_LIB + """
+local rel_id = ARGV[2]
+if rel_id ~= 'begin' and rel_id ~= 'end' and
+   redis.call('hexists', KEYS[3], rel_id) == 0 then
+    return nil
+end
+local id = redis.call('incr', KEYS[1])
+if rel_id == 'begin' then
+    redis.call('lpush', KEYS[2], id)
+elseif rel_id == 'end' then
+    redis.call('rpush', KEYS[2], id)
+else
+    redis.call('linsert', KEYS[2], ARGV[3], rel_id, id)
+end
+redis.call('hset', KEYS[3], id, ARGV[1])
+local version = redis.call('incr', KEYS[4])
+redis.call('publish', KEYS[5],
+           item_notice(notice_format(KEYS[7]), id, ARGV[1], version))
+redis.call('publish', KEYS[6], id .. '\\0' .. ARGV[4])
+return id
+""")
+
+# Add a batch of new items to either end of a sorted feed, keeping
+# the order of the batch.
+#
+# KEYS: feed.idincr:[feed], feed.ids:[feed], feed.items:[feed],
+#       feed.publishes:[feed], feed.publish:[feed], feed.position:[feed],
+#       feed.config:[feed]
+# ARGV: 'begin' or 'end', followed by the items
+#
+# IDs for the whole batch are reserved with a single INCRBY. Returns
+# the list of new IDs.
+SORTED_INSERT_MANY = scripts.register('sorted_insert_many', NOTIFY_LIB + """
+local n = #ARGV - 1
+local first = redis.call('incrby', KEYS[1], n) - n + 1
+local ids = {}
+for i = 1, n do
+    ids[i] = first + i - 1
+    redis.call('hset', KEYS[3], ids[i], ARGV[i + 1])
+end
+if ARGV[1] == 'begin' then
+    for i = n, 1, -1 do
+        redis.call('lpush', KEYS[2], ids[i])
+    end
+else
+    for i = 1, n do
+        redis.call('rpush', KEYS[2], ids[i])
+    end
+end
+local version = redis.call('incrby', KEYS[4], n) - n
+local format = notice_format(KEYS[7])
+for i = 1, n do
+    redis.call('publish', KEYS[5],
+               item_notice(format, ids[i], ARGV[i + 1], version + i))
+    local position = ':end'
+    if ARGV[1] == 'begin' then
+        position = i == 1 and 'begin:' or ids[i - 1] .. ':'
+    end
+    redis.call('publish', KEYS[6], ids[i] .. '\\0' .. position)
+end
+return ids
+""")
+
+
+# Replace the contents of an existing item.
+#
+# KEYS: feed.items:[feed], feed.publishes:[feed], feed.publish:[feed],
+#       feed.config:[feed]
+# ARGV: ID, item
+SORTED_EDIT = scripts.register('sorted_edit', NOTIFY_LIB + """
+if redis.call('hexists', KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+redis.call('hset', KEYS[1], ARGV[1], ARGV[2])
+local version = redis.call('incr', KEYS[2])
+redis.call('publish', KEYS[3],
+           item_notice(notice_format(KEYS[4]), ARGV[1], ARGV[2], version))
+return 1
+""")
+
+# Move a batch of existing items in a sorted feed.
+#
+# KEYS: feed.ids:[feed], feed.items:[feed], feed.reorder:[feed]
+# ARGV: groups of ID, relative ID ('begin', 'end' or an item ID),
+#       direction ('BEFORE' or 'AFTER') and relative position
+#
+# Moves are applied in order; moves naming missing items are skipped.
+# The applied moves are announced in a single reorder notice. Returns
+# the number of moves applied.
+SORTED_MOVE_MANY = scripts.register('sorted_move_many', """
+local notice = {}
+for i = 1, #ARGV, 4 do
+    local id, rel_id, dir = ARGV[i], ARGV[i + 1], ARGV[i + 2]
+    if redis.call('hexists', KEYS[2], id) == 1 and
+       (rel_id == 'begin' or rel_id == 'end' or
+        (rel_id ~= id and redis.call('hexists', KEYS[2], rel_id) == 1)) then
+        redis.call('lrem', KEYS[1], 1, id)
+        if rel_id == 'begin' then
+            redis.call('lpush', KEYS[1], id)
+        elseif rel_id == 'end' then
+            redis.call('rpush', KEYS[1], id)
+        else
+            redis.call('linsert', KEYS[1], dir, rel_id, id)
+        end
+        table.insert(notice, id)
+        table.insert(notice, ARGV[i + 3])
+    end
+end
+if #notice > 0 then
+    redis.call('publish', KEYS[3], table.concat(notice, '\\0'))
+end
+return #notice / 2
+""")
+
+# Replace the order of a sorted feed.
+#
+# KEYS: feed.ids:[feed], feed.items:[feed], feed.reorder:[feed]
+# ARGV: every item ID in the feed, in the new order
+#
+# Returns 0 without changing anything unless the IDs are exactly the
+# items in the feed. The new order is announced in a single reorder
+# notice.
+SORTED_REORDER = scripts.register('sorted_reorder', """
+if #ARGV ~= redis.call('hlen', KEYS[2]) then
+    return 0
+end
+local seen = {}
+for i, id in ipairs(ARGV) do
+    if seen[id] or redis.call('hexists', KEYS[2], id) == 0 then
+        return 0
+    end
+    seen[id] = true
+end
+redis.call('del', KEYS[1])
+local notice = {}
+for i, id in ipairs(ARGV) do
+    redis.call('rpush', KEYS[1], id)
+    table.insert(notice, id)
+    table.insert(notice, i == 1 and 'begin:' or ARGV[i - 1] .. ':')
+end
+if #notice > 0 then
+    redis.call('publish', KEYS[3], table.concat(notice, '\\0'))
+end
+return 1
+""")
+
 
 class SortedFeed(Feed):
 
@@ -14,6 +194,8 @@ class SortedFeed(Feed):
         feed.idincr:[feed]  -- A counter for ID values.
         feed.publish:[feed] -- A channel for publishing item position
                                change events.
+        feed.reorder:[feed] -- A channel for publishing batches of item
+                               position changes.
 
     Thoonk.py Implementation API:
         get_channels -- Return the standard pubsub channels for this feed.
@@ -21,17 +203,29 @@ class SortedFeed(Feed):
 
     Thoonk Standard API:
         append    -- Append an item to the end of the feed.
+        append_many -- Append several items to the end of the feed.
         edit      -- Edit an item in-place.
         get_all   -- Return all items in the feed.
         get_ids   -- Return the IDs of all items in the feed.
         get_item  -- Return a single item from the feed given its ID.
+        get_range -- Return a slice of (ID, item) pairs in feed order.
+        iter_items -- Iterate over (ID, item) pairs in feed order.
+        move_many -- Move several items in a single step.
         prepend   -- Add an item to the beginning of the feed.
+        prepend_many -- Add several items to the beginning of the feed.
+        reorder   -- Replace the order of all items in the feed.
         retract   -- Remove an item from the feed.
         publish   -- Add an item to the end of the feed.
         publish_after  -- Add an item immediately before an existing item.
         publish_before -- Add an item immediately after an existing item.
     """
 
+    _range_command = 'lrange'
+    _insert_script = SORTED_INSERT
+    _insert_many_script = SORTED_INSERT_MANY
+    _move_many_script = SORTED_MOVE_MANY
+    _reorder_script = SORTED_REORDER
+
     def __init__(self, thoonk, feed):
         """
         Create a new SortedFeed object for a given Thoonk feed.
@@ -47,15 +241,18 @@ class SortedFeed(Feed):
 
         """
         Feed.__init__(self, thoonk, feed)
+        name = thoonk.key_name(feed)
 
-        self.feed_id_incr = 'feed.idincr:%s' % feed
-        self.feed_position = 'feed.position:%s' % feed
+        self.feed_id_incr = 'feed.idincr:%s' % name
+        self.feed_position = 'feed.position:%s' % name
+        self.feed_reorder = 'feed.reorder:%s' % name
 
     def get_channels(self):
         """
         Return the Redis key channels for publishing and retracting items.
         """
-        return (self.feed_publish, self.feed_retract, self.feed_position)
+        return (self.feed_publish, self.feed_retract, self.feed_position,
+                self.feed_reorder)
 
     def get_schemas(self):
         """Return the set of Redis keys used exclusively by this feed."""
@@ -73,6 +270,20 @@ class SortedFeed(Feed):
         """
         return self.publish(item)
 
+    def append_many(self, items):
+        """
+        Add several items to the end of the feed, in order.
+
+        The IDs for all of the items are allocated and the items
+        inserted and announced in a single round trip.
+
+        Returns the list of new item IDs.
+
+        Arguments:
+            items -- A list of item contents to add.
+        """
+        return self._insert_many(items, 'end')
+
     def prepend(self, item):
         """
         Add an item to the beginning of the feed.
@@ -80,45 +291,69 @@ class SortedFeed(Feed):
         Arguments:
             item -- The item contents to add.
         """
-        id = self.redis.incr(self.feed_id_incr)
-        pipe = self.redis.pipeline()
-        pipe.lpush(self.feed_ids, id)
-        pipe.incr(self.feed_publishes)
-        pipe.hset(self.feed_items, id, item)
-        self.thoonk._publish(self.feed_publish, (str(id), item), pipe)
-        self.thoonk._publish(self.feed_position, (str(id), 'begin:'), pipe)
-        pipe.execute()
-        return id
+        return self._insert(item, 'begin', 'BEFORE', 'begin:')
 
-    def __insert(self, item, rel_id, method):
+    def prepend_many(self, items):
+        """
+        Add several items to the beginning of the feed, keeping their
+        order, so the first of the items becomes the first in the feed.
+
+        Returns the list of new item IDs.
+
+        Arguments:
+            items -- A list of item contents to add.
+        """
+        return self._insert_many(items, 'begin')
+
+    def _insert(self, item, rel_id, method, pos_rel_id):
         """
         Insert an item into the feed, either before or after an
-        existing item.
+        existing item, or at either end of the feed.
+
+        The ID allocation, insertion and notices are performed by a
+        single server side script.
+
+        Returns the new item's ID, or None if rel_id does not exist.
 
         Arguments:
-            item   -- The item contents to insert.
-            rel_id -- The ID of an existing item.
-            method -- Either 'BEFORE' or 'AFTER', and indicates
-                      where the item will be inserted in relation
-                      to rel_id.
-        """
-        id = self.redis.incr(self.feed_id_incr)
-        if method == 'BEFORE':
-            pos_rel_id = ':%s' % rel_id
-        else:
-            pos_rel_id = '%s:' % rel_id
-        
-        def _insert(pipe):
-            if not pipe.hexists(self.feed_items, rel_id):
-                return # raise exception?
-            pipe.multi()
-            pipe.linsert(self.feed_ids, method, rel_id, id)
-            pipe.hset(self.feed_items, id, item)
-            self.thoonk._publish(self.feed_publish, (str(id), item), pipe)
-            self.thoonk._publish(self.feed_position, (str(id), pos_rel_id), pipe)
-        
-        self.redis.transaction(_insert, self.feed_items)
-        return id
+            item       -- The item contents to insert.
+            rel_id     -- The ID of an existing item, 'begin' or 'end'.
+            method     -- Either 'BEFORE' or 'AFTER', and indicates
+                          where the item will be inserted in relation
+                          to rel_id.
+            pos_rel_id -- The relative position for the position notice.
+        """
+        return self._insert_script.run(self.redis, 7,
+                                       self.feed_id_incr,
+                                       self.feed_ids,
+                                       self.feed_items,
+                                       self.feed_publishes,
+                                       self.feed_publish,
+                                       self.feed_position,
+                                       self.feed_config,
+                                       item, rel_id, method, pos_rel_id)
+
+    def _insert_many(self, items, where):
+        """
+        Add a batch of items to either end of the feed in one round trip.
+
+        Returns the list of new item IDs.
+
+        Arguments:
+            items -- A list of item contents to add.
+            where -- Either 'begin' or 'end'.
+        """
+        if not items:
+            return []
+        return self._insert_many_script.run(self.redis, 7,
+                                            self.feed_id_incr,
+                                            self.feed_ids,
+                                            self.feed_items,
+                                            self.feed_publishes,
+                                            self.feed_publish,
+                                            self.feed_position,
+                                            self.feed_config,
+                                            where, *items)
 
     def publish(self, item):
         """
@@ -129,15 +364,7 @@ class SortedFeed(Feed):
         Arguments:
             item -- The item contens to add.
         """
-        id = self.redis.incr(self.feed_id_incr)
-        pipe = self.redis.pipeline()
-        pipe.rpush(self.feed_ids, id)
-        pipe.incr(self.feed_publishes)
-        pipe.hset(self.feed_items, id, item)
-        self.thoonk._publish(self.feed_publish, (str(id), item), pipe)
-        self.thoonk._publish(self.feed_position, (str(id), ':end'), pipe)
-        pipe.execute()
-        return id
+        return self._insert(item, 'end', 'AFTER', ':end')
 
     def edit(self, id, item):
         """
@@ -147,15 +374,12 @@ class SortedFeed(Feed):
             id   -- The ID value of the item to edit.
             item -- The new contents of the item.
         """
-        def _edit(pipe):
-            if not pipe.hexists(self.feed_items, id):
-                return # raise exception?
-            pipe.multi()
-            pipe.hset(self.feed_items, id, item)
-            pipe.incr(self.feed_publishes)
-            pipe.publish(self.feed_publish, '%s\x00%s' % (id, item))
-        
-        self.redis.transaction(_edit, self.feed_items)
+        SORTED_EDIT.run(self.redis, 4,
+                        self.feed_items,
+                        self.feed_publishes,
+                        self.feed_publish,
+                        self.feed_config,
+                        id, item)
 
     def publish_before(self, before_id, item):
         """
@@ -165,7 +389,7 @@ class SortedFeed(Feed):
             before_id -- ID of the item to insert before.
             item      -- The item contents to add.
         """
-        return self.__insert(item, before_id, 'BEFORE')
+        return self._insert(item, before_id, 'BEFORE', ':%s' % before_id)
 
     def publish_after(self, after_id, item):
         """
@@ -175,7 +399,7 @@ class SortedFeed(Feed):
             after_id -- ID of the item to insert after.
             item     -- The item contents to add.
         """
-        return self.__insert(item, after_id, 'AFTER')
+        return self._insert(item, after_id, 'AFTER', '%s:' % after_id)
 
     def move(self, rel_position, id):
         """
@@ -192,14 +416,7 @@ class SortedFeed(Feed):
             rel_position -- A formatted ID to move before/after.
             id           -- The ID of the item to move.
         """
-        if rel_position[0] == ':':
-            dir = 'BEFORE'
-            rel_id = rel_position[1:]
-        elif rel_position[-1] == ':':
-            dir = 'AFTER'
-            rel_id = rel_position[:-1]
-        else:
-            raise ValueError('Relative ID formatted incorrectly')
+        dir, rel_id = self._parse_position(rel_position)
         
         def _move(pipe):
             if not pipe.hexists(self.feed_items, id):
@@ -221,6 +438,67 @@ class SortedFeed(Feed):
         
         self.redis.transaction(_move, self.feed_items)
 
+    def _parse_position(self, rel_position):
+        """
+        Split a relative position into a direction and a relative ID.
+
+        Returns a tuple of 'BEFORE' or 'AFTER' and the relative ID.
+
+        Arguments:
+            rel_position -- A formatted ID, such as ':42' or 'begin:'.
+        """
+        if rel_position[0] == ':':
+            return 'BEFORE', rel_position[1:]
+        elif rel_position[-1] == ':':
+            return 'AFTER', rel_position[:-1]
+        raise ValueError('Relative ID formatted incorrectly')
+
+    def move_many(self, moves):
+        """
+        Move several existing items atomically in a single round trip.
+
+        The moves are applied in order, and use the same relative
+        positions as self.move(). Moves naming items that do not exist
+        are skipped. Listeners receive a single reorder notice with
+        the applied moves.
+
+        Returns the number of moves applied.
+
+        Arguments:
+            moves -- A list of (rel_position, id) pairs.
+        """
+        args = []
+        for rel_position, id in moves:
+            dir, rel_id = self._parse_position(rel_position)
+            args.extend((id, rel_id, dir, rel_position))
+        if not args:
+            return 0
+        return self._move_many_script.run(self.redis, 3,
+                                          self.feed_ids,
+                                          self.feed_items,
+                                          self.feed_reorder,
+                                          *args)
+
+    def reorder(self, ids):
+        """
+        Replace the order of the feed atomically in a single round trip.
+
+        Listeners receive a single reorder notice describing the
+        new order.
+
+        Raises ValueError, leaving the feed unchanged, unless the IDs
+        are exactly the items in the feed.
+
+        Arguments:
+            ids -- Every item ID in the feed, in the new order.
+        """
+        if not self._reorder_script.run(self.redis, 3,
+                                        self.feed_ids,
+                                        self.feed_items,
+                                        self.feed_reorder,
+                                        *ids):
+            raise ValueError('IDs do not match the items in the feed')
+
     def move_before(self, rel_id, id):
         """
         Move an existing item to before an existing item.
@@ -275,19 +553,82 @@ class SortedFeed(Feed):
         
         self.redis.transaction(_retract, self.feed_items)
 
-    def get_ids(self):
-        """Return the set of IDs used by items in the feed."""
-        return self.redis.lrange(self.feed_ids, 0, -1)
+    def get_ids(self, consistent=False):
+        """
+        Return the set of IDs used by items in the feed.
 
-    def get_item(self, id):
+        Arguments:
+            consistent -- Flag indicating if the feed's own server must
+                          be read instead of a replica.
+        """
+        return self._reader(consistent).lrange(self.feed_ids, 0, -1)
+
+    def get_item(self, id, consistent=False):
         """
         Retrieve a single item from the feed.
 
         Arguments:
-            id -- The ID of the item to retrieve.
+            id         -- The ID of the item to retrieve.
+            consistent -- Flag indicating if the feed's own server must
+                          be read instead of a replica.
+        """
+        return self._reader(consistent).hget(self.feed_items, id)
+
+    def get_items(self, consistent=False):
+        """
+        Return all items from the feed.
+
+        Arguments:
+            consistent -- Flag indicating if the feed's own server must
+                          be read instead of a replica.
+        """
+        return self._reader(consistent).hgetall(self.feed_items)
+
+    def get_range(self, start=0, stop=None, consistent=False):
+        """
+        Return a slice of the feed as a list of (ID, item) pairs
+        in feed order, fetched in a single round trip.
+
+        The start and stop positions follow Python slice conventions,
+        so get_range(20, 30) returns the 21st through 30th items and
+        negative positions count from the end of the feed.
+
+        Arguments:
+            start      -- Position of the first item to return.
+            stop       -- Position after the last item to return.
+                          Defaults to the end of the feed.
+            consistent -- Flag indicating if the feed's own server must
+                          be read instead of a replica.
+        """
+        if stop is None:
+            stop = -1
+        elif stop == 0:
+            return []
+        else:
+            stop -= 1
+        result = SORTED_RANGE.run(self._reader(consistent), 2,
+                                  self.feed_ids, self.feed_items,
+                                  start, stop, self._range_command)
+        return zip(result[::2], result[1::2])
+
+    def iter_items(self, batch_size=100, consistent=False):
         """
-        return self.redis.hget(self.feed_items, id)
+        Iterate over the (ID, item) pairs of the feed in feed order,
+        fetching batch_size items at a time.
+
+        Items moved, added or removed while iterating may be skipped
+        or returned twice.
 
-    def get_items(self):
-        """Return all items from the feed."""
-        return self.redis.hgetall(self.feed_items)
+        Arguments:
+            batch_size -- The number of items to fetch per round trip.
+            consistent -- Flag indicating if the feed's own server must
+                          be read instead of a replica.
+        """
+        start = 0
+        while True:
+            batch = self.get_range(start, start + batch_size, consistent)
+            for pair in batch:
+                yield pair
+            if len(batch) < batch_size:
+                return
+            start += batch_size
@@ -0,0 +1,96 @@
+"""
+    Written by Nathan Fritz and Lance Stout. Copyright 2011 by &yet, LLC.
+    Released under the terms of the MIT License
+"""
+
+import math
+
+
+# Number of buckets per power of two. Four sub-buckets keep the
+# relative error of a reported percentile below 19%.
+SUB_BUCKETS = 4
+
+
+def bucket(value):
+    """
+    Return the histogram bucket index for a value.
+
+    Buckets grow exponentially, so a compact histogram covers
+    everything from sub-millisecond to multi-day latencies.
+
+    Arguments:
+        value -- A non-negative number, such as a latency in ms.
+    """
+    return int(math.log(max(value, 0) + 1, 2) * SUB_BUCKETS)
+
+
+def bucket_limit(index):
+    """
+    Return the largest value counted in a given bucket.
+
+    Arguments:
+        index -- A bucket index returned by bucket().
+    """
+    return 2 ** ((index + 1) / float(SUB_BUCKETS)) - 1
+
+
+def record(pipe, key, value, now):
+    """
+    Add a value to a histogram stored in a Redis hash.
+
+    The hash contains a counter for every non-empty bucket along with
+    the total count and sum of the values, and the times of the first
+    and latest values. Since every field is only ever incremented or
+    set, histograms written by any number of processes merge together.
+
+    Arguments:
+        pipe  -- A Redis pipeline to queue the commands on.
+        key   -- The Redis key of the histogram hash.
+        value -- The value to record, such as a latency in ms.
+        now   -- The current time in ms.
+    """
+    pipe.hincrby(key, 'b%s' % bucket(value), 1)
+    pipe.hincrby(key, 'count', 1)
+    pipe.hincrby(key, 'sum', int(value))
+    pipe.hsetnx(key, 'start', now)
+    pipe.hset(key, 'last', now)
+
+
+def summarize(data, percentiles=(50, 95, 99)):
+    """
+    Summarize the contents of a histogram hash.
+
+    Returns a dictionary with the number of values recorded, their
+    mean, the requested percentiles (keyed as 'p50', 'p95', etc) and
+    the throughput in values per second between the first and latest
+    recorded values.
+
+    Arguments:
+        data        -- The result of HGETALL on a histogram hash.
+        percentiles -- Optional list of percentiles to compute.
+    """
+    count = int(data.get('count', 0))
+    summary = {'count': count,
+               'mean': 0.0,
+               'throughput': 0.0}
+    for p in percentiles:
+        summary['p%s' % p] = 0.0
+    if not count:
+        return summary
+
+    summary['mean'] = int(data.get('sum', 0)) / float(count)
+    elapsed = (int(data['last']) - int(data['start'])) / 1000.0
+    if elapsed > 0:
+        summary['throughput'] = count / elapsed
+
+    buckets = sorted((int(k[1:]), int(v)) for k, v in data.items()
+                     if k.startswith('b'))
+    for p in percentiles:
+        target = count * p / 100.0
+        seen = 0
+        for index, n in buckets:
+            seen += n
+            if seen >= target:
+                summary['p%s' % p] = bucket_limit(index)
+                break
+    return summary
@@ -0,0 +1,261 @@
+"""
+    Written by Nathan Fritz and Lance Stout. Copyright 2011 by &yet, LLC.
+    Released under the terms of the MIT License
+"""
+
+import struct
+import threading
+
+
+# The value of a feed's 'notify' config field that makes its publish
+# and edit notices carry only the item ID, the feed's publish counter
+# and the size of the item, instead of the whole item.
+ID_ONLY = 'id'
+
+# The value of a feed's 'framing' config field that makes its item
+# carrying notices use length prefixed binary frames instead of joining
+# their fields with NUL bytes, so items may contain any bytes.
+BINARY = 'binary'
+
+# The first bytes of a binary frame: a marker byte that plain notices
+# do not start with, followed by the version of the frame format.
+FRAME_HEADER = '\xff\x01'
+
+# The most items whose contents are fetched together by a LazyBatch.
+BATCH_LIMIT = 1000
+
+# Shared Lua functions for building publish and edit notices in the
+# format chosen by a feed's 'notify' and 'framing' config fields.
+NOTIFY_LIB = """
+local function notice_format(config)
+    return redis.call('hmget', config, 'notify', 'framing')
+end
+
+local function frame(fields)
+    local parts = {'\\255\\1'}
+    for i, field in ipairs(fields) do
+        field = tostring(field)
+        parts[#parts + 1] = struct.pack('>I4', string.len(field)) .. field
+    end
+    return table.concat(parts)
+end
+
+local function item_notice(format, id, item, version)
+    if format[1] == 'id' then
+        if format[2] == 'binary' then
+            return frame({id, version, string.len(item)})
+        end
+        return id .. '\\0' .. version .. '\\0' .. string.len(item)
+    end
+    if format[2] == 'binary' then
+        return frame({id, item})
+    end
+    return id .. '\\0' .. item
+end
+"""
+
+
+def item_notice(mode, id, item, version, framing=None):
+    """
+    Return the contents of a publish or edit notice.
+
+    Arguments:
+        mode    -- The feed's 'notify' config value.
+        id      -- The ID of the item.
+        item    -- The contents of the item.
+        version -- The feed's publish counter after the change.
+        framing -- The feed's 'framing' config value.
+    """
+    # measure and send the item as stored, so that the size is in
+    # bytes, as in the Lua scripts
+    if isinstance(item, unicode):
+        item = item.encode('utf-8')
+    if mode == ID_ONLY:
+        fields = (id, version, len(item))
+    else:
+        fields = (id, item)
+    if framing == BINARY:
+        return frame(fields)
+    return '\x00'.join(str(field) for field in fields)
+
+
+def frame(fields):
+    """
+    Return a binary frame holding a sequence of fields.
+
+    A frame is FRAME_HEADER followed by each field as a four byte, big
+    endian length and the field's bytes.
+
+    Arguments:
+        fields -- The fields, converted with str().
+    """
+    parts = [FRAME_HEADER]
+    for field in fields:
+        field = str(field)
+        parts.append(struct.pack('>I', len(field)))
+        parts.append(field)
+    return ''.join(parts)
+
+
+def parse_frame(data):
+    """
+    Return the list of fields in a binary frame, or None if the data is
+    not a well formed frame.
+
+    The fields are returned as buffer objects pointing into the data,
+    so parsing a frame never copies or scans the fields. Use str() on
+    the fields that are needed as strings.
+
+    Arguments:
+        data -- The contents of a notice.
+    """
+    if not data.startswith(FRAME_HEADER):
+        return None
+    fields = []
+    pos = len(FRAME_HEADER)
+    end = len(data)
+    while pos < end:
+        if pos + 4 > end:
+            return None
+        size = struct.unpack_from('>I', data, pos)[0]
+        pos += 4
+        if pos + size > end:
+            return None
+        fields.append(buffer(data, pos, size))
+        pos += size
+    return fields
+
+
+def frame_head(data):
+    """
+    Return the first field of a binary frame without reading the rest,
+    or None if the data does not start with a frame.
+
+    Arguments:
+        data -- The contents of a notice.
+    """
+    start = len(FRAME_HEADER) + 4
+    if not data.startswith(FRAME_HEADER) or len(data) < start:
+        return None
+    size = struct.unpack_from('>I', data, start - 4)[0]
+    if start + size > len(data):
+        return None
+    return data[start:start + size]
+
+
+class LazyBatch(object):
+
+    """
+    A LazyBatch fetches the contents of a group of items from a feed
+    with a single HMGET, the first time any of them is needed.
+
+    Methods:
+        add -- Add an item ID to the batch.
+        get -- Return the contents of an item in the batch.
+    """
+
+    def __init__(self, redis, key):
+        """
+        Create a new, empty batch.
+
+        Arguments:
+            redis -- The Redis connection to fetch items with.
+            key   -- The feed.items hash of the feed.
+        """
+        self.redis = redis
+        self.key = key
+        self.ids = []
+        self.values = None
+        self.lock = threading.Lock()
+
+    def add(self, id):
+        """
+        Add an item ID to the batch.
+
+        Returns False if the batch has already been fetched or is full,
+        in which case a new batch is needed.
+
+        Arguments:
+            id -- The ID of the item.
+        """
+        with self.lock:
+            if self.values is not None or len(self.ids) >= BATCH_LIMIT:
+                return False
+            self.ids.append(id)
+            return True
+
+    def get(self, id):
+        """
+        Return the contents of an item, fetching the whole batch if it
+        has not been fetched yet.
+
+        Arguments:
+            id -- The ID of the item.
+        """
+        with self.lock:
+            if self.values is None:
+                self.values = dict(zip(self.ids,
+                                       self.redis.hmget(self.key, self.ids)))
+        return self.values.get(id)
+
+
+class LazyItem(object):
+
+    """
+    A LazyItem stands in for the contents of an item received through
+    an ID only notice. The contents are fetched on first use, together
+    with those of the other items in the same batch.
+
+    Converting a LazyItem to a string, comparing it, or using string
+    methods on it uses the item's contents, which are None if the item
+    was removed before being fetched. Its length is the size announced
+    in the notice and does not need a fetch.
+
+    Attributes:
+        id      -- The ID of the item.
+        version -- The feed's publish counter when the notice was sent.
+        size    -- The size of the item contents in bytes.
+        value   -- The contents of the item.
+    """
+
+    def __init__(self, batch, id, version, size):
+        """
+        Create a new lazy item.
+
+        Arguments:
+            batch   -- The LazyBatch that fetches the item.
+            id      -- The ID of the item.
+            version -- The feed's publish counter from the notice.
+            size    -- The item size from the notice.
+        """
+        self.batch = batch
+        self.id = id
+        self.version = version
+        self.size = size
+        self._value = None
+        self._fetched = False
+
+    @property
+    def value(self):
+        if not self._fetched:
+            self._value = self.batch.get(self.id)
+            self._fetched = True
+        return self._value
+
+    def __str__(self):
+        return str(self.value)
+
+    def __len__(self):
+        return self.size
+
+    def __eq__(self, other):
+        return self.value == other
+
+    def __ne__(self, other):
+        return self.value != other
+
+    def __getattr__(self, name):
+        return getattr(self.value, name)
+
+    def __repr__(self):
+        return '<LazyItem %s>' % self.id
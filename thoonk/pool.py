@@ -0,0 +1,93 @@
+"""
+    Written by Nathan Fritz and Lance Stout. Copyright 2011 by &yet, LLC.
+    Released under the terms of the MIT License
+"""
+
+import redis
+
+
+def connection_pool(host='localhost', port=6379, db=0, password=None,
+                    url=None, unix_socket_path=None, max_connections=50,
+                    timeout=20):
+    """
+    Return a bounded pool of connections to a Redis server.
+
+    At most max_connections connections are opened. When all of them
+    are in use, taking another waits up to timeout seconds for one to
+    be released before raising a ConnectionError.
+
+    Arguments:
+        host             -- The Redis server name.
+        port             -- Port for connecting to the Redis server.
+        db               -- The Redis database to use.
+        password         -- Optional password for the Redis server.
+        url              -- Optional redis:// or unix:// URL of the
+                            server, used instead of the host, port, db
+                            and password.
+        unix_socket_path -- Optional path of a Unix socket to connect
+                            through instead of host and port.
+        max_connections  -- The most connections the pool opens.
+        timeout          -- Seconds to wait for a free connection, or
+                            None to wait without limit.
+    """
+    if url is not None:
+        return redis.BlockingConnectionPool.from_url(
+            url, max_connections=max_connections, timeout=timeout)
+    if unix_socket_path is not None:
+        return redis.BlockingConnectionPool(
+            max_connections=max_connections, timeout=timeout,
+            connection_class=redis.UnixDomainSocketConnection,
+            path=unix_socket_path, db=db, password=password)
+    return redis.BlockingConnectionPool(
+        max_connections=max_connections, timeout=timeout,
+        host=host, port=port, db=db, password=password)
+
+
+def clone_pool(pool, max_connections=50, timeout=20):
+    """
+    Return a new bounded pool of connections made the same way as
+    those of an existing pool, to the same server and database and
+    with the same password.
+
+    Arguments:
+        pool            -- The existing connection pool.
+        max_connections -- The most connections the new pool opens.
+        timeout         -- Seconds to wait for a free connection, or
+                           None to wait without limit.
+    """
+    return redis.BlockingConnectionPool(
+        max_connections=max_connections, timeout=timeout,
+        connection_class=pool.connection_class, **pool.connection_kwargs)
+
+
+def server_key(pool):
+    """
+    Return a hashable key identifying the Redis server a pool connects
+    to, ignoring the database.
+
+    Arguments:
+        pool -- The connection pool.
+    """
+    kwargs = dict(pool.connection_kwargs)
+    kwargs.pop('db', None)
+    return (pool.connection_class, frozenset(kwargs.items()))
+
+
+def pool_stats(pool):
+    """
+    Return a dictionary with the 'max' number of connections of a pool,
+    and the number 'created', 'in_use' and 'idle'.
+
+    Arguments:
+        pool -- A redis-py ConnectionPool or BlockingConnectionPool.
+    """
+    if isinstance(pool, redis.BlockingConnectionPool):
+        created = len(pool._connections)
+        idle = len([c for c in list(pool.pool.queue) if c is not None])
+    else:
+        created = pool._created_connections
+        idle = len(pool._available_connections)
+    return {'max': pool.max_connections,
+            'created': created,
+            'in_use': created - idle,
+            'idle': idle}
@@ -3,13 +3,81 @@
     Released under the terms of the MIT License
 """
 
+import fnmatch
+import itertools
+import logging
 import redis
 import threading
+import time
 import uuid
-
-from thoonk import feeds, cache
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from thoonk import feeds, cache, pool, scripts, sharding
+from thoonk.feeds import Job
+from thoonk.dispatch import OrderedDispatcher, BatchHandler, EventBuffer
+from thoonk.notify import (ID_ONLY, BINARY, LazyBatch, LazyItem, frame,
+                           frame_head, parse_frame)
 from thoonk.exceptions import FeedExists, FeedDoesNotExist, NotListening
 
+
+# Prefixes of the per-feed channels that listeners handle. The name of
+# the feed follows the prefix.
+FEED_CHANNEL_PREFIXES = ('feed.publish:', 'feed.publishes:', 'feed.edit:',
+                         'feed.retract:', 'feed.position:', 'feed.reorder:',
+                         'job.finish:')
+
+# Channels announcing feed creation, deletion and configuration, which
+# listeners handle as they arrive instead of buffering them.
+CONTROL_CHANNELS = ('newfeed', 'newfeeds', 'delfeed', 'delfeeds', 'conffeed')
+
+# Seconds to wait before the first attempt to restore a lost listener
+# connection, and the longest wait between attempts.
+RECONNECT_MIN_DELAY = 0.1
+RECONNECT_MAX_DELAY = 30
+
+# Seconds before the last received message from which missed publishes
+# are replayed after a reconnect, allowing for clock differences between
+# publishers and the listener.
+CATCH_UP_SLACK = 1.0
+
+# Number of feeds created or deleted per round of pipelined commands by
+# create_feeds and delete_feeds.
+FEED_BATCH_SIZE = 1000
+
+# Position of the item ID in the arguments of each event, after the
+# feed name, for coalescing batched events.
+EVENT_ID_INDEX = {'publish': 1,
+                  'edit': 1,
+                  'retract': 0,
+                  'position': 0,
+                  'finish': 0}
+
+
+log = logging.getLogger(__name__)
+
+
+def reconnect(pubsub):
+    """
+    Restore the lost connection of a Redis pubsub object, waiting
+    longer between each failed attempt.
+
+    Arguments:
+        pubsub -- The pubsub object.
+    """
+    delay = RECONNECT_MIN_DELAY
+    while True:
+        log.warning('Listener connection lost, reconnecting in %s seconds',
+                    delay)
+        time.sleep(delay)
+        try:
+            pubsub.connection.connect()
+            return
+        except redis.exceptions.ConnectionError:
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
 class Thoonk(object):
 
     """
@@ -29,7 +97,9 @@ class Thoonk(object):
 
     Thoonk.py also provides an additional pyqueue feed type which behaves
     identically to a queue, except that it pickles/unpickles Python
-    datatypes automatically.
+    datatypes automatically, and a scored sorted feed type which behaves
+    identically to a sorted feed, but keeps its ordering in a sorted set
+    so that inserts and moves in large feeds are cheap.
 
     The core Thoonk class provides infrastructure for creating and
     managing feeds.
@@ -48,24 +118,54 @@ class Thoonk(object):
         lredis       -- A Redis connection for listening to publish events.
         port         -- The Redis server port.
         redis        -- The Redis connection instance.
+        blocking_redis -- The Redis connection instance for blocking pops.
+        hash_tags    -- A flag indicating if feed names are wrapped in
+                        braces in keys.
+        shards       -- A HashRing of (redis, blocking_redis) pairs
+                        holding the feeds, or None.
+        replicas     -- The Redis connections to replicas of the main
+                        server.
 
     Methods:
         close             -- Terminate the listening Redis connection.
         create_feed       -- Create a new feed using a given type and config.
+        create_feeds      -- Create many feeds at once.
         create_notice     -- Execute handlers for feed creation event.
         delete_feed       -- Remove an existing feed.
+        delete_feeds      -- Remove many feeds at once.
         delete_notice     -- Execute handlers for feed deletion event.
         feed_exists       -- Determine if a feed has already been created.
+        get_buffer_stats  -- Return the listener's event buffer counters.
         get_feeds         -- Return the set of active feeds.
+        key_name          -- Return the form of a name used in keys.
         listen            -- Start the listening Redis connection.
+        pool_stats        -- Return the use of the connection pools.
+        script_stats      -- Return the Lua script counters.
+        cache_stats       -- Return the feed cache counters.
         publish_notice    -- Execute handlers for item publish event.
+        read_redis_for    -- Return the Redis connection for a read.
+        redis_for         -- Return the Redis connection holding a feed.
+        blocking_redis_for -- Return the Redis connection for blocking
+                              pops from a feed.
         register_feedtype -- Make a new feed type available for use.
+        register_batch_handler -- Assign a function to receive batches
+                                  of events.
         register_handler  -- Assign a function as an event handler.
         retract_notice    -- Execute handlers for item retraction event.
         set_config        -- Set the configuration for a given feed.
+        subscribe_feed    -- Start receiving notices for a feed.
+        unsubscribe_feed  -- Stop receiving notices for a feed.
     """
 
-    def __init__(self, host='localhost', port=6379, db=0, listen=False, password=None):
+    def __init__(self, host='localhost', port=6379, db=0, listen=False,
+                 password=None, dispatch_workers=0, dispatch_queue_size=1000,
+                 listen_patterns=False, listen_feeds=None, listen_types=None,
+                 buffer_size=0, buffer_policy=EventBuffer.BLOCK,
+                 shared_listener=False, connection_pool=None, url=None,
+                 unix_socket_path=None, max_connections=50,
+                 blocking_connections=50, pool_timeout=20, hash_tags=False,
+                 shards=None, replicas=None, feed_cache_size=10000,
+                 missing_feed_ttl=1.0, catch_up=False):
         """
         Start a new Thoonk instance for creating and managing feeds.
 
@@ -76,12 +176,128 @@ class Thoonk(object):
             listen -- Flag indicating if this Thoonk instance should listen
                       for feed events and relevant event handlers. Defaults
                       to False.
+            dispatch_workers -- Number of threads for running event
+                                handlers. Events for the same feed are
+                                handled in order, events for different
+                                feeds in parallel. Defaults to 0, which
+                                runs handlers on the listener thread.
+            dispatch_queue_size -- Maximum number of events waiting for
+                                   each dispatch thread.
+            listen_patterns -- Flag indicating if the listener should
+                               use a fixed set of pattern subscriptions
+                               covering every feed, instead of
+                               subscribing to the channels of each feed.
+                               Startup time then no longer depends on
+                               the number of feeds. Defaults to False.
+            listen_feeds -- Optional list of feed names or glob patterns.
+                            When given, the listener only receives
+                            notices for matching feeds.
+            listen_types -- Optional list of feed type names. When given,
+                            the listener only receives notices for feeds
+                            of these types.
+            buffer_size -- Number of received messages the listener may
+                           hold while handlers catch up. Defaults to 0,
+                           which handles messages as they are read.
+            buffer_policy -- What to do with new messages: 'block' or
+                             'drop_oldest' when the buffer is full, or
+                             'coalesce' with a buffered message for
+                             the same item. See EventBuffer.
+            shared_listener -- Flag indicating if the listener should
+                               share one pubsub connection with every
+                               other shared listener in the process for
+                               the same Redis server, instead of opening
+                               its own. See ListenerHub. Defaults to
+                               False.
+            connection_pool -- Optional redis-py connection pool to use
+                               for commands, instead of creating one.
+                               Blocking pops and the listener use pools
+                               of their own connecting the same way.
+            url -- Optional redis:// or unix:// URL of the Redis server,
+                   used instead of host, port, db and password.
+            unix_socket_path -- Optional path of a Unix socket to
+                                connect through instead of host and port.
+            max_connections -- The most connections used for commands
+                               other than blocking pops. Defaults to 50.
+            blocking_connections -- The most connections held by blocking
+                                    queue and job pops at once. Further
+                                    pops wait for one of them to finish.
+                                    Defaults to 50.
+            pool_timeout -- Seconds a command waits for a free connection
+                            before raising a ConnectionError. Defaults
+                            to 20.
+            hash_tags -- Flag indicating if the name in every key of a
+                         feed or scheduler is wrapped in braces, as in
+                         feed.ids:{name}, so that Redis Cluster keeps
+                         them in one hash slot. Every client of the
+                         feeds must use the same setting. Defaults to
+                         False.
+            shards -- Optional list of Redis URLs or connection pools.
+                      When given, feeds are spread over these servers
+                      by consistent hashing of their names, while the
+                      list of feeds and the feed creation, deletion and
+                      configuration notices stay on the main server.
+            replicas -- Optional list of Redis URLs or connection pools
+                        of replicas of the main server. Read only calls
+                        such as get_ids and get_item are sent to them in
+                        turn, unless called with consistent=True. Feeds
+                        on shards are always read from their shard.
+            feed_cache_size -- The most feed objects kept in memory.
+                               Defaults to 10000.
+            missing_feed_ttl -- Seconds a feed found not to exist is
+                                remembered as missing. Defaults to 1.
+            catch_up -- Which feeds the listener replays missed
+                        publishes of after reconnecting: True for every
+                        feed it receives notices for, or a list of feed
+                        names or glob patterns. Defaults to False, which
+                        replays nothing.
         """
-        self.host = host
-        self.port = port
-        self.db = db
-        self.redis = redis.StrictRedis(host=self.host, port=self.port, db=self.db, password=password)
-        self._feeds = cache.FeedCache(self)
+        # the pools created here, which close disconnects; pools passed
+        # in may be shared with other clients and are left alone
+        self._own_pools = []
+        if connection_pool is None:
+            connection_pool = pool.connection_pool(
+                host, port, db, password, url, unix_socket_path,
+                max_connections, pool_timeout)
+            self._own_pools.append(connection_pool)
+        connection_kwargs = connection_pool.connection_kwargs
+        self.host = connection_kwargs.get('host', host)
+        self.port = connection_kwargs.get('port', port)
+        self.db = connection_kwargs.get('db', db)
+        self.redis = redis.StrictRedis(connection_pool=connection_pool)
+        self.blocking_redis = redis.StrictRedis(
+            connection_pool=pool.clone_pool(connection_pool,
+                                            blocking_connections, None))
+        self._own_pools.append(self.blocking_redis.connection_pool)
+        self.hash_tags = hash_tags
+        self.shards = None
+        if shards:
+            nodes = {}
+            for shard in shards:
+                if isinstance(shard, basestring):
+                    shard = pool.connection_pool(
+                        url=shard, max_connections=max_connections,
+                        timeout=pool_timeout)
+                    self._own_pools.append(shard)
+                blocking_pool = pool.clone_pool(shard, blocking_connections,
+                                                None)
+                self._own_pools.append(blocking_pool)
+                nodes[sharding.node_name(shard)] = (
+                    redis.StrictRedis(connection_pool=shard),
+                    redis.StrictRedis(connection_pool=blocking_pool))
+            self.shards = sharding.HashRing(nodes)
+        self.replicas = []
+        for replica in replicas or ():
+            if isinstance(replica, basestring):
+                replica = pool.connection_pool(
+                    url=replica, max_connections=max_connections,
+                    timeout=pool_timeout)
+                self._own_pools.append(replica)
+            self.replicas.append(redis.StrictRedis(connection_pool=replica))
+        # cycle objects are safe to share between threads
+        self._next_replica = itertools.cycle(self.replicas).next
+        self._feeds = cache.FeedCache(self, feed_cache_size, missing_feed_ttl)
+        # (expiry time, (rate, burst)) of job feeds, by feed name
+        self._rate_limits = {}
         self.instance = uuid.uuid4().hex
 
         self.feedtypes = {}
@@ -98,27 +314,122 @@ class Thoonk(object):
         self.register_feedtype(u'job', feeds.Job)
         self.register_feedtype(u'pyqueue', feeds.PythonQueue)
         self.register_feedtype(u'sorted_feed', feeds.SortedFeed)
+        self.register_feedtype(u'scored_sorted_feed', feeds.ScoredSortedFeed)
 
         if listen:
-            self.listener = ThoonkListener(self)
+            dispatcher = None
+            if dispatch_workers:
+                dispatcher = OrderedDispatcher(dispatch_workers,
+                                               dispatch_queue_size)
+            buffer = None
+            if buffer_size:
+                buffer = EventBuffer(buffer_size, buffer_policy)
+            hub = None
+            if shared_listener:
+                hub = ListenerHub.get(connection_pool)
+            self.listener = ThoonkListener(self, dispatcher=dispatcher,
+                                           buffer=buffer,
+                                           hub=hub,
+                                           patterns=listen_patterns,
+                                           feeds=listen_feeds,
+                                           types=listen_types,
+                                           catch_up=catch_up)
+            self._own_pools.append(self.listener.redis.connection_pool)
             self.listener.start()
             self.listener.ready.wait()
 
-    def _publish(self, schema, items=[], pipe=None):
+    def key_name(self, name):
+        """
+        Return the form of a feed or scheduler name used in its keys
+        and channels, wrapped in braces when using hash tags.
+
+        Arguments:
+            name -- The name of the feed or scheduler.
+        """
+        if self.hash_tags:
+            return sharding.tag(name)
+        return name
+
+    def redis_for(self, feed):
+        """
+        Return the Redis connection holding a feed.
+
+        Arguments:
+            feed -- The name of the feed.
+        """
+        if self.shards is None:
+            return self.redis
+        return self.shards.get(feed)[0]
+
+    def read_redis_for(self, feed=None, consistent=False):
+        """
+        Return the Redis connection for a read only call, which is the
+        next replica in turn when there are replicas and consistency is
+        not required.
+
+        Arguments:
+            feed       -- Optional name of the feed to read from.
+                          Defaults to the main server.
+            consistent -- Flag indicating if the call must see every
+                          completed write, so must not use a replica.
+        """
+        if consistent or not self.replicas or (
+                feed is not None and self.shards is not None):
+            return self.redis if feed is None else self.redis_for(feed)
+        return self._next_replica()
+
+    def blocking_redis_for(self, feed):
+        """
+        Return the Redis connection for blocking pops from a feed.
+
+        Arguments:
+            feed -- The name of the feed.
+        """
+        if self.shards is None:
+            return self.blocking_redis
+        return self.shards.get(feed)[1]
+
+    def _config_values(self, feeds, field):
+        """
+        Return the values of a config field for a list of feeds, with
+        one pipeline per server.
+
+        Arguments:
+            feeds -- The names of the feeds.
+            field -- The name of the config field.
+        """
+        groups = {}
+        for feed in feeds:
+            groups.setdefault(self.redis_for(feed), []).append(feed)
+        values = {}
+        for conn, names in groups.items():
+            pipe = conn.pipeline()
+            for feed in names:
+                pipe.hget('feed.config:%s' % self.key_name(feed), field)
+            values.update(zip(names, pipe.execute()))
+        return [values[feed] for feed in feeds]
+
+    def _publish(self, schema, items=[], pipe=None, framing=None):
         """
         A shortcut method to publish items separated by \x00.
 
         Arguments:
-            schema -- The key to publish the items to.
-            items  -- A tuple or list of items to publish.
-            pipe   -- A redis pipeline to use to publish the item using.
-                      Note: it is up to the caller to execute the pipe after
-                      publishing
+            schema  -- The key to publish the items to.
+            items   -- A tuple or list of items to publish.
+            pipe    -- A redis pipeline to use to publish the item using.
+                       Note: it is up to the caller to execute the pipe after
+                       publishing
+            framing -- Optional 'framing' config value of the feed. If
+                       'binary', the items are sent as a binary frame.
         """
+        if framing == BINARY:
+            data = frame(items)
+        else:
+            data = "\x00".join(items)
         if pipe:
-            pipe.publish(schema, "\x00".join(items))
+            pipe.publish(schema, data)
         else:
-            self.redis.publish(schema, "\x00".join(items))
+            self.redis.publish(schema, data)
 
     def register_feedtype(self, feedtype, klass):
         """
@@ -190,6 +501,113 @@ class Thoonk(object):
         else:
             raise NotListening
 
+    def register_batch_handler(self, name, handler, max_size=100,
+                               max_wait=0.05, coalesce=False):
+        """
+        Register a function to receive feed events in batches.
+
+        Events are grouped by feed, and the handler is called as
+        handler(feed, events) with a list of the argument tuples of
+        each event, such as (item, id) tuples for publish events.
+        A batch is delivered when it reaches max_size events or when
+        its oldest event has waited max_wait seconds.
+
+        Returns the registered batch handler, which may be passed to
+        remove_handler to unregister it.
+
+        Arguments:
+            name     -- The name of the feed event.
+            handler  -- The function for handling batches of events.
+            max_size -- The maximum number of events in a batch.
+            max_wait -- The maximum seconds an event waits for delivery.
+            coalesce -- If True, repeated events for the same item ID
+                        in a batch are replaced by the latest one.
+                        Supported for publish, edit, retract, position
+                        and finish events.
+        """
+        if not self.listener:
+            raise NotListening
+        id_index = None
+        if coalesce:
+            if name not in EVENT_ID_INDEX:
+                raise ValueError("Cannot coalesce '%s' events" % name)
+            id_index = EVENT_ID_INDEX[name]
+        batch_handler = BatchHandler(handler, max_size, max_wait, id_index)
+        self.listener.register_handler(name, batch_handler)
+        return batch_handler
+
+    def pool_stats(self):
+        """
+        Return the use of the connection pools, as a dictionary holding
+        the stats of the 'commands' pool and of the 'blocking' pool used
+        by queue and job pops, and a list of the stats of the pools of
+        any 'replicas'. Each has the 'max' number of connections and the
+        number 'created', 'in_use' and 'idle'.
+        """
+        stats = {'commands': pool.pool_stats(self.redis.connection_pool),
+                 'blocking': pool.pool_stats(
+                     self.blocking_redis.connection_pool)}
+        if self.replicas:
+            stats['replicas'] = [pool.pool_stats(replica.connection_pool)
+                                 for replica in self.replicas]
+        return stats
+
+    def script_stats(self):
+        """
+        Return the counters of every registered Lua script, by name.
+        Scripts count their 'calls', the 'reloads' that had to send
+        their source to the server, the 'errors', and the 'total_time',
+        'mean_time' and 'max_time' in seconds spent in them. The
+        counters are shared by every Thoonk instance in the process.
+        """
+        return scripts.stats()
+
+    def cache_stats(self):
+        """
+        Return the counters of the feed cache: the number of feeds
+        'cached', the 'hits', the 'negative_hits' on feeds known to be
+        missing, the 'misses' looked up in Redis, the misses 'coalesced'
+        into a lookup in progress, and the 'evictions'.
+        """
+        return self._feeds.stats()
+
+    def get_buffer_stats(self):
+        """
+        Return the counters of the listener's event buffer: the number
+        of messages 'buffered', the total 'dropped' and 'coalesced', and
+        the 'lag' in seconds of the oldest buffered message.
+        """
+        if not self.listener:
+            raise NotListening
+        if self.listener.buffer is None:
+            return {'buffered': 0, 'dropped': 0, 'coalesced': 0, 'lag': 0.0}
+        return self.listener.buffer.stats()
+
+    def subscribe_feed(self, feed):
+        """
+        Start receiving notices for a feed, even if it does not match
+        the listen_feeds or listen_types filters.
+
+        Arguments:
+            feed -- The name of the feed.
+        """
+        if self.listener:
+            self.listener.subscribe_feed(feed)
+        else:
+            raise NotListening
+
+    def unsubscribe_feed(self, feed):
+        """
+        Stop receiving notices for a feed.
+
+        Arguments:
+            feed -- The name of the feed.
+        """
+        if self.listener:
+            self.listener.unsubscribe_feed(feed)
+        else:
+            raise NotListening
+
     def create_feed(self, feed, config):
         """
         Create a new feed with a given configuration.
@@ -214,6 +632,16 @@ class Thoonk(object):
         """
         feed_instance = self._feeds[feed]
 
+        if self.hash_tags or self.shards is not None:
+            # the keys of the feed are in another slot or on another
+            # server than the list of feeds
+            if not self.redis.srem('feeds', feed):
+                raise FeedDoesNotExist
+            feed_instance.redis.delete(*feed_instance.get_schemas())
+            self._forget_config(feed)
+            self._publish('delfeed', (feed, self.instance))
+            return
+
         def _delete_feed(pipe):
             if not pipe.sismember('feeds', feed):
                 raise FeedDoesNotExist
@@ -224,6 +652,143 @@ class Thoonk(object):
             self._publish('delfeed', (feed, self.instance), pipe)
 
         self.redis.transaction(_delete_feed, 'feeds')
+        self._forget_config(feed)
+
+    def create_feeds(self, feeds, batch_size=FEED_BATCH_SIZE):
+        """
+        Create many feeds, each with its own configuration.
+
+        The feeds are created in batches, each taking two pipelined
+        round trips and sending one notice listing the feeds it created
+        on the newfeeds channel. Feeds that already exist are left
+        unchanged.
+
+        Returns the set of names of the feeds that already existed.
+
+        Arguments:
+            feeds      -- A dictionary mapping the names of the new feeds
+                          to dictionaries of configuration values.
+            batch_size -- The number of feeds created per batch.
+        """
+        names = list(feeds)
+        existing = set()
+        for start in range(0, len(names), batch_size):
+            batch = names[start:start + batch_size]
+            pipe = self.redis.pipeline(transaction=False)
+            for feed in batch:
+                pipe.sadd('feeds', feed)
+            created = [feed for feed, added in zip(batch, pipe.execute())
+                       if added]
+            existing.update(set(batch).difference(created))
+            if not created:
+                continue
+
+            pipes = {self.redis: self.redis.pipeline(transaction=False)}
+            for feed in created:
+                config = dict(feeds[feed])
+                config.setdefault(u'type', u'feed')
+                conn = self.redis_for(feed)
+                if conn not in pipes:
+                    pipes[conn] = conn.pipeline(transaction=False)
+                pipes[conn].hmset('feed.config:' + self.key_name(feed), config)
+            self._publish('newfeeds', created + [self.instance],
+                          pipes[self.redis])
+            self._execute_pipes(pipes)
+            for feed in created:
+                self._forget_config(feed)
+        return existing
+
+    def delete_feeds(self, feeds, batch_size=FEED_BATCH_SIZE):
+        """
+        Delete many feeds.
+
+        The feeds are deleted in batches, each taking three pipelined
+        round trips (four when it contains job feeds) and sending one notice listing the feeds it deleted
+        on the delfeeds channel. Unlike delete_feed, the keys of a feed
+        are deleted after it is removed from the set of feeds rather
+        than in the same transaction.
+
+        Returns the set of names of the feeds that did not exist.
+
+        Arguments:
+            feeds      -- The names of the feeds to delete.
+            batch_size -- The number of feeds deleted per batch.
+        """
+        names = list(feeds)
+        missing = set()
+        for start in range(0, len(names), batch_size):
+            batch = names[start:start + batch_size]
+            types = self._config_values(batch, 'type')
+            pipe = self.redis.pipeline(transaction=False)
+            for feed in batch:
+                pipe.srem('feeds', feed)
+            removed = []
+            for feed, feed_type, found in zip(batch, types, pipe.execute()):
+                if found:
+                    removed.append((feed, feed_type))
+                else:
+                    missing.add(feed)
+            if not removed:
+                continue
+
+            # the keys of registered workers are only known from the
+            # worker sets of job feeds, read together for the batch
+            instances = []
+            reads = {}
+            for feed, feed_type in removed:
+                klass = self.feedtypes.get(feed_type, self.feedtypes['feed'])
+                instance = klass(self, feed)
+                if isinstance(instance, Job):
+                    if instance.redis not in reads:
+                        reads[instance.redis] = instance.redis.pipeline(
+                            transaction=False)
+                    reads[instance.redis].smembers(instance.feed_workers)
+                instances.append(instance)
+            workers = dict((conn, iter(pipe.execute()))
+                           for conn, pipe in reads.items())
+
+            pipes = {self.redis: self.redis.pipeline(transaction=False)}
+            for instance in instances:
+                if isinstance(instance, Job):
+                    schema = instance.get_schemas(
+                        next(workers[instance.redis]))
+                else:
+                    schema = instance.get_schemas()
+                if instance.redis not in pipes:
+                    pipes[instance.redis] = instance.redis.pipeline(
+                        transaction=False)
+                pipes[instance.redis].delete(*schema)
+            self._publish('delfeeds',
+                          [feed for feed, _ in removed] + [self.instance],
+                          pipes[self.redis])
+            self._execute_pipes(pipes)
+            for feed, _ in removed:
+                self._forget_config(feed)
+        return missing
+
+    def _forget_config(self, feed):
+        """
+        Drop everything cached about a feed that was created, deleted
+        or reconfigured.
+
+        Arguments:
+            feed -- The name of the feed.
+        """
+        self._feeds.invalidate(feed)
+        self._rate_limits.pop(feed, None)
+
+    def _execute_pipes(self, pipes):
+        """
+        Execute a pipeline for each server, sending the one for the main
+        server last so that its feed notices follow the other changes.
+
+        Arguments:
+            pipes -- A dictionary mapping Redis connections to pipelines.
+        """
+        for conn, pipe in pipes.items():
+            if conn is not self.redis:
+                pipe.execute()
+        pipes[self.redis].execute()
 
     def set_config(self, feed, config, new_feed=False):
         """
@@ -237,21 +802,27 @@ class Thoonk(object):
             raise FeedDoesNotExist
         if u'type' not in config:
             config[u'type'] = u'feed'
-        pipe = self.redis.pipeline()
+        pipe = self.redis_for(feed).pipeline()
         for k, v in config.iteritems():
-            pipe.hset('feed.config:' + feed, k, v)
+            pipe.hset('feed.config:' + self.key_name(feed), k, v)
         pipe.execute()
+        self._forget_config(feed)
         if new_feed:
             self._publish('newfeed', (feed, self.instance))
         self._publish('conffeed', (feed, self.instance))
 
-    def get_feed_names(self):
+    def get_feed_names(self, consistent=False):
         """
         Return the set of known feeds.
 
+        Arguments:
+            consistent -- Flag indicating if the main server must be
+                          read instead of a replica.
+
         Returns: set
         """
-        return self.redis.smembers('feeds') or set()
+        return self.read_redis_for(consistent=consistent).smembers(
+            'feeds') or set()
 
     def feed_exists(self, feed):
         """
@@ -263,26 +834,70 @@ class Thoonk(object):
         return self.redis.sismember('feeds', feed)
 
     def close(self):
-        """Terminate the listening Redis connection."""
+        """
+        Terminate the listening Redis connection, and disconnect the
+        connection pools created by this Thoonk instance.
+        """
         if self.listening:
             self.redis.publish(self.listener._finish_channel, "")
             self.listener.finished.wait()
-        self.redis.connection_pool.disconnect()
+            if self.listener.dispatcher:
+                self.listener.dispatcher.stop()
+            for handlers in self.listener.handlers.values():
+                for handler in handlers:
+                    if isinstance(handler, BatchHandler):
+                        handler.stop()
+        for own_pool in self._own_pools:
+            own_pool.disconnect()
 
 
 class ThoonkListener(threading.Thread):
 
     def __init__(self, thoonk, *args, **kwargs):
+        self.dispatcher = kwargs.pop('dispatcher', None)
+        self.patterns = kwargs.pop('patterns', False)
+        self.buffer = kwargs.pop('buffer', None)
+        self.hub = kwargs.pop('hub', None)
+        feeds = kwargs.pop('feeds', None)
+        types = kwargs.pop('types', None)
+        catch_up = kwargs.pop('catch_up', False)
+        self.feed_filter = list(feeds) if feeds is not None else None
+        self.type_filter = set(types) if types is not None else None
+        if catch_up is True or not catch_up:
+            self.catch_up = bool(catch_up)
+        else:
+            self.catch_up = list(catch_up)
         threading.Thread.__init__(self, *args, **kwargs)
         self.lock = threading.Lock()
         self.handlers = {}
         self.thoonk = thoonk
         self.ready = threading.Event()
-        self.redis = redis.StrictRedis(host=thoonk.host, port=thoonk.port, db=thoonk.db)
+        self.redis = redis.StrictRedis(
+            connection_pool=pool.clone_pool(thoonk.redis.connection_pool))
         self.finished = threading.Event()
         self.instance = thoonk.instance
         self._finish_channel = "listenerclose_%s" % self.instance
         self._pubsub = None
+        self._types = {}
+        self._formats = {}
+        self._lazy_batches = {}
+        self._last_alive = None
+        self._gap_since = None
+        self._routes = {}
+        self._parsers = {'newfeed': self._on_newfeed,
+                         'newfeeds': self._on_newfeeds,
+                         'delfeed': self._on_delfeed,
+                         'delfeeds': self._on_delfeeds,
+                         'conffeed': self._on_conffeed,
+                         'feed.publish:': self._on_publish,
+                         'feed.publishes:': self._on_publish,
+                         'feed.edit:': self._on_edit,
+                         'feed.retract:': self._on_retract,
+                         'feed.position:': self._on_position,
+                         'feed.reorder:': self._on_reorder,
+                         'job.finish:': self._on_finish}
+        self._added = set()
+        self._removed = set()
         self.daemon = True
 
     def finish(self):
@@ -299,75 +914,521 @@ class ThoonkListener(threading.Thread):
             - Item retractions.
         """
         # listener redis object
-        self._pubsub = self.redis.pubsub()
+        if self.thoonk.shards is not None:
+            self._pubsub = ShardedSubscription(self.thoonk, self._route)
+        elif self.hub is not None:
+            self._pubsub = self.hub.subscribe()
+        else:
+            self._pubsub = self.redis.pubsub()
+        # redis-py resubscribes by itself when the connection is restored;
+        # note each time it does so that missed publishes can be replayed
+        resubscribe = self._pubsub.on_connect
+        def on_connect(connection):
+            resubscribe(connection)
+            if (self.catch_up and self._last_alive is not None and
+                    self._gap_since is None):
+                self._gap_since = self._last_alive - CATCH_UP_SLACK
+        self._pubsub.on_connect = on_connect
         # subscribe to feed activities channel
-        self._pubsub.subscribe((self._finish_channel, 'newfeed', 'delfeed', 'conffeed'))
-
-        # subscribe to exist feeds retract and publish
-        for feed in self.redis.smembers("feeds"):
-            self._pubsub.subscribe(self.thoonk._feeds[feed].get_channels())
-
+        self._pubsub.subscribe((self._finish_channel,) + CONTROL_CHANNELS)
+
+        if self.patterns:
+            # subscribe to the channels of every matching feed, current
+            # or future
+            self._pubsub.psubscribe([prefix + self.thoonk.key_name(glob)
+                                     for prefix in FEED_CHANNEL_PREFIXES
+                                     for glob in self.feed_filter or ['*']])
+        else:
+            # subscribe to exist feeds retract and publish
+            feeds = self.redis.smembers("feeds")
+            if self.type_filter is not None:
+                self._load_types(feeds)
+            channels = []
+            for feed in feeds:
+                if self.wants(feed):
+                    channels.extend(self._feed_channels(feed))
+            if channels:
+                self._pubsub.subscribe(channels)
+
+        self._last_alive = time.time()
         self.ready.set()
+        while True:
+            try:
+                self._listen()
+                break
+            except redis.exceptions.ConnectionError:
+                self._reconnect()
+        if self.buffer is not None:
+            self.buffer.stop()
+        self.finished.set()
+
+    def _listen(self):
+        """Handle received messages until the listener is finished."""
+        if self._gap_since is not None:
+            self._catch_up()
         for event in self._pubsub.listen():
             type = event.pop("type")
-            if event["channel"] == self._finish_channel:
+            if type == 'message' and event["channel"] == self._finish_channel:
                 # For compatibility with older and newer versions of redis-py
                 is_subscribed = getattr(self._pubsub, 'subscription_count',
                                         getattr(self._pubsub, 'subscribed', False))
                 if is_subscribed:
                     self._pubsub.unsubscribe()
+                    if self.patterns:
+                        self._pubsub.punsubscribe()
             elif type == 'message':
-                self._handle_message(**event)
+                self._last_alive = time.time()
+                self._deliver(self._handle_message,
+                              (event['channel'], event['data']),
+                              event['channel'], event['data'])
             elif type == 'pmessage':
-                self._handle_pmessage(**event)
+                self._last_alive = time.time()
+                self._deliver(self._handle_pmessage,
+                              (event['pattern'], event['channel'],
+                               event['data']),
+                              event['channel'], event['data'])
+            elif self._gap_since is not None:
+                # resubscribed after a reconnect
+                self._catch_up()
+
+    def _deliver(self, func, args, channel=None, data=None):
+        """
+        Handle a received message or event now, or pass it to the
+        event buffer if there is one.
 
-        self.finished.set()
+        Messages on the control channels are always handled now, so
+        that they are never dropped or coalesced and the subscriptions
+        and cached configs of the listener stay up to date.
+
+        Arguments:
+            func    -- The function handling the message or event.
+            args    -- The arguments for the function.
+            channel -- The channel of a received message.
+            data    -- The contents of a received message.
+        """
+        if self.buffer is None or channel in CONTROL_CHANNELS:
+            func(*args)
+            return
+        key = None
+        if self.buffer.policy == EventBuffer.COALESCE and channel is not None:
+            key = self._coalesce_key(channel, data)
+        self.buffer.put(func, args, key)
+
+    def _coalesce_key(self, channel, data):
+        """
+        Return the key identifying messages about the same item on the
+        same channel, or None for messages that must not be coalesced.
+
+        Arguments:
+            channel -- The channel of the message.
+            data    -- The contents of the message.
+        """
+        route = self._routes.get(channel) or self._route(channel)
+        if route is None or route[1] is None or route[0] == self._on_reorder:
+            return None
+        if self._notice_format(route[1])[1] == BINARY:
+            id = frame_head(data)
+            if id is not None:
+                return channel, id
+        end = data.find('\x00')
+        return channel, data if end < 0 else data[:end]
+
+    def _reconnect(self):
+        """Restore a lost listener connection."""
+        reconnect(self._pubsub)
+
+    def _catch_up(self):
+        """
+        Replay the publishes to plain feeds that may have been missed
+        while the listener was disconnected, as publish events.
+
+        Only the feeds chosen by catch_up are replayed, and nothing is
+        done without publish handlers. The reads are pipelined, taking
+        a few round trips per Redis server however many feeds there are.
+
+        Items published around the time of the outage may be replayed
+        even if they were already received, and edits made during the
+        outage are replayed as publishes.
+        """
+        since = self._gap_since
+        self._gap_since = None
+        if not self.handlers.get('publish'):
+            return
+        names = [feed for feed in self._catch_up_feeds() if self.wants(feed)]
+        types = self.thoonk._config_values(names, 'type')
+        groups = {}
+        for feed, feed_type in zip(names, types):
+            if self.thoonk.feedtypes.get(feed_type) is feeds.Feed:
+                groups.setdefault(self.thoonk.redis_for(feed), []).append(feed)
+        for conn, group in groups.items():
+            keys = [self.thoonk.key_name(feed) for feed in group]
+            pipe = conn.pipeline(transaction=False)
+            for key in keys:
+                pipe.zrangebyscore('feed.ids:' + key, since, '+inf',
+                                   withscores=True)
+            published = [(feed, key, ids) for feed, key, ids
+                         in zip(group, keys, pipe.execute()) if ids]
+            if not published:
+                continue
+            for feed, key, ids in published:
+                pipe.hmget('feed.items:' + key, [id for id, _ in ids])
+            for (feed, key, ids), items in zip(published, pipe.execute()):
+                for (id, _), item in zip(ids, items):
+                    if item is not None:
+                        self._deliver(self.emit, ("publish", feed, item, id))
+
+    def _catch_up_feeds(self):
+        """
+        Return the names of the feeds chosen by catch_up, reading the
+        set of feeds only when catch_up is True or has glob patterns.
+        """
+        if self.catch_up is True:
+            return self.redis.smembers('feeds')
+        globs = [name for name in self.catch_up
+                 if any(c in name for c in '*?[')]
+        if not globs:
+            return self.catch_up
+        names = set(name for name in self.catch_up if name not in globs)
+        for feed in self.redis.smembers('feeds'):
+            for glob in globs:
+                if fnmatch.fnmatchcase(feed, glob):
+                    names.add(feed)
+                    break
+        return names
 
     def _handle_message(self, channel, data, pattern=None):
-        if channel == 'newfeed':
-            #feed created event
-            name, _ = data.split('\x00')
-            self._pubsub.subscribe(("feed.publish:"+name, "feed.edit:"+name,
-                "feed.retract:"+name, "feed.position:"+name, "job.finish:"+name))
+        """
+        Parse a received message and emit the matching event.
+
+        The parser and feed name for each channel are found with a
+        single dictionary lookup; see _route.
+
+        Arguments:
+            channel -- The channel the message was published to.
+            data    -- The message contents.
+            pattern -- The pattern the channel matched, if any.
+        """
+        route = self._routes.get(channel)
+        if route is None:
+            route = self._route(channel)
+            if route is None:
+                return
+        parser, feed = route
+        parser(feed, data)
+
+    def _route(self, channel):
+        """
+        Find and remember the parser and feed name for a channel.
+
+        Returns a (parser, feed) tuple, or None for unknown channels.
+
+        Arguments:
+            channel -- The name of the channel.
+        """
+        parser = self._parsers.get(channel)
+        if parser is not None:
+            feed = None
+        else:
+            prefix, _, feed = channel.partition(':')
+            parser = self._parsers.get(prefix + ':')
+            if parser is None:
+                return None
+            if self.thoonk.hash_tags:
+                feed = sharding.untag(feed)
+        route = self._routes[channel] = (parser, feed)
+        return route
+
+    def _on_newfeed(self, feed, data):
+        #feed created event
+        name, _ = data.split('\x00')
+        self._created([name])
+
+    def _on_newfeeds(self, feed, data):
+        #batch of feeds created event; it stands in for their conffeed
+        #events as well
+        names = data.split('\x00')[:-1]
+        for name in names:
+            self._types.pop(name, None)
+            self._formats.pop(name, None)
+        for name in self._created(names):
+            self.emit("config:"+name, None)
+
+    def _created(self, names):
+        """
+        Subscribe to the channels of newly created feeds and emit their
+        create events.
+
+        Returns the names of the feeds whose notices are received.
+
+        Arguments:
+            names -- The names of the feeds.
+        """
+        for name in names:
+            self.thoonk._forget_config(name)
+        if self.type_filter is not None:
+            self._load_types([name for name in names
+                              if name not in self._types])
+        wanted = [name for name in names if self.wants(name)]
+        if not self.patterns:
+            channels = []
+            for name in wanted:
+                channels.extend(self._feed_channels(name))
+            if channels:
+                self._pubsub.subscribe(channels)
+        for name in wanted:
             self.emit("create", name)
+        return wanted
 
-        elif channel == 'delfeed':
-            #feed destroyed event
-            name, _ = data.split('\x00')
-            try:
-                del self._feeds[name]
-            except:
-                pass
-            self.emit("delete", name)
+    def _on_delfeed(self, feed, data):
+        #feed destroyed event
+        name, _ = data.split('\x00')
+        self._deleted([name])
+
+    def _on_delfeeds(self, feed, data):
+        #batch of feeds destroyed event
+        self._deleted(data.split('\x00')[:-1])
 
-        elif channel == 'conffeed':
-            feed, _ = data.split('\x00', 1)
-            self.emit("config:"+feed, None)
+    def _deleted(self, names):
+        """
+        Forget deleted feeds and emit their delete events.
 
-        elif channel.startswith('feed.publish'):
-            #feed publish event
-            id, item = data.split('\x00', 1)
-            self.emit("publish", channel.split(':', 1)[-1], item, id)
+        Arguments:
+            names -- The names of the feeds.
+        """
+        for name in names:
+            wanted = self.wants(name)
+            self.thoonk._forget_config(name)
+            self._types.pop(name, None)
+            self._formats.pop(name, None)
+            self._lazy_batches.pop(name, None)
+            key_name = self.thoonk.key_name(name)
+            for prefix in FEED_CHANNEL_PREFIXES:
+                self._routes.pop(prefix + key_name, None)
+            if wanted:
+                self.emit("delete", name)
+
+    def _on_conffeed(self, feed, data):
+        name, _ = data.split('\x00', 1)
+        self.thoonk._forget_config(name)
+        self._types.pop(name, None)
+        self._formats.pop(name, None)
+        if self.wants(name):
+            self.emit("config:"+name, None)
+
+    def _on_publish(self, feed, data):
+        id, item = self._item_notice(feed, data)
+        self.emit("publish", feed, item, id)
+
+    def _on_edit(self, feed, data):
+        id, item = self._item_notice(feed, data)
+        self.emit("edit", feed, item, id)
+
+    def _item_notice(self, feed, data):
+        """
+        Parse a publish or edit notice into the item ID and contents.
 
-        elif channel.startswith('feed.edit'):
-            #feed publish event
-            id, item = data.split('\x00', 1)
-            self.emit("edit", channel.split(':', 1)[-1], item, id)
+        Notices are parsed according to the feed's 'notify' and
+        'framing' config fields. On a feed with binary framing, a frame
+        of three fields is an ID only notice and a frame of two fields
+        carries the item; notices that are not frames, such as those
+        sent before framing was turned on, are parsed as plain notices.
 
-        elif channel.startswith('feed.retract'):
-            self.emit("retract", channel.split(':', 1)[-1], data)
+        Arguments:
+            feed -- The name of the feed.
+            data -- The notice contents.
+        """
+        mode, framing = self._notice_format(feed)
+        if framing == BINARY:
+            fields = parse_frame(data)
+            if fields is not None and len(fields) == 3:
+                return self._lazy_item(feed, *map(str, fields))
+            if fields is not None and len(fields) == 2:
+                return map(str, fields)
+        if mode == ID_ONLY:
+            return self._lazy_item(feed, *data.split('\x00'))
+        return data.split('\x00', 1)
+
+    def _notice_format(self, feed):
+        """
+        Return the notice format of a feed, as a pair of its 'notify'
+        and 'framing' config fields. The values are cached until the
+        config changes.
 
-        elif channel.startswith('feed.position'):
-            id, rel_id = data.split('\x00', 1)
-            self.emit("position", channel.split(':', 1)[-1], id, rel_id)
+        Arguments:
+            feed -- The name of the feed.
+        """
+        format = self._formats.get(feed)
+        if format is None:
+            config = 'feed.config:%s' % self.thoonk.key_name(feed)
+            mode, framing = self.thoonk.redis_for(feed).hmget(
+                config, 'notify', 'framing')
+            format = self._formats[feed] = (mode or '', framing or '')
+        return format
+
+    def _lazy_item(self, feed, id, version, size):
+        """
+        Return the item ID and a LazyItem for the fields of an ID only
+        notice. The items of consecutive notices for a feed share a
+        LazyBatch, so they are fetched together when the first of them
+        is used.
 
-        elif channel.startswith('job.finish'):
+        Arguments:
+            feed    -- The name of the feed.
+            id      -- The ID of the item.
+            version -- The feed's publish counter from the notice.
+            size    -- The item size from the notice.
+        """
+        batch = self._lazy_batches.get(feed)
+        if batch is None or not batch.add(id):
+            batch = LazyBatch(self.thoonk.redis_for(feed),
+                              'feed.items:%s' % self.thoonk.key_name(feed))
+            batch.add(id)
+            self._lazy_batches[feed] = batch
+        return id, LazyItem(batch, id, int(version), int(size))
+
+    def _on_retract(self, feed, data):
+        self.emit("retract", feed, data)
+
+    def _on_position(self, feed, data):
+        id, rel_id = data.split('\x00', 1)
+        self.emit("position", feed, id, rel_id)
+
+    def _on_reorder(self, feed, data):
+        fields = data.split('\x00')
+        self.emit("reorder", feed, zip(fields[::2], fields[1::2]))
+
+    def _on_finish(self, feed, data):
+        fields = None
+        if self._notice_format(feed)[1] == BINARY:
+            fields = parse_frame(data)
+        if fields is not None and len(fields) == 2:
+            id, result = map(str, fields)
+        else:
             id, result = data.split('\x00', 1)
-            self.emit("finish", channel.split(':', 1)[-1], id, result)
+        self.emit("finish", feed, id, result)
+
+    def _handle_pmessage(self, pattern, channel, data):
+        """
+        Process a message received through a pattern subscription.
+
+        Arguments:
+            pattern -- The pattern that matched the channel.
+            channel -- The channel the message was published to.
+            data    -- The message contents.
+        """
+        if self.type_filter is not None or self._removed:
+            route = self._routes.get(channel) or self._route(channel)
+            if route is None or not self.wants(route[1]):
+                return
+        self._handle_message(channel, data, pattern)
+
+    def wants(self, feed):
+        """
+        Check if notices for a feed should be received.
+
+        Arguments:
+            feed -- The name of the feed.
+        """
+        if feed in self._removed:
+            return False
+        if feed in self._added:
+            return True
+        if not self._matches(feed):
+            return False
+        if self.type_filter is not None:
+            if feed not in self._types:
+                self._load_types([feed])
+            return self._types.get(feed) in self.type_filter
+        return True
+
+    def subscribe_feed(self, feed):
+        """
+        Start receiving notices for a feed.
+
+        Arguments:
+            feed -- The name of the feed.
+        """
+        self._removed.discard(feed)
+        self._added.add(feed)
+        if not (self.patterns and self._matches(feed)):
+            self._pubsub.subscribe(self._feed_channels(feed))
+
+    def unsubscribe_feed(self, feed):
+        """
+        Stop receiving notices for a feed.
+
+        Arguments:
+            feed -- The name of the feed.
+        """
+        self._added.discard(feed)
+        self._removed.add(feed)
+        if not (self.patterns and self._matches(feed)):
+            self._pubsub.unsubscribe(self._feed_channels(feed))
+
+    def _matches(self, feed):
+        """
+        Check if a feed name matches the listen_feeds filter.
+
+        Arguments:
+            feed -- The name of the feed.
+        """
+        if self.feed_filter is None:
+            return True
+        for glob in self.feed_filter:
+            if fnmatch.fnmatchcase(feed, glob):
+                return True
+        return False
+
+    def _load_types(self, feeds):
+        """
+        Fetch and remember the types of a set of feeds.
+
+        Arguments:
+            feeds -- The names of the feeds.
+        """
+        feeds = list(feeds)
+        types = self.thoonk._config_values(feeds, 'type')
+        for feed, feed_type in zip(feeds, types):
+            if feed_type is not None:
+                self._types[feed] = feed_type
+
+    def _feed_channels(self, feed):
+        """
+        Return the channels carrying notices for a feed.
+
+        Arguments:
+            feed -- The name of the feed.
+        """
+        name = self.thoonk.key_name(feed)
+        channels = [prefix + name for prefix in FEED_CHANNEL_PREFIXES]
+        for channel in channels:
+            self._route(channel)
+        return channels
 
     def emit(self, event, *args):
-        with self.lock:
-            for handler in self.handlers.get(event, []):
+        """
+        Call the handlers registered for an event.
+
+        Handlers are called on the listener thread, or passed to the
+        dispatcher if there is one, using the feed name as the ordering
+        key. The handler list is replaced rather than modified when
+        handlers are added or removed, so it is read without locking
+        and registering a handler never waits for a running handler.
+
+        Arguments:
+            event -- The name of the event.
+            args  -- The arguments to pass to the handlers.
+        """
+        handlers = self.handlers.get(event, ())
+        if not handlers:
+            return
+        if self.dispatcher:
+            key = event
+            if args and isinstance(args[0], basestring):
+                key = args[0]
+            self.dispatcher.dispatch(key, handlers, args)
+        else:
+            for handler in handlers:
                 handler(*args)
 
     def register_handler(self, name, handler):
@@ -386,9 +1447,7 @@ class ThoonkListener(threading.Thread):
             handler -- The function for handling the event.
         """
         with self.lock:
-            if name not in self.handlers:
-                self.handlers[name] = []
-            self.handlers[name].append(handler)
+            self.handlers[name] = self.handlers.get(name, ()) + (handler,)
 
     def remove_handler(self, name, handler):
         """
@@ -399,7 +1458,474 @@ class ThoonkListener(threading.Thread):
             handler -- The function for handling the event.
         """
         with self.lock:
+            handlers = list(self.handlers.get(name, ()))
             try:
-                self.handlers[name].remove(handler)
-            except (KeyError, ValueError):
-                pass
+                handlers.remove(handler)
+            except ValueError:
+                return
+            self.handlers[name] = tuple(handlers)
+        if isinstance(handler, BatchHandler):
+            handler.stop()
+
+
+class ListenerHub(threading.Thread):
+
+    """
+    A ListenerHub shares a single pubsub connection to a Redis server
+    between every listener in the process that asks for it.
+
+    Each listener gets a HubSubscription, which it uses in place of a
+    redis-py pubsub object. The hub subscribes to a channel or pattern
+    when the first listener asks for it and unsubscribes when the last
+    one lets go, and passes each received message to the listeners
+    subscribed to its channel or pattern.
+
+    Pubsub channels are shared by all databases of a Redis server, so
+    listeners for different databases share a hub too.
+
+    Methods:
+        get       -- Return the hub for a Redis server, creating it if
+                     needed.
+        subscribe -- Return a new HubSubscription for a listener.
+    """
+
+    _hubs = {}
+    _hubs_lock = threading.Lock()
+
+    @classmethod
+    def get(cls, connection_pool):
+        """
+        Return the running hub for a Redis server, starting one if
+        there is none.
+
+        Arguments:
+            connection_pool -- A connection pool for the Redis server,
+                               whose settings are used for the hub's
+                               own connection.
+        """
+        with cls._hubs_lock:
+            key = pool.server_key(connection_pool)
+            hub = cls._hubs.get(key)
+            if hub is None:
+                hub = cls._hubs[key] = cls(key, connection_pool)
+                hub.start()
+            return hub
+
+    def __init__(self, key, connection_pool):
+        """
+        Create a new hub. Use ListenerHub.get instead.
+
+        Arguments:
+            key             -- The key of the hub in the registry of hubs.
+            connection_pool -- A connection pool for the Redis server.
+        """
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.key = key
+        self.redis = redis.StrictRedis(
+            connection_pool=pool.clone_pool(connection_pool, 1))
+        self.lock = threading.Lock()
+        self._channels = {}
+        self._patterns = {}
+        self._subscriptions = set()
+        self._connected = False
+        self._closed = False
+        self._pubsub = self.redis.pubsub()
+        resubscribe = self._pubsub.on_connect
+        def on_connect(connection):
+            resubscribe(connection)
+            if self._connected:
+                for subscription in list(self._subscriptions):
+                    subscription.reconnected()
+            self._connected = True
+        self._pubsub.on_connect = on_connect
+        # keep the connection subscribed while the hub is in use
+        self._pubsub.subscribe('listenerhub_%s' % uuid.uuid4().hex)
+
+    def subscribe(self, messages=None):
+        """
+        Return a new HubSubscription using this hub.
+
+        Arguments:
+            messages -- Optional queue for the received messages.
+        """
+        subscription = HubSubscription(self, messages)
+        with self.lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def run(self):
+        """Pass received messages to subscriptions until closed."""
+        while True:
+            try:
+                for event in self._pubsub.listen():
+                    if event['type'] == 'message':
+                        targets = self._channels.get(event['channel'], ())
+                    elif event['type'] == 'pmessage':
+                        targets = self._patterns.get(event['pattern'], ())
+                    else:
+                        continue
+                    for subscription in targets:
+                        subscription.queue.put(dict(event))
+                break
+            except redis.exceptions.ConnectionError:
+                if self._closed:
+                    break
+                reconnect(self._pubsub)
+
+    def _add(self, subscription, names, table, command):
+        """
+        Add a subscription to a set of channels or patterns.
+
+        Arguments:
+            subscription -- The HubSubscription.
+            names        -- The channels or patterns.
+            table        -- The hub's channel or pattern table.
+            command      -- The pubsub method for subscribing.
+        """
+        with self.lock:
+            new = []
+            for name in names:
+                targets = table.get(name, frozenset())
+                if not targets:
+                    new.append(name)
+                table[name] = targets | set([subscription])
+            if new:
+                command(new)
+
+    def _remove(self, subscription, names, table, command):
+        """
+        Remove a subscription from a set of channels or patterns.
+
+        Arguments:
+            subscription -- The HubSubscription.
+            names        -- The channels or patterns.
+            table        -- The hub's channel or pattern table.
+            command      -- The pubsub method for unsubscribing.
+        """
+        with self.lock:
+            unused = []
+            for name in names:
+                targets = table.get(name, frozenset()) - set([subscription])
+                if targets:
+                    table[name] = targets
+                elif table.pop(name, None):
+                    unused.append(name)
+            if unused:
+                command(unused)
+
+    def _release(self, subscription):
+        """
+        Forget a subscription that no longer listens to anything,
+        closing the hub when it was the last one.
+
+        The hub's thread ends once the server confirms it has
+        unsubscribed, after which its connection is closed.
+
+        Arguments:
+            subscription -- The HubSubscription.
+        """
+        with self._hubs_lock:
+            with self.lock:
+                self._subscriptions.discard(subscription)
+                if self._subscriptions:
+                    return
+                if self._hubs.get(self.key) is self:
+                    del self._hubs[self.key]
+                self._closed = True
+                self._pubsub.unsubscribe()
+        if threading.current_thread() is not self:
+            self.join(1)
+        self._pubsub.close()
+        self.redis.connection_pool.disconnect()
+
+
+class HubSubscription(object):
+
+    """
+    A HubSubscription stands in for a redis-py pubsub object for a
+    listener that shares the connection of a ListenerHub.
+
+    It supports the subset of the pubsub API used by ThoonkListener.
+    Messages for its channels and patterns are queued by the hub's
+    thread and returned by listen(), which ends once the subscription
+    has unsubscribed from everything.
+
+    Attributes:
+        hub        -- The ListenerHub.
+        queue      -- The queue of received messages.
+        channels   -- The set of subscribed channels.
+        patterns   -- The set of subscribed patterns.
+        subscribed -- True while any channel or pattern is subscribed.
+    """
+
+    def __init__(self, hub, messages=None):
+        """
+        Create a new subscription. Use ListenerHub.subscribe instead.
+
+        Arguments:
+            hub      -- The ListenerHub.
+            messages -- Optional queue for the received messages, which
+                        may be shared with other subscriptions.
+        """
+        self.hub = hub
+        self.queue = messages if messages is not None else queue.Queue()
+        self.channels = set()
+        self.patterns = set()
+
+    @property
+    def subscribed(self):
+        return bool(self.channels or self.patterns)
+
+    def on_connect(self, connection):
+        """
+        Called after the hub's connection has been restored, once the
+        hub has resubscribed. Meant to be replaced.
+
+        Arguments:
+            connection -- The restored connection.
+        """
+        pass
+
+    def reconnected(self):
+        """
+        Tell the listener that the hub's connection was restored, in
+        the same way a redis-py pubsub object would.
+        """
+        self.on_connect(None)
+        self.queue.put({'type': 'subscribe', 'pattern': None,
+                        'channel': None, 'data': None})
+
+    def subscribe(self, channels):
+        """
+        Subscribe to one or more channels.
+
+        Arguments:
+            channels -- A channel name or a list of channel names.
+        """
+        channels = _as_list(channels)
+        self.channels.update(channels)
+        self.hub._add(self, channels, self.hub._channels,
+                      self.hub._pubsub.subscribe)
+
+    def psubscribe(self, patterns):
+        """
+        Subscribe to one or more channel patterns.
+
+        Arguments:
+            patterns -- A pattern or a list of patterns.
+        """
+        patterns = _as_list(patterns)
+        self.patterns.update(patterns)
+        self.hub._add(self, patterns, self.hub._patterns,
+                      self.hub._pubsub.psubscribe)
+
+    def unsubscribe(self, channels=None):
+        """
+        Unsubscribe from some or all channels.
+
+        Arguments:
+            channels -- Optional channel name or list of channel names.
+                        Defaults to every subscribed channel.
+        """
+        channels = self.channels if channels is None else _as_list(channels)
+        channels = self.channels & set(channels)
+        self.channels -= channels
+        self.hub._remove(self, channels, self.hub._channels,
+                         self.hub._pubsub.unsubscribe)
+        self._check_done()
+
+    def punsubscribe(self, patterns=None):
+        """
+        Unsubscribe from some or all channel patterns.
+
+        Arguments:
+            patterns -- Optional pattern or list of patterns. Defaults
+                        to every subscribed pattern.
+        """
+        patterns = self.patterns if patterns is None else _as_list(patterns)
+        patterns = self.patterns & set(patterns)
+        self.patterns -= patterns
+        self.hub._remove(self, patterns, self.hub._patterns,
+                         self.hub._pubsub.punsubscribe)
+        self._check_done()
+
+    def listen(self):
+        """Yield received messages until unsubscribed from everything."""
+        while True:
+            event = self.queue.get()
+            if event is None:
+                return
+            yield event
+
+    def _check_done(self):
+        """End listen() once nothing is subscribed."""
+        if not self.subscribed:
+            self.hub._release(self)
+            self.queue.put(None)
+
+
+class ShardedSubscription(object):
+
+    """
+    A ShardedSubscription stands in for a redis-py pubsub object for
+    the listener of a Thoonk instance whose feeds are spread over
+    several Redis servers.
+
+    It holds a HubSubscription for each server, all passing messages
+    to one queue. The channels of a feed are subscribed on the server
+    holding the feed, other channels on the main server, and patterns
+    on every shard.
+
+    Attributes:
+        thoonk     -- The main Thoonk object.
+        queue      -- The queue of received messages.
+        subscribed -- True while any channel or pattern is subscribed.
+    """
+
+    def __init__(self, thoonk, route):
+        """
+        Create a new subscription.
+
+        Arguments:
+            thoonk -- The main Thoonk object.
+            route  -- A function returning a (parser, feed) tuple for a
+                      channel, or None for channels of no feed.
+        """
+        self.thoonk = thoonk
+        self.route = route
+        self.queue = queue.Queue()
+        self._subscriptions = {}
+
+    @property
+    def subscribed(self):
+        return any(subscription.subscribed
+                   for subscription in self._subscriptions.values())
+
+    def on_connect(self, connection):
+        """
+        Called after the connection to a server has been restored.
+        Meant to be replaced.
+
+        Arguments:
+            connection -- The restored connection.
+        """
+        pass
+
+    def subscribe(self, channels):
+        """
+        Subscribe to one or more channels.
+
+        Arguments:
+            channels -- A channel name or a list of channel names.
+        """
+        for conn, names in self._group(_as_list(channels)).items():
+            self._subscription(conn).subscribe(names)
+
+    def psubscribe(self, patterns):
+        """
+        Subscribe to one or more channel patterns on every shard.
+
+        Arguments:
+            patterns -- A pattern or a list of patterns.
+        """
+        for conn, _ in self.thoonk.shards.nodes.values():
+            self._subscription(conn).psubscribe(patterns)
+
+    def unsubscribe(self, channels=None):
+        """
+        Unsubscribe from some or all channels.
+
+        Arguments:
+            channels -- Optional channel name or list of channel names.
+                        Defaults to every subscribed channel.
+        """
+        if channels is None:
+            for subscription in self._subscriptions.values():
+                if subscription.subscribed:
+                    subscription.unsubscribe()
+            return
+        for conn, names in self._group(_as_list(channels)).items():
+            subscription = self._subscriptions.get(self._key(conn))
+            if subscription is not None and subscription.subscribed:
+                subscription.unsubscribe(names)
+
+    def punsubscribe(self, patterns=None):
+        """
+        Unsubscribe from some or all channel patterns.
+
+        Arguments:
+            patterns -- Optional pattern or list of patterns. Defaults
+                        to every subscribed pattern.
+        """
+        for subscription in self._subscriptions.values():
+            if subscription.subscribed:
+                subscription.punsubscribe(patterns)
+
+    def listen(self):
+        """Yield received messages until unsubscribed from everything."""
+        while True:
+            event = self.queue.get()
+            if event is None:
+                # one server no longer has subscriptions
+                if self.subscribed:
+                    continue
+                return
+            yield event
+
+    def _group(self, channels):
+        """
+        Group channels by the Redis connection of their server.
+
+        Arguments:
+            channels -- The channel names.
+        """
+        groups = {}
+        for channel in channels:
+            route = self.route(channel)
+            if route is None or route[1] is None:
+                conn = self.thoonk.redis
+            else:
+                conn = self.thoonk.redis_for(route[1])
+            groups.setdefault(conn, []).append(channel)
+        return groups
+
+    def _key(self, conn):
+        """
+        Return the key of the server of a Redis connection.
+
+        Arguments:
+            conn -- The Redis connection.
+        """
+        return pool.server_key(conn.connection_pool)
+
+    def _subscription(self, conn):
+        """
+        Return the HubSubscription for the server of a connection,
+        starting a new one if there is none or the last one let go
+        of its hub.
+
+        Arguments:
+            conn -- The Redis connection.
+        """
+        key = self._key(conn)
+        subscription = self._subscriptions.get(key)
+        if subscription is None or not subscription.subscribed:
+            hub = ListenerHub.get(conn.connection_pool)
+            subscription = hub.subscribe(self.queue)
+            subscription.on_connect = lambda connection: \
+                self.on_connect(connection)
+            self._subscriptions[key] = subscription
+        return subscription
+
+
+def _as_list(names):
+    """
+    Return a list of channel or pattern names.
+
+    Arguments:
+        names -- A single name, or a sequence of names.
+    """
+    if isinstance(names, basestring):
+        return [names]
+    return list(names)
@@ -0,0 +1,275 @@
+"""
+    Written by Nathan Fritz and Lance Stout. Copyright 2011 by &yet, LLC.
+    Released under the terms of the MIT License
+"""
+
+import math
+import threading
+import time
+import uuid
+
+from thoonk import scripts
+
+
+# Become or remain the leader of a scheduler.
+#
+# KEYS: scheduler.leader:[name]
+# ARGV: instance, lease (ms)
+SCHEDULER_LEAD = scripts.register('scheduler_lead', """
+local holder = redis.call('get', KEYS[1])
+if not holder or holder == ARGV[1] then
+    redis.call('psetex', KEYS[1], ARGV[2], ARGV[1])
+    return 1
+end
+return 0
+""")
+
+# Give up the leadership of a scheduler.
+#
+# KEYS: scheduler.leader:[name]
+# ARGV: instance
+SCHEDULER_RESIGN = scripts.register('scheduler_resign', """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    redis.call('del', KEYS[1])
+end
+""")
+
+# Claim the schedules that are due and advance them to their next
+# occurrence.
+#
+# KEYS: scheduler.leader:[name], scheduler.due:[name],
+#       scheduler.feeds:[name], scheduler.items:[name],
+#       scheduler.intervals:[name]
+# ARGV: instance, now (ms), batch size
+#
+# Only the current leader may fire schedules. The next occurrence is
+# computed from the previous due time rather than the current time, so
+# schedules do not drift; occurrences missed while no scheduler was
+# running are skipped instead of fired in a burst. Returns a flat list
+# of schedule ID, feed and item triples.
+SCHEDULER_TICK = scripts.register('scheduler_tick', """
+if redis.call('get', KEYS[1]) ~= ARGV[1] then
+    return {}
+end
+local now = tonumber(ARGV[2])
+local due = redis.call('zrangebyscore', KEYS[2], '-inf', now,
+                       'WITHSCORES', 'LIMIT', 0, tonumber(ARGV[3]))
+local fired = {}
+for i = 1, #due, 2 do
+    local id = due[i]
+    local at = tonumber(due[i + 1])
+    local interval = tonumber(redis.call('hget', KEYS[5], id))
+    local next_at = at + interval * (math.floor((now - at) / interval) + 1)
+    redis.call('zadd', KEYS[2], next_at, id)
+    table.insert(fired, id)
+    table.insert(fired, redis.call('hget', KEYS[3], id))
+    table.insert(fired, redis.call('hget', KEYS[4], id))
+end
+return fired
+""")
+
+
+class Scheduler(threading.Thread):
+
+    """
+    A Scheduler periodically adds jobs to Job feeds.
+
+    Recurring job definitions are stored in Redis, so any number of
+    scheduler processes may share them. Only one scheduler instance,
+    the leader, fires schedules at a time; the others wait to take
+    over if the leader stops renewing its lease.
+
+    Each schedule repeats at a fixed interval, aligned to multiples of
+    the interval since the Unix epoch unless a start time is given
+    (an hourly schedule fires on the hour). The index of next due times
+    is a sorted set, so finding due schedules costs O(log n) regardless
+    of how many schedules exist.
+
+    Occurrences are delivered at most once: a schedule is advanced
+    before its job is added, so a scheduler crashing in between loses
+    that occurrence rather than firing it twice.
+
+    Redis Keys Used:
+        scheduler.due:[name]       -- A sorted set of schedule IDs
+                                      scored by next due time.
+        scheduler.feeds:[name]     -- A hash of Job feed names keyed
+                                      by schedule ID.
+        scheduler.items:[name]     -- A hash of job contents keyed by
+                                      schedule ID.
+        scheduler.intervals:[name] -- A hash of intervals in ms keyed
+                                      by schedule ID.
+        scheduler.leader:[name]    -- The expiring ID of the leading
+                                      scheduler instance.
+
+    Methods:
+        add           -- Add a recurring job.
+        finish        -- Stop the scheduler thread.
+        get_schedules -- Return all recurring job definitions.
+        is_leader     -- Try to become or remain the leader.
+        remove        -- Remove a recurring job.
+        resign        -- Give up leadership.
+        run           -- Fire due schedules until finished.
+        tick          -- Fire a batch of due schedules once.
+    """
+
+    def __init__(self, thoonk, name='default', lease=10, batch_size=1000):
+        """
+        Create a new scheduler.
+
+        Arguments:
+            thoonk     -- The main Thoonk object.
+            name       -- The name of the set of schedules to manage.
+            lease      -- Seconds a leader stays elected without
+                          renewing its lease.
+            batch_size -- Maximum number of schedules fired per tick.
+        """
+        threading.Thread.__init__(self)
+        self.thoonk = thoonk
+        self.redis = thoonk.redis
+        self.name = name
+        self.lease = lease
+        self.batch_size = batch_size
+        self.instance = uuid.uuid4().hex
+        self.finished = threading.Event()
+        self.daemon = True
+
+        key_name = thoonk.key_name(name)
+        self.scheduler_due = 'scheduler.due:%s' % key_name
+        self.scheduler_feeds = 'scheduler.feeds:%s' % key_name
+        self.scheduler_items = 'scheduler.items:%s' % key_name
+        self.scheduler_intervals = 'scheduler.intervals:%s' % key_name
+        self.scheduler_leader = 'scheduler.leader:%s' % key_name
+
+    def add(self, feed, item, interval, id=None, start=None):
+        """
+        Add or replace a recurring job.
+
+        Returns the schedule's ID.
+
+        Arguments:
+            feed     -- The name of the Job feed to add jobs to.
+            item     -- The content of each job.
+            interval -- Seconds between occurrences.
+            id       -- Optional ID for the schedule. An existing
+                        schedule with the same ID is replaced.
+            start    -- Optional Unix time of the first occurrence.
+                        Defaults to the next multiple of the interval.
+        """
+        if id is None:
+            id = uuid.uuid4().hex
+        interval = int(interval * 1000)
+        if interval <= 0:
+            raise ValueError('Schedule interval must be positive')
+        if start is None:
+            now = int(time.time() * 1000)
+            start = int(math.ceil(now / float(interval))) * interval
+        else:
+            start = int(start * 1000)
+
+        pipe = self.redis.pipeline()
+        pipe.hset(self.scheduler_feeds, id, feed)
+        pipe.hset(self.scheduler_items, id, item)
+        pipe.hset(self.scheduler_intervals, id, interval)
+        pipe.zadd(self.scheduler_due, start, id)
+        pipe.execute()
+        return id
+
+    def remove(self, id):
+        """
+        Remove a recurring job.
+
+        Arguments:
+            id -- The ID of the schedule.
+        """
+        pipe = self.redis.pipeline()
+        pipe.zrem(self.scheduler_due, id)
+        pipe.hdel(self.scheduler_feeds, id)
+        pipe.hdel(self.scheduler_items, id)
+        pipe.hdel(self.scheduler_intervals, id)
+        pipe.execute()
+
+    def get_schedules(self):
+        """
+        Return all recurring job definitions.
+
+        Returns a dictionary keyed by schedule ID of dictionaries with
+        the 'feed', 'item', 'interval' (seconds) and 'next' (Unix time)
+        of each schedule.
+        """
+        pipe = self.redis.pipeline()
+        pipe.hgetall(self.scheduler_feeds)
+        pipe.hgetall(self.scheduler_items)
+        pipe.hgetall(self.scheduler_intervals)
+        pipe.zrange(self.scheduler_due, 0, -1, withscores=True)
+        feeds, items, intervals, due = pipe.execute()
+        schedules = {}
+        for id, at in due:
+            schedules[id] = {'feed': feeds.get(id),
+                             'item': items.get(id),
+                             'interval': int(intervals.get(id, 0)) / 1000.0,
+                             'next': at / 1000.0}
+        return schedules
+
+    def is_leader(self):
+        """
+        Try to become the leader, or renew the lease if already leading.
+
+        Returns True if this instance is the leader.
+        """
+        return bool(SCHEDULER_LEAD.run(self.redis, 1,
+                                       self.scheduler_leader,
+                                       self.instance,
+                                       int(self.lease * 1000)))
+
+    def resign(self):
+        """Give up leadership, if held, so another instance may lead."""
+        SCHEDULER_RESIGN.run(self.redis, 1, self.scheduler_leader,
+                             self.instance)
+
+    def tick(self):
+        """
+        Add jobs for a batch of the schedules that are due.
+
+        Nothing is fired unless this instance is the leader.
+
+        Returns the number of jobs added.
+        """
+        fired = SCHEDULER_TICK.run(self.redis, 5,
+                                   self.scheduler_leader,
+                                   self.scheduler_due,
+                                   self.scheduler_feeds,
+                                   self.scheduler_items,
+                                   self.scheduler_intervals,
+                                   self.instance,
+                                   int(time.time() * 1000),
+                                   self.batch_size)
+        jobs = {}
+        for i in range(0, len(fired), 3):
+            jobs.setdefault(fired[i + 1], []).append(fired[i + 2])
+        for feed, items in jobs.items():
+            self.thoonk.job(feed).put_many(items)
+        return len(fired) // 3
+
+    def finish(self):
+        """Stop the scheduler thread and give up leadership."""
+        self.finished.set()
+
+    def run(self):
+        """
+        Fire due schedules until finished.
+
+        While leading, the scheduler sleeps until the next schedule is
+        due, waking often enough to renew its lease. Otherwise it checks
+        periodically whether the leader has gone away.
+        """
+        while not self.finished.isSet():
+            wait = self.lease / 3.0
+            if self.is_leader():
+                if self.tick() >= self.batch_size:
+                    continue
+                due = self.redis.zrange(self.scheduler_due, 0, 0,
+                                        withscores=True)
+                if due:
+                    wait = min(wait, max(0, due[0][1] / 1000.0 - time.time()))
+            self.finished.wait(wait)
+        self.resign()
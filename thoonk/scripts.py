@@ -0,0 +1,149 @@
+"""
+    Written by Nathan Fritz and Lance Stout. Copyright 2011 by &yet, LLC.
+    Released under the terms of the MIT License
+"""
+
+import hashlib
+import threading
+import time
+
+import redis.exceptions
+
+
+# Every registered script, by name.
+SCRIPTS = {}
+
+_lock = threading.Lock()
+
+
+class Script(object):
+
+    """
+    A Script is a Lua script run on the Redis server by its SHA1 digest
+    with EVALSHA, so the source is only sent when the server does not
+    have the script cached yet, such as after a restart or failover.
+
+    Each script counts its calls, the calls that had to send the source
+    again, the calls that failed, and the time spent in them.
+
+    Attributes:
+        name   -- The name of the script in the registry.
+        source -- The Lua source of the script.
+        sha    -- The SHA1 digest of the source.
+
+    Methods:
+        run   -- Run the script.
+        stats -- Return the counters of the script.
+        reset -- Clear the counters of the script.
+    """
+
+    def __init__(self, name, source):
+        """
+        Create a new script. Use register instead.
+
+        Arguments:
+            name   -- The name of the script.
+            source -- The Lua source of the script.
+        """
+        self.name = name
+        self.source = source
+        self.sha = hashlib.sha1(source).hexdigest()
+        self.reset()
+
+    def run(self, client, numkeys, *keys_and_args):
+        """
+        Run the script and return its result.
+
+        The arguments are the same as those of EVAL, after the script.
+        If the server does not know the script, it is sent with EVAL,
+        which also caches it for later calls.
+
+        Arguments:
+            client        -- The Redis connection to run the script on.
+            numkeys       -- The number of keys in keys_and_args.
+            keys_and_args -- The keys followed by the other arguments.
+        """
+        start = time.time()
+        reloaded = False
+        try:
+            try:
+                return client.evalsha(self.sha, numkeys, *keys_and_args)
+            except redis.exceptions.NoScriptError:
+                reloaded = True
+                return client.eval(self.source, numkeys, *keys_and_args)
+        except Exception:
+            with _lock:
+                self._errors += 1
+            raise
+        finally:
+            elapsed = time.time() - start
+            with _lock:
+                self._calls += 1
+                self._reloads += reloaded
+                self._time += elapsed
+                self._max_time = max(self._max_time, elapsed)
+
+    def stats(self):
+        """
+        Return a dictionary with the number of 'calls', 'reloads' and
+        'errors', and the 'total_time', 'mean_time' and 'max_time' in
+        seconds spent running the script.
+        """
+        with _lock:
+            return {'calls': self._calls,
+                    'reloads': self._reloads,
+                    'errors': self._errors,
+                    'total_time': self._time,
+                    'mean_time': self._time / self._calls if self._calls
+                                 else 0.0,
+                    'max_time': self._max_time}
+
+    def reset(self):
+        """Clear the counters of the script."""
+        with _lock:
+            self._calls = 0
+            self._reloads = 0
+            self._errors = 0
+            self._time = 0.0
+            self._max_time = 0.0
+
+
+def register(name, source):
+    """
+    Add a Lua script to the registry and return it as a Script.
+
+    Arguments:
+        name   -- A unique name for the script, used in its stats.
+        source -- The Lua source of the script.
+    """
+    script = Script(name, source)
+    with _lock:
+        if name in SCRIPTS:
+            raise ValueError('Script already registered: %s' % name)
+        SCRIPTS[name] = script
+    return script
+
+
+def load(client):
+    """
+    Load every registered script into a Redis server's script cache,
+    so their first calls do not need to send the source.
+
+    Arguments:
+        client -- The Redis connection to load the scripts with.
+    """
+    pipe = client.pipeline(transaction=False)
+    for script in SCRIPTS.values():
+        pipe.script_load(script.source)
+    pipe.execute()
+
+
+def stats():
+    """Return the stats of every registered script, by name."""
+    return dict((name, script.stats()) for name, script in SCRIPTS.items())
+
+
+def reset_stats():
+    """Clear the counters of every registered script."""
+    for script in SCRIPTS.values():
+        script.reset()
@@ -0,0 +1,111 @@
+"""
+    Written by Nathan Fritz and Lance Stout. Copyright 2011 by &yet, LLC.
+    Released under the terms of the MIT License
+"""
+
+import bisect
+import hashlib
+import struct
+
+
+# Number of points each node has on a hash ring. More points spread
+# feeds more evenly between nodes.
+RING_POINTS = 160
+
+
+def node_name(pool):
+    """
+    Return a name for the Redis server and database a connection pool
+    connects to, which is the same in every process.
+
+    Arguments:
+        pool -- The connection pool.
+    """
+    kwargs = pool.connection_kwargs
+    if 'path' in kwargs:
+        return '%s/%s' % (kwargs['path'], kwargs.get('db', 0))
+    return '%s:%s/%s' % (kwargs.get('host', 'localhost'),
+                         kwargs.get('port', 6379), kwargs.get('db', 0))
+
+
+def tag(name):
+    """
+    Return a name wrapped in braces, so that Redis Cluster places every
+    key containing it in the same hash slot.
+
+    Arguments:
+        name -- The name of a feed or scheduler.
+    """
+    return '{%s}' % name
+
+
+def untag(name):
+    """
+    Return a name without the braces added by tag.
+
+    Arguments:
+        name -- A name, with or without braces.
+    """
+    if name.startswith('{') and name.endswith('}'):
+        return name[1:-1]
+    return name
+
+
+class HashRing(object):
+
+    """
+    A HashRing assigns feeds to Redis nodes by consistent hashing.
+
+    Each node is placed at many points on a ring of hash values, and a
+    feed belongs to the node at the first point after the hash of its
+    name. Adding or removing a node only moves the feeds between that
+    node and its neighbours on the ring, so most feeds stay where they
+    are.
+
+    Attributes:
+        nodes -- A dictionary mapping node names to nodes.
+
+    Methods:
+        get -- Return the node for a feed.
+    """
+
+    def __init__(self, nodes, points=RING_POINTS):
+        """
+        Create a new ring.
+
+        Arguments:
+            nodes  -- A dictionary mapping node names to nodes. The
+                      names decide the placement of feeds, so they must
+                      be the same in every process.
+            points -- The number of points for each node.
+        """
+        self.nodes = dict(nodes)
+        ring = []
+        for name in self.nodes:
+            for i in range(points):
+                ring.append((self._hash('%s-%s' % (name, i)), name))
+        ring.sort()
+        self._hashes = [point for point, name in ring]
+        self._names = [name for point, name in ring]
+
+    def get(self, feed):
+        """
+        Return the node a feed belongs to.
+
+        Arguments:
+            feed -- The name of the feed.
+        """
+        index = bisect.bisect(self._hashes, self._hash(feed))
+        return self.nodes[self._names[index % len(self._names)]]
+
+    @staticmethod
+    def _hash(value):
+        """
+        Return the position of a value on the ring.
+
+        Arguments:
+            value -- The string to hash.
+        """
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        return struct.unpack('>I', hashlib.md5(value).digest()[:4])[0]